@@ -0,0 +1,192 @@
+"""
+Deterministic input corpora for the backend microbenchmarks.
+The shapes follow what production traffic actually sends through each function:
+button clicks and free-text questions for the routers, policy_catalog rows with
+Decimal columns, and 10-message chat histories whose bot turns carry
+the multi-line quote tables and policy detail dumps.
+"""
+import json
+import random
+from decimal import Decimal
+
+SEED = 1234
+
+PROVIDERS = ["HDFC Life", "ICICI Prudential", "LIC", "Max Life", "SBI Life", "Tata AIA"]
+PLANS = ["Click 2 Protect", "Sanchay Plus", "Jeevan Anand", "Smart Wealth", "Guaranteed Income", "Child Future"]
+POLICY_TYPES = ["term", "endowment", "ULIP", "retirement", "child", "money back"]
+EMPLOYMENT = ["Salaried", "Self-Employed", "Other"]
+INCOMES = ["Less than 5 Lakhs", "5-10 Lakhs", "10-20 Lakhs", "20+ Lakhs"]
+QUESTIONS = [
+    "what is the claim settlement ratio of this plan?",
+    "does it cover critical illness?",
+    "which is better for me, term or endowment?",
+    "can I pay the premium monthly?",
+    "what are the tax benefits under 80C?",
+    "insurance policy",
+]
+
+BUTTON_CLICKS = [
+    "I have an existing policy", "I do not have an existing policy", "1. Salaried", "2. Self-Employed",
+    "Other", "Less than 5 Lakhs", "5-10 Lakhs", "10-20 Lakhs", "20+ Lakhs", "Get Quotation",
+    "Show Details", "Proceed to Buy", "Apply for Smart Wealth", "Get More Details", "compare these two",
+]
+FREE_TEXT = QUESTIONS + [
+    "Ravi Kumar", "ravi.kumar@example.com", "35", "I want a 1 crore cover for 30 years",
+    "tell me about riders", "explain the difference between term and ULIP",
+    "should i take the monthly payout option", "ok thanks", "hello", "my budget is 25000 a year",
+]
+NUMERIC_TEXTS = [
+    "5 lakhs", "₹ 1,50,000", "2 crore", "1.5 cr", "35", "35 years", "Rs. 25,000", "10 lakh rupees",
+    "20+ Lakhs", "abc", "", "50000", "₹75000 per annum", "0.5 crore", "30",
+]
+NUMERIC_FIELDS = ["age", "income", "budget", "term", "coverage", "amount"]
+PAYOUT_FREQUENCIES = ["Monthly", "Quarterly", "Half-Yearly", "Yearly", "Lump Sum"]
+
+
+def router_queries(count: int = 500) -> list:
+    rng = random.Random(SEED)
+    pool = BUTTON_CLICKS + FREE_TEXT
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def numeric_inputs(count: int = 500) -> list:
+    rng = random.Random(SEED)
+    return [(rng.choice(NUMERIC_TEXTS), rng.choice(NUMERIC_FIELDS)) for _ in range(count)]
+
+
+def premium_inputs(count: int = 200) -> list:
+    rng = random.Random(SEED)
+    inputs = []
+    for _ in range(count):
+        policy_term = rng.choice([10, 15, 20, 25, 30])
+        driven_by_coverage = rng.random() < 0.7
+        inputs.append({
+            "plan_type": rng.choice(["Wealth Builder", "Child Future", "Retirement Income", "Monthly Income", "Endowment Plus"]),
+            "policy_term": policy_term,
+            "premium_payment_term": rng.choice([policy_term, max(5, policy_term - 5)]),
+            "payout_frequency": rng.choice(PAYOUT_FREQUENCIES),
+            "dob": f"{rng.randint(1960, 2004)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "coverage": rng.randrange(10, 200) * 100000 if driven_by_coverage else None,
+            "budget": None if driven_by_coverage else rng.randrange(10, 100) * 1000,
+        })
+    return inputs
+
+
+def catalog_rows(count: int = 500) -> list:
+    """Rows shaped like sqlconnect.get_policy_catalog_chunk returns them."""
+    from sqlconnect import POLICY_CATALOG_COLUMNS
+
+    rng = random.Random(SEED)
+    rows = []
+    for i in range(count):
+        coverage_min = rng.randrange(5, 50) * 100000
+        premium_min = rng.randrange(2, 20) * 1000
+        rows.append(dict(zip(POLICY_CATALOG_COLUMNS, (
+            f"POL{i:05d}",
+            f"{rng.choice(PLANS)} {i}",
+            rng.choice(PROVIDERS),
+            rng.choice(POLICY_TYPES),
+            coverage_min,
+            coverage_min * rng.randint(2, 20),
+            5,
+            rng.choice([20, 30, 40]),
+            premium_min,
+            premium_min * rng.randint(2, 10),
+            18,
+            rng.choice([55, 60, 65]),
+            Decimal(f"{rng.uniform(95, 99.5):.2f}"),
+            "Accidental death benefit, Critical illness, Waiver of premium",
+            "Suicide within 12 months, Pre-existing conditions not disclosed",
+            "Section 80C and 10(10D)",
+            rng.choice(["Lump Sum", "Monthly Income", "Lump Sum + Monthly Income"]),
+            "Guaranteed maturity benefit with loyalty additions and a life cover throughout the term.",
+            "Intimate the claim online, submit documents, settlement within 30 days.",
+        ))))
+    return rows
+
+
+def _message(message_type: str, content: str) -> dict:
+    # The nested {type, data} shape of langchain's messages_to_dict, which serialization.message_to_dict
+    # stores in user_context.chat_history (BaseMessage.dict() gives the older flat shape)
+    return {
+        "type": message_type,
+        "data": {"content": content},
+    }
+
+
+QUOTE_ANSWER = (
+    "Here is your personalized quote (Quote ID: QUOTE-20250701-101500-4821):\n"
+    "- **Plan Selected:** Wealth Builder\n"
+    "- **Sum Assured:** ₹5,000,000.00\n"
+    "- **Policy Term:** 20 years\n"
+    "- **Premium Payment Term:** 15 years\n"
+    "- **Premium:** ₹5,940.00\n"
+    "- **GST (18%):** ₹1,069.20\n"
+    "- **Total Payable Premium:** ₹7,009.20 (Yearly)"
+)
+DETAILS_ANSWER = (
+    "Here are the key details for **Smart Wealth 12**:\n\n"
+    "**Policy Name**: Smart Wealth 12\n**Provider**: HDFC Life\n**Type**: endowment\n"
+    "**Maximum Coverage**: ₹20,000,000\n**Maximum Premium**: ₹150,000\n**Maximum Entry Age**: 60\n"
+    "**Claim Settlement Ratio**: 98.66\n**Tax Benefits**: Section 80C and 10(10D)\n"
+    "**Benefits**: Guaranteed maturity benefit with loyalty additions and a life cover throughout the term."
+)
+
+
+def chat_history(turns: int = 5) -> list:
+    """The 5-turn window ImprovedChatBot persists, with realistic bot payloads."""
+    rng = random.Random(SEED)
+    answers = [QUOTE_ANSWER, DETAILS_ANSWER, "What is your current employment status?",
+               "Based on your profile, I recommend the **Smart Wealth 12**.\n\nIt balances savings and cover."]
+    history = []
+    for _ in range(turns):
+        history.append(_message("human", rng.choice(BUTTON_CLICKS + FREE_TEXT)))
+        history.append(_message("ai", rng.choice(answers)))
+    return history
+
+
+def session_row() -> dict:
+    """A joined user_info + user_context row as returned by the MySQL dictionary cursor."""
+    return {
+        "user_id": 42, "phone_number": "9876543210", "name": "Ravi Kumar", "email": "ravi.kumar@example.com",
+        "dob": "1990-04-12", "gender": "Male", "nationality": "Indian", "marital_status": "Married",
+        "education": "Graduate", "employment_status": "Salaried", "existing_policy": "I do not have an existing policy",
+        "annual_income": 1500000, "gst_applicable": "No", "context_id": 42,
+        "context_state": "quote_displayed", "previous_state": "generate_premium_quotation",
+        "state_history": json.dumps(["welcome", "existing_policy", "collect_employment_status",
+                                     "collect_annual_income", "recommendation_phase", "recommendation_given_phase"]),
+        "shown_recommendations": json.dumps([{"name": "Smart Wealth 12", "description": "It balances savings and cover."}]),
+        "selected_policy": "POL00012",
+        "selected_policy_details": json.dumps({"policy_id": "POL00012", "policy_name": "Smart Wealth 12",
+                                               "benefits": DETAILS_ANSWER}),
+        "chat_history": json.dumps(chat_history()),
+        "quotation_clicked": 1, "details_clicked": 1, "plan_option": "Wealth Builder",
+        "coverage_required": 5000000, "policy_term": 20, "premium_payment_term": 15,
+    }
+
+
+def context_update() -> dict:
+    """The JSON-bearing part of a typical _update_context write."""
+    row = session_row()
+    return {
+        "context_state": "recommendation_given_phase",
+        "shown_recommendations": json.loads(row["shown_recommendations"]),
+        "state_history": json.loads(row["state_history"]),
+        "chat_history": chat_history(),
+    }
+
+
+def chat_response() -> dict:
+    """An opening /chat response: answer, options and the first page of history."""
+    history = [{"type": "user" if m["type"] == "human" else "bot", "text": m["data"]["content"],
+                "timestamp": "2025-07-01T10:15:00"} for m in chat_history(10)]
+    return {
+        "answer": DETAILS_ANSWER,
+        "options": ["Apply for Smart Wealth 12", "Get Quotation", "Get More Details"],
+        "chat_history": history,
+        "history_cursor": "MjAyNS0wNy0wMVQxMDoxNTowMHw0Mg",
+        "input_type": None,
+        "slider_config": None,
+        "quote_data": None,
+        "action_buttons": {"getQuotation": True, "showDetails": False},
+    }
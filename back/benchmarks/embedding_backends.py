@@ -0,0 +1,126 @@
+"""
+Parity check and throughput benchmark for the embedding backends.
+
+Compares the int8 ONNX backend against the PyTorch (HuggingFace) embeddings on a
+corpus shaped like the real traffic: catalog documents as built by
+pinecone_handler.build_page_content, and the retrieval queries the handlers send.
+
+    python benchmarks/embedding_backends.py --min-cosine 0.99
+
+Exits non-zero if any vector falls below the cosine threshold or the top-1
+retrieval agreement between backends falls below --min-top1. The same check runs
+in the test suite (tests/test_embedding_parity.py) when both backends are installed.
+"""
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+from pinecone_handler import load_embeddings
+from benchmarks.corpora import EMPLOYMENT, INCOMES, PLANS, PROVIDERS, POLICY_TYPES, QUESTIONS
+
+
+def build_corpus(num_documents: int, num_queries: int, seed: int = 42):
+    rng = random.Random(seed)
+    documents = [
+        f"Policy: {rng.choice(PROVIDERS)} {rng.choice(PLANS)} {i} from {rng.choice(PROVIDERS)}, "
+        f"with coverage up to ₹{rng.randrange(10, 500) * 100000} and premium of ₹{rng.randrange(5, 200) * 1000}. "
+        f"A {rng.choice(POLICY_TYPES)} plan."
+        for i in range(num_documents)
+    ]
+    queries = []
+    for _ in range(num_queries):
+        if rng.random() < 0.5:
+            queries.append(
+                f"insurance for person {rng.choice(['I have an existing policy', 'I do not have an existing policy'])} "
+                f"and {rng.choice(EMPLOYMENT)} with annual income {rng.choice(INCOMES)}"
+            )
+        else:
+            queries.append(rng.choice(QUESTIONS))
+    return documents, queries
+
+
+def rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(embeddings, documents, queries, repeats):
+    embeddings.embed_documents(documents[:8])  # warm up allocators and kernels
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        doc_vectors = embeddings.embed_documents(documents)
+    batch_seconds = (time.perf_counter() - start) / repeats
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        embeddings.embed_query(query)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    return np.array(doc_vectors), {
+        "documents_per_second": round(len(documents) / batch_seconds, 1),
+        "query_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "query_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "peak_rss_mb": round(rss_mb(), 1),
+    }
+
+
+def parity(onnx_docs, torch_docs, onnx_queries, torch_queries) -> dict:
+    """Per-document cosine between the backends, and how often they retrieve the same top document."""
+    # Both backends return L2-normalized vectors, so the dot product is the cosine
+    cosines = np.sum(onnx_docs * torch_docs, axis=1)
+    top1_onnx = np.argmax(onnx_queries @ onnx_docs.T, axis=1)
+    top1_torch = np.argmax(torch_queries @ torch_docs.T, axis=1)
+    return {
+        "min_cosine": round(float(cosines.min()), 5),
+        "mean_cosine": round(float(cosines.mean()), 5),
+        "top1_agreement": round(float(np.mean(top1_onnx == top1_torch)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--min-top1", type=float, default=0.98, help="Minimum top-1 retrieval agreement.")
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    args = parser.parse_args()
+
+    documents, queries = build_corpus(args.documents, args.queries)
+    results = {"documents": len(documents), "queries": len(queries), "backends": {}}
+
+    # ONNX first, so its peak RSS is not inflated by PyTorch
+    onnx = load_embeddings("onnx")
+    onnx_docs, results["backends"]["onnx"] = measure(onnx, documents, queries, args.repeats)
+    onnx_queries = np.array(onnx.embed_documents(queries))
+
+    torch = load_embeddings("huggingface")
+    torch_docs, results["backends"]["huggingface"] = measure(torch, documents, queries, args.repeats)
+    torch_queries = np.array(torch.embed_documents(queries))
+
+    results["parity"] = parity(onnx_docs, torch_docs, onnx_queries, torch_queries)
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+    if results["parity"]["min_cosine"] < args.min_cosine or results["parity"]["top1_agreement"] < args.min_top1:
+        print("Parity check FAILED", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Microbenchmarks for the backend hot paths.
+
+    python benchmarks/run_benchmarks.py                          # run and print
+    python benchmarks/run_benchmarks.py --output results.json    # machine-readable results
+    python benchmarks/run_benchmarks.py --save-baseline main     # store benchmarks/baselines/main.json
+    python benchmarks/run_benchmarks.py --compare main           # fail on regressions against it
+
+Each benchmark runs its whole corpus per loop; results are reported per item.
+No database, network or model downloads are needed.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import warnings
+import statistics
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks import corpora
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """
+    Registers a benchmark. The decorated function does the setup and returns
+    (fn, items): fn processes the whole corpus once, items is its size.
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+@benchmark("utils.is_general_question")
+def bench_is_general_question():
+    from utils import is_general_question
+
+    queries = corpora.router_queries()
+    keywords = ["compare", "details for", "apply for", "get more details"]
+
+    def run():
+        for query in queries:
+            is_general_question(query, specific_keywords=keywords)
+    return run, len(queries)
+
+
+@benchmark("utils.extract_numeric_value")
+def bench_extract_numeric_value():
+    from utils import extract_numeric_value
+
+    inputs = corpora.numeric_inputs()
+
+    def run():
+        for text, field in inputs:
+            extract_numeric_value(text, field)
+    return run, len(inputs)
+
+
+@benchmark("premium_calculator.calculate_premium")
+def bench_calculate_premium():
+    from premium_calculator import calculate_premium
+
+    inputs = corpora.premium_inputs()
+
+    def run():
+        for kwargs in inputs:
+            calculate_premium(**kwargs)
+    return run, len(inputs)
+
+
+@benchmark("pinecone_handler.prepare_documents")
+def bench_prepare_documents():
+    import pinecone_handler
+
+    rows = corpora.catalog_rows()
+    # Feed the catalog corpus in place of the MySQL query
+    pinecone_handler.iter_policy_catalog = lambda chunk_size=1000: iter([rows])
+    return pinecone_handler.prepare_documents, len(rows)
+
+
+def _bare_bot(context):
+    from cbot import ImprovedChatBot
+
+    bot = ImprovedChatBot.__new__(ImprovedChatBot)
+    bot.user_id = context.get("user_id")
+    bot.context = context
+    bot.memory = ImprovedChatBot._create_memory()
+    return bot
+
+
+@benchmark("cbot.ImprovedChatBot._load_chat_history")
+def bench_load_chat_history():
+    history = corpora.chat_history()
+
+    def run():
+        _bare_bot({"chat_history": history})._load_chat_history()
+    return run, 1
+
+
+@benchmark("cbot.ImprovedChatBot.chat_history_dump")
+def bench_chat_history_dump():
+    # The chat window rebuild done on every _update_context
+    from serialization import messages_to_dicts
+
+    bot = _bare_bot({"chat_history": corpora.chat_history()})
+    bot._load_chat_history()
+
+    def run():
+        messages_to_dicts(bot.memory.buffer_as_messages)
+    return run, 1
+
+
+@benchmark("sqlconnect.deserialize_context_fields")
+def bench_deserialize_context():
+    from sqlconnect import deserialize_context_fields
+
+    row = corpora.session_row()
+
+    def run():
+        deserialize_context_fields(dict(row))
+    return run, 1
+
+
+@benchmark("sqlconnect.serialize_context_fields")
+def bench_serialize_context():
+    from sqlconnect import serialize_context_fields
+
+    update = corpora.context_update()
+
+    def run():
+        serialize_context_fields(dict(update))
+    return run, 1
+
+
+@benchmark("serialization.FastJSONResponse.render")
+def bench_response_render():
+    from serialization import FastJSONResponse
+
+    content = corpora.chat_response()
+    response = FastJSONResponse(content)
+
+    def run():
+        response.render(content)
+    return run, 1
+
+
+@benchmark("starlette.JSONResponse.render")
+def bench_stdlib_response_render():
+    # The stdlib renderer FastJSONResponse replaced, kept as the reference point
+    from fastapi.responses import JSONResponse
+
+    content = corpora.chat_response()
+    response = JSONResponse(content)
+
+    def run():
+        response.render(content)
+    return run, 1
+
+
+def measure(fn, items: int, repeats: int, min_time: float) -> dict:
+    fn()  # warm up caches, regex compilation and lazy imports
+
+    # Calibrate so each repeat runs for at least min_time
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops = min(loops * 10, int(loops * min_time / max(elapsed, 1e-9) * 1.1) + 1)
+
+    per_item = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_item.append((time.perf_counter() - start) / (loops * items))
+
+    median = statistics.median(per_item)
+    return {
+        "median_us": round(median * 1e6, 4),
+        "mean_us": round(statistics.mean(per_item) * 1e6, 4),
+        "min_us": round(min(per_item) * 1e6, 4),
+        "stdev_us": round(statistics.stdev(per_item) * 1e6, 4) if repeats > 1 else 0.0,
+        "items_per_second": round(1 / median, 1),
+        "items": items,
+        "loops": loops,
+        "repeats": repeats,
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    """
+    Returns (name, baseline_us, current_us, change) for every benchmark slower than allowed.
+    Compares the fastest repeat, which is the least sensitive to noise from other processes.
+    """
+    regressions = []
+    for name, current in results["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+        if not previous:
+            continue
+        change = current["min_us"] / previous["min_us"] - 1
+        print(f"  {name:45s} {previous['min_us']:>12.3f} -> {current['min_us']:>12.3f} us  ({change:+.1%})")
+        if change > max_regression:
+            regressions.append((name, previous["min_us"], current["min_us"], change))
+    return regressions
+
+
+def _baseline_path(name_or_path: str) -> str:
+    if os.path.exists(name_or_path):
+        return name_or_path
+    return os.path.join(BASELINE_DIR, f"{name_or_path}.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend microbenchmarks.")
+    parser.add_argument("-k", "--filter", help="Only run benchmarks whose name contains this.")
+    parser.add_argument("--repeats", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per repeat.")
+    parser.add_argument("--output", help="Write the JSON results to this file.")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Save the results as benchmarks/baselines/NAME.json.")
+    parser.add_argument("--compare", metavar="BASELINE", help="Baseline name or path to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="Allowed slowdown of the fastest repeat before --compare fails (0.15 = 15%%).")
+    args = parser.parse_args()
+    # langchain memory and pydantic .dict() deprecation notices would drown the table
+    warnings.simplefilter("ignore")
+
+    results = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+        },
+        "benchmarks": {},
+    }
+    for name, setup in BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        fn, items = setup()
+        # Imports done during setup may have re-enabled langchain's deprecation filter
+        warnings.simplefilter("ignore")
+        results["benchmarks"][name] = stats = measure(fn, items, args.repeats, args.min_time)
+        print(f"{name:45s} {stats['median_us']:>12.3f} us/item  ({stats['items_per_second']:,.0f} items/s)")
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save_baseline}.json"), "w") as f:
+            f.write(report)
+
+    if args.compare:
+        with open(_baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare} ({baseline['meta']['created_at']}):")
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.max_regression:.0%}:", file=sys.stderr)
+            for name, _, _, change in regressions:
+                print(f"  {name}: {change:+.1%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
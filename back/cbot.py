@@ -1,9 +1,10 @@
-import json
 import logging
-from typing import Any, Dict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
 from langchain.memory import ConversationBufferWindowMemory
 from langchain_community.chat_message_histories import ChatMessageHistory
 from sqlconnect import (
+    get_recent_quotation,
     get_user_session,
     log_chat_message,
     update_user_context,
@@ -23,38 +24,160 @@ from handlers.closing import (
 )
 from handlers.general_qa import route_general_question, handle_random_query, handle_general_questions
 from utils import is_general_question
+import conversation_summary
+import outbox
+from metrics import counter, handler_scope
+from serialization import dumps, messages_to_dicts
+from state_machine import State, StateMachine
+
+from handlers.quotation import (
+    QUOTE_REUSE_WINDOW_SECONDS,
+    QuotationHandler,
+    handle_generate_premium_quotation,
+    quote_input_hash,
+)
+
+QUOTE_REQUESTS = counter(
+    "chatbot_quote_requests_total",
+    "Quote form submissions, by whether they were priced or served from a stored quote.",
+    ("outcome",),
+)
+
+# The conversation flow. A handler that moves context_state on and returns {} hands
+# the turn to the next state's handler, which receives that state's entry_query.
+CONVERSATION_FLOW = StateMachine([
+    # Onboarding
+    State("existing_policy", handle_existing_policy),
+    State("collect_employment_status", handle_employment_status),
+    State("collect_annual_income", handle_annual_income),
+
+    # Recommendation
+    State("recommendation_phase", handle_recommendation_phase,
+          entry_query="My profile is complete. Please give me recommendations."),
+    State("recommendation_given_phase", handle_recommendation_phase),
+
+    State("generate_premium_quotation", handle_generate_premium_quotation),
+    State("quote_displayed", handle_general_questions),
+    # Closing
+    State("application", handle_application),
+    State("contact_capture", handle_contact_capture),
+    State("email_capture", handle_email_capture),
+], default="existing_policy")
+
 
-from handlers.quotation import QuotationHandler, handle_generate_premium_quotation
 class ImprovedChatBot:
+    # Context writes held back by batched_context_writes(), or None when writing through
+    _pending_updates: Optional[Dict[str, Any]] = None
+    _pending_transitions: Optional[list] = None
+    _pending_writes: Optional[list] = None
+    _pending_side_effects: Optional[list] = None
+
     def __init__(self, phone_number: str, name: str = None, email: str = None):
         session_data = get_user_session(phone_number, name, email)
         self.user_id = session_data["user_id"]
         self.context = session_data or {}
-        self.memory = ConversationBufferWindowMemory(
+        self.memory = self._create_memory()
+        self._load_chat_history()
+
+    def reload(self):
+        """Re-reads the user's context and history, for bots kept across requests."""
+        self.context = get_user_session(self.context["phone_number"]) or self.context
+        self.memory = self._create_memory()
+        self._load_chat_history()
+
+    @staticmethod
+    def _create_memory() -> ConversationBufferWindowMemory:
+        return ConversationBufferWindowMemory(
             chat_memory=ChatMessageHistory(),
             memory_key="chat_history",
             return_messages=True,
             k=5  # Keep the last 5 interactions
         )
-        self._load_chat_history()
 
     def _load_chat_history(self):
         # Load chat history from context if available
         if "chat_history" in self.context and isinstance(self.context["chat_history"], list):
             for msg in self.context["chat_history"]:
+                # Rows written before messages_to_dicts hold the flat BaseMessage.dict() shape
+                content = msg["data"].get("content", "") if "data" in msg else msg.get("content", "")
                 if msg.get("type") == "human":
-                    self.memory.chat_memory.add_user_message(msg.get("data", {}).get("content", ""))
+                    self.memory.chat_memory.add_user_message(content)
                 elif msg.get("type") == "ai":
-                    self.memory.chat_memory.add_ai_message(msg.get("data", {}).get("content", ""))
+                    self.memory.chat_memory.add_ai_message(content)
 
     def _update_context(self, updates: Dict[str, Any]):
+        previous_state = self.context.get("context_state")
+        snapshot = dict(self.context)
         self.context.update(updates)
-        
+
+        transitions = []
+        if "context_state" in updates and updates["context_state"] != previous_state:
+            transitions.append((previous_state, updates["context_state"]))
+
+        if self._pending_updates is not None:
+            self._pending_updates.update(updates)
+            self._pending_transitions.extend(transitions)
+            return
+        try:
+            self._persist_context(updates, transitions)
+        except Exception:
+            self.context = snapshot
+            raise
+
+    def write_with_context(self, kind: str, payload: Dict[str, Any]):
+        """
+        Makes a write (see sqlconnect.SIDE_EFFECT_WRITERS) in the same transaction as the
+        context updates, for data the next turn reads back. Inside batched_context_writes()
+        it joins the block's single write.
+        """
+        if self._pending_writes is not None:
+            self._pending_writes.append((kind, payload))
+            return
+        self._persist_context({}, [], writes=[(kind, payload)])
+
+    def enqueue_side_effect(self, kind: str, payload: Dict[str, Any]):
+        """
+        Queues a write for the outbox workers (see outbox.py) instead of making it now.
+        It is stored in the same transaction as the context updates of the enclosing
+        batched_context_writes() block, so it may only be called inside one.
+        """
+        if self._pending_side_effects is None:
+            raise RuntimeError("enqueue_side_effect() must be called inside batched_context_writes().")
+        self._pending_side_effects.append((kind, payload))
+
+    @contextmanager
+    def batched_context_writes(self):
+        """
+        Collects the context updates and side effects made inside the block into one
+        database write. If that write fails the in-memory context is put back and the
+        error is raised from the block, so the turn does not confirm a rolled-back change.
+        """
+        if self._pending_updates is not None:
+            yield
+            return
+        snapshot = dict(self.context)
+        self._pending_updates, self._pending_transitions = {}, []
+        self._pending_writes, self._pending_side_effects = [], []
+        try:
+            yield
+        finally:
+            updates, transitions = self._pending_updates, self._pending_transitions
+            writes, side_effects = self._pending_writes, self._pending_side_effects
+            self._pending_updates, self._pending_transitions = None, None
+            self._pending_writes, self._pending_side_effects = None, None
+            if updates or writes or side_effects:
+                try:
+                    self._persist_context(updates, transitions, writes, side_effects)
+                except Exception:
+                    self.context = snapshot
+                    raise
+
+    def _persist_context(self, updates: Dict[str, Any], transitions: list, writes: list = (), side_effects: list = ()):
         # Persist only the changes to the database
         db_updates = updates.copy()
 
         # Add chat history to the updates if it has changed
-        self.context["chat_history"] = [msg.dict() for msg in self.memory.buffer_as_messages]
+        self.context["chat_history"] = messages_to_dicts(self.memory.buffer_as_messages)
         db_updates["chat_history"] = self.context["chat_history"]
 
         # --- CONTEXT TO DB MAPPING ---
@@ -63,7 +186,11 @@ class ImprovedChatBot:
             db_updates['term_length'] = db_updates.pop('policy_term')
         # --- END MAPPING ---
 
-        update_user_context(self.user_id, db_updates)
+        # State changes feed the funnel analytics (see funnel.py)
+        update_user_context(self.user_id, db_updates, transitions=transitions,
+                            writes=list(writes), outbox=list(side_effects))
+        if side_effects:
+            outbox.notify()
 
     def _validate_context_completeness(self) -> bool:
         """Ensure all required fields are collected before recommendations"""
@@ -93,25 +220,22 @@ class ImprovedChatBot:
             logging.debug(f"Routing query: '{query}' in state: '{current_state}'. Is general: {is_general}")
 
             if is_general:
-                response = route_general_question(self, query)
+                with handler_scope("route_general_question", current_state):
+                    response = route_general_question(self, query)
             else:
-                response = self._handle_state(current_state, query)
-                
-                if not response:
-                    new_state = self.context.get("context_state")
-                    if new_state != current_state:
-                        logging.debug(f"Handler returned empty, transitioning to new state: {new_state}")
-                        response = self._handle_state(new_state, "")
-                    else:
-                        # If the state hasn't changed and the handler returned nothing,
-                        # it's a random query.
-                        logging.debug(f"No specific handler for query in state '{current_state}'. Treating as random query.")
+                response = CONVERSATION_FLOW.dispatch(self, self.context.get("context_state"), query)
+
+                if not response and self.context.get("context_state", "existing_policy") == current_state:
+                    # If the state hasn't changed and the handler returned nothing,
+                    # it's a random query.
+                    logging.debug(f"No specific handler for query in state '{current_state}'. Treating as random query.")
+                    with handler_scope("handle_random_query", current_state):
                         response = handle_random_query(self, query)
 
             if query:
                 # If the query is a dictionary (form submission), convert it to a string for logging
                 if isinstance(query, dict):
-                    log_message = json.dumps(query)
+                    log_message = dumps(query)
                     self.memory.chat_memory.add_user_message(log_message)
                 else:
                     log_message = query
@@ -123,6 +247,10 @@ class ImprovedChatBot:
                 log_chat_message(self.user_id, "bot", response["answer"])
                 self.memory.chat_memory.add_ai_message(response["answer"])
 
+            if query:
+                # Off the request path: fold turns that left the prompt window into the summary
+                conversation_summary.schedule(self)
+
             return response
         except Exception as e:
             # Centralized error handling
@@ -132,46 +260,24 @@ class ImprovedChatBot:
                 "options": ["Start Over", "Get Policy Recommendations", "Speak to an Agent"]
             }
 
-    def _handle_state(self, state: str, query: Any) -> Dict[str, Any]:
-        handlers = {
-            # Onboarding
-            "existing_policy": handle_existing_policy,
-            "collect_employment_status": handle_employment_status,
-            "collect_annual_income": handle_annual_income,
-            
-            # Recommendation
-            "recommendation_phase": handle_recommendation_phase,
-            "recommendation_given_phase": handle_recommendation_phase,
-
-            "generate_premium_quotation": handle_generate_premium_quotation,
-            "quote_displayed": handle_general_questions,
-            # Closing
-            "application": handle_application,
-            "contact_capture": handle_contact_capture,
-            "email_capture": handle_email_capture,
-        }
-        handler = handlers.get(state, handle_existing_policy)
-        return handler(self, query)
-
     def get_handler_for_state(self, state: str):
         """Returns the handler function for a given state."""
-        handlers = {
-            "existing_policy": handle_existing_policy,
-            "collect_employment_status": handle_employment_status,
-            "collect_annual_income": handle_annual_income,
-            "recommendation_phase": handle_recommendation_phase,
-            "recommendation_given_phase": handle_recommendation_phase,
-            "generate_premium_quotation": handle_generate_premium_quotation,
-            "application": handle_application,
-            "contact_capture": handle_contact_capture,
-            "email_capture": handle_email_capture,
-            "quote_displayed": handle_general_questions,}
-        return handlers.get(state)
+        return CONVERSATION_FLOW.handler_for(state)
 
     def update_profile_and_get_quote(self, form_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Updates user profile from form, generates a quote, and saves it.
+        A resubmission of the same inputs within QUOTE_REUSE_WINDOW_SECONDS returns the
+        stored quote without re-pricing or writing anything.
         """
+        input_hash = quote_input_hash(self.user_id, form_data)
+        stored = get_recent_quotation(self.user_id, input_hash, QUOTE_REUSE_WINDOW_SECONDS)
+        if stored is not None:
+            logging.debug(f"Reusing stored quote for user {self.user_id} ({input_hash[:12]})")
+            QUOTE_REQUESTS.inc(outcome="reused")
+            return stored
+        QUOTE_REQUESTS.inc(outcome="priced")
+
         # 1. Update user_info and user_context
         user_info_keys = [
             "dob", "gender", "nationality", "marital_status",
@@ -194,12 +300,8 @@ class ImprovedChatBot:
         self.context.update(user_context_data)
 
         # 3. Generate quote
-        from handlers.quotation import QuotationHandler
-        from sqlconnect import get_mysql_connection, save_quotation_details
-        db_conn = get_mysql_connection()
         quotation_handler = QuotationHandler(self, self.user_id, self.context)
         response = quotation_handler.handle()
-        db_conn.close()
 
         # 4. Save the generated quote to the new table
         if response.get("quote_data"):
@@ -211,9 +313,14 @@ class ImprovedChatBot:
                 if key not in flat_quote_data:
                     flat_quote_data[key] = form_data[key]
             
-            save_quotation_details(self.user_id, flat_quote_data)
-            
-            # Also update the user_context with the quote details
-            self._update_context(flat_quote_data)
+            # Stored with the context update, so get_recent_quotation sees it on the very next submission
+            with self.batched_context_writes():
+                self.write_with_context("quotation", {
+                    "quote_data": flat_quote_data,
+                    "input_hash": input_hash,
+                    "quote_response": response,
+                })
+                # Also update the user_context with the quote details
+                self._update_context(flat_quote_data)
 
         return response
@@ -0,0 +1,119 @@
+"""
+WebSocket chat sessions: one hydrated ImprovedChatBot per connection.
+
+Protocol (JSON text frames) on /ws/chat:
+
+    client -> {"type": "hello", "phone_number": "...", "name": "...", "email": "..."}
+    server <- {"type": "welcome", "answer": ..., "options": ..., "chat_history": [...], "history_cursor": ...}
+
+    client -> {"type": "message", "id": "<client id>", "query": "..." | {...form data...}}
+    server <- {"type": "delta", "id": ..., "text": "..."}        zero or more, as the answer is generated
+    server <- {"type": "answer", "id": ..., "answer": ..., "options": ..., "action_buttons": {...}, ...}
+
+    client -> {"type": "history", "id": ..., "before": "<history_cursor>", "limit": 20}
+    server <- {"type": "history", "id": ..., "messages": [...], "history_cursor": ...}
+
+    client -> {"type": "ping"}            server <- {"type": "pong"}
+    server <- {"type": "push", "event": "...", ...}             at any time, see push()
+    server <- {"type": "error", "id": ..., "detail": "..."}
+
+The "answer" frame is authoritative: handlers may add to the streamed text (e.g. the
+nudge back into the flow after a general question), so clients replace the deltas
+with it. Turns on one connection run one at a time, in order.
+
+Pushes only reach connections held by the same worker process.
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from metrics import counter
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+SOCKET_FRAMES = counter("chat_socket_frames_total", "WebSocket chat frames, by direction and type.", ("direction", "type"))
+SOCKET_CONNECTIONS = counter("chat_socket_connections_total", "WebSocket chat connections, by how they ended.", ("outcome",))
+
+
+class ChatSocketSession:
+    """
+    The state one connection keeps: its bot, and an outbox drained by a single writer
+    task, so frames from the event loop and from worker threads never interleave.
+    """
+
+    def __init__(self, websocket, loop: asyncio.AbstractEventLoop):
+        self.websocket = websocket
+        self.loop = loop
+        self.bot = None
+        self.phone_number: Optional[str] = None
+        # Set when another request changed this user's context; the bot reloads before its next turn
+        self.stale = False
+        # The sink of the turn being answered, closed with the connection
+        self.token_sink = None
+        self.closed = False
+        self._outbox: asyncio.Queue = asyncio.Queue()
+
+    def send(self, message: Dict[str, Any]):
+        """Queues a frame; dropped once the connection is closed. Safe to call from any thread."""
+        if self.closed:
+            return
+        self.loop.call_soon_threadsafe(self._outbox.put_nowait, message)
+
+    async def writer(self):
+        while True:
+            message = await self._outbox.get()
+            if message is None:
+                return
+            await self.websocket.send_text(dumps(message))
+            SOCKET_FRAMES.inc(direction="out", type=message.get("type", ""))
+
+    def close(self):
+        """Stops the writer after the frames already queued and drops any sent later."""
+        if self.token_sink is not None:
+            self.token_sink.close()
+        self.send(None)
+        self.closed = True
+
+
+_sessions: Dict[int, set] = {}
+_sessions_lock = threading.Lock()
+
+
+def register(user_id: int, session: ChatSocketSession):
+    with _sessions_lock:
+        _sessions.setdefault(user_id, set()).add(session)
+
+
+def unregister(user_id: int, session: ChatSocketSession):
+    with _sessions_lock:
+        sessions = _sessions.get(user_id)
+        if sessions:
+            sessions.discard(session)
+            if not sessions:
+                del _sessions[user_id]
+
+
+def push(user_id: int, event: str, payload: Dict[str, Any] = None, context_changed: bool = False) -> int:
+    """
+    Sends a push frame to the user's open connections in this process and returns how
+    many there were. context_changed makes their bots reload the user's context before
+    the next turn, for changes made outside the socket (e.g. a quote form submitted over HTTP).
+    """
+    with _sessions_lock:
+        sessions = list(_sessions.get(user_id, ()))
+    for session in sessions:
+        if context_changed:
+            session.stale = True
+        session.send({"type": "push", "event": event, **(payload or {})})
+    return len(sessions)
+
+
+def mark_stale(user_id: int, except_session: Optional[ChatSocketSession] = None):
+    """Makes the user's connections reload their context before the next turn, without a frame."""
+    with _sessions_lock:
+        sessions = list(_sessions.get(user_id, ()))
+    for session in sessions:
+        if session is not except_session:
+            session.stale = True
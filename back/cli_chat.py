@@ -1,11 +1,18 @@
 import sys
 import os
+import json
+import time
+import random
+import argparse
+import threading
+from collections import defaultdict
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
 
-# Add the project root to the Python path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Make the backend modules importable when run from the project root
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
-from back.cbot import ImprovedChatBot
-from back.sqlconnect import get_or_create_user
+from cbot import ImprovedChatBot
 
 
 def run_cli_chat():
@@ -33,7 +40,7 @@ def run_cli_chat():
             if response.get('options'):
                 for i, option in enumerate(response['options'], 1):
                     print(f"  {i}. {option}")
-            
+
             print("-" * 30)
 
             query = input("You: ")
@@ -49,5 +56,207 @@ def run_cli_chat():
             break
 
 
+# --- Headless load generation ---
+
+def load_scenarios(path: str) -> list[dict]:
+    """
+    Reads scripted conversations from a JSONL file. Each line looks like:
+    {"name": "...", "turns": [{"state": "existing_policy", "query": "I do not have an existing policy"},
+                              {"state": "generate_premium_quotation", "quote_form": {...}}, ...]}
+    A turn either sends `query` to /chat or submits `quote_form` to the quote endpoint.
+    `state` labels the turn in the report when the real state is not observable (HTTP target).
+    """
+    scenarios = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                scenarios.append(json.loads(line))
+    return scenarios
+
+
+class InProcessTarget:
+    """Drives ImprovedChatBot directly, rebuilding the bot per turn as the API does."""
+
+    name = "inprocess"
+
+    def run_turn(self, phone_number: str, turn: dict) -> str:
+        bot = ImprovedChatBot(phone_number=phone_number, name=turn.get("name"))
+        state = bot.context.get("context_state") or turn.get("state", "unknown")
+        if "quote_form" in turn:
+            bot.update_profile_and_get_quote({**turn["quote_form"], "phone_number": phone_number})
+        else:
+            bot.handle_message(turn.get("query", ""))
+        return state
+
+
+class HttpTarget:
+    """Drives a running server through the same endpoints the React widget uses."""
+
+    name = "http"
+
+    def __init__(self, base_url: str, timeout: float):
+        import requests
+
+        self._requests = requests
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = self._requests.Session()
+        return self._local.session
+
+    def run_turn(self, phone_number: str, turn: dict) -> str:
+        if "quote_form" in turn:
+            url = f"{self.base_url}/api/update_user_and_get_quote"
+            payload = {**turn["quote_form"], "phone_number": phone_number}
+        else:
+            url = f"{self.base_url}/chat"
+            payload = {"phone_number": phone_number, "name": turn.get("name"), "query": turn.get("query", "")}
+        response = self._session().post(url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return turn.get("state", "unknown")
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LoadReport:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.conversations = 0
+
+    def record(self, state: str, seconds: float, ok: bool):
+        with self._lock:
+            self.latencies[state].append(seconds)
+            if not ok:
+                self.errors[state] += 1
+
+    def conversation_done(self):
+        with self._lock:
+            self.conversations += 1
+
+    def summary(self, elapsed: float) -> dict:
+        states = {}
+        for state, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            states[state] = {
+                "turns": len(values),
+                "errors": self.errors[state],
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round(values[-1] * 1000, 1),
+            }
+        turns = sum(len(v) for v in self.latencies.values())
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "conversations": self.conversations,
+            "turns": turns,
+            "errors": sum(self.errors.values()),
+            "turns_per_second": round(turns / elapsed, 2) if elapsed else 0.0,
+            "conversations_per_second": round(self.conversations / elapsed, 2) if elapsed else 0.0,
+            "states": states,
+        }
+
+
+def _run_conversation(target, scenario: dict, phone_number: str, report: LoadReport, think_time: float):
+    for turn in scenario["turns"]:
+        start = time.perf_counter()
+        ok = True
+        state = turn.get("state", "unknown")
+        try:
+            state = target.run_turn(phone_number, turn)
+        except Exception as e:
+            ok = False
+            print(f"[{scenario.get('name', 'scenario')}] {phone_number}: turn failed: {e}", file=sys.stderr)
+        report.record(state, time.perf_counter() - start, ok)
+        if not ok:
+            break
+        if think_time:
+            time.sleep(random.uniform(0, think_time))
+    report.conversation_done()
+
+
+def run_load(scenarios: list[dict], target, conversations: int, concurrency: int,
+             think_time: float = 0.0, phone_prefix: str = "7") -> dict:
+    """
+    Runs `conversations` scripted conversations (cycling through the scenarios) with
+    `concurrency` in flight at once. Each conversation gets a fresh phone number,
+    so it starts at onboarding like a new user.
+    """
+    report = LoadReport()
+    phone_number = run_phone_numbers(phone_prefix, conversations)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(conversations):
+            scenario = scenarios[i % len(scenarios)]
+            pool.submit(_run_conversation, target, scenario, phone_number(i), report, think_time)
+    return report.summary(time.perf_counter() - start)
+
+
+def run_phone_numbers(phone_prefix: str, conversations: int) -> Callable[[int], str]:
+    """
+    Returns i -> the phone number of conversation i of this run. Numbers stay 10 digits
+    wide: the run id shrinks as the conversation index grows, so runs started at
+    different times do not reuse each other's numbers.
+    """
+    index_digits = max(4, len(str(max(conversations - 1, 0))))
+    if index_digits > 9 - len(phone_prefix):
+        raise ValueError(f"At most {10 ** (9 - len(phone_prefix)) - 1} conversations fit in a 10-digit number.")
+    run_digits = 10 - len(phone_prefix) - index_digits
+    run_id = int(time.time()) % 10 ** run_digits
+
+    def phone_number(i: int) -> str:
+        if i >= conversations:
+            raise ValueError(f"Conversation {i} is past the {conversations} this run was sized for.")
+        return f"{phone_prefix}{run_id:0{run_digits}d}{i:0{index_digits}d}"
+    return phone_number
+
+
+def print_report(summary: dict, target_name: str):
+    print(f"\nTarget: {target_name}  |  {summary['conversations']} conversations, {summary['turns']} turns "
+          f"in {summary['elapsed_s']}s  |  {summary['turns_per_second']} turns/s, "
+          f"{summary['conversations_per_second']} conversations/s  |  {summary['errors']} errors")
+    print(f"{'state':32s} {'turns':>7s} {'errors':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    for state, s in summary["states"].items():
+        print(f"{state:32s} {s['turns']:>7d} {s['errors']:>7d} {s['p50_ms']:>9.1f} "
+              f"{s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interactive chat, or a headless load generator with --load.")
+    parser.add_argument("--load", metavar="SCENARIOS_JSONL", help="Run scripted conversations from this file.")
+    parser.add_argument("--target", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL for --target http.")
+    parser.add_argument("--conversations", type=int, default=50, help="Total conversations to run.")
+    parser.add_argument("--concurrency", type=int, default=10, help="Conversations in flight at once.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Max random pause between turns, in seconds.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="HTTP request timeout, in seconds.")
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    args = parser.parse_args()
+
+    if not args.load:
+        run_cli_chat()
+        return
+
+    target = InProcessTarget() if args.target == "inprocess" else HttpTarget(args.url, args.timeout)
+    summary = run_load(load_scenarios(args.load), target, args.conversations, args.concurrency, args.think_time)
+    print_report(summary, target.name)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"target": target.name, **summary}, f, indent=2)
+    if summary["errors"]:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
-    run_cli_chat()
+    main()
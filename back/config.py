@@ -1,22 +1,413 @@
 import os
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, List, Optional
 from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from pinecone_handler import upload_vectorstore
+from deadline import CircuitBreaker, call_with_deadline, remaining
+from metrics import LLM_CALLS, LLM_ERRORS, current_handler, time_stage
+from retrieval_cache import RetrievalCache, normalize_query
+from singleflight import SingleFlight, normalize_prompt
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "life-insurance")
+NAMESPACE = os.getenv("PINECONE_NAMESPACE", "default")
+# Rebuilding the index on first use keeps the catalog in step with MySQL, which is
+# what every startup used to do. Set to "false" when the catalog is synced elsewhere.
+CATALOG_SYNC_ON_STARTUP = os.getenv("CATALOG_SYNC_ON_STARTUP", "true").lower() == "true"
+# Policies returned per retrieval
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "1"))
+# Query embeddings from concurrent requests are coalesced for up to this long.
+# Set EMBEDDING_BATCH_MAX_WAIT_MS=0 to embed every query on its own.
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+# Each /chat turn gets this many seconds in total; the retriever, DB and LLM calls
+# inside it get whatever is left, and handlers fall back once it runs out.
+TURN_LATENCY_BUDGET_S = float(os.getenv("TURN_LATENCY_BUDGET_S", "8"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+
+# --- Providers ---
+# LLM_PROVIDER: "openrouter" (default) or "fake"
+# EMBEDDING_BACKEND: "huggingface" (default), "onnx" or "hashing"
+# VECTORSTORE_PROVIDER: "pinecone" (default) or "memory"
+# The fake, hashing and memory providers are deterministic local stand-ins (see
+# providers.py); their simulated latencies are set with FAKE_*_LATENCY_MS / _JITTER_MS.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openrouter").lower()
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "huggingface").lower()
+VECTORSTORE_PROVIDER = os.getenv("VECTORSTORE_PROVIDER", "pinecone").lower()
+
+
+def _latency_env(name: str, default_ms: float) -> dict:
+    return {
+        "latency_ms": float(os.getenv(f"FAKE_{name}_LATENCY_MS", str(default_ms))),
+        "jitter_ms": float(os.getenv(f"FAKE_{name}_JITTER_MS", str(default_ms / 4))),
+    }
+
+
+class LazyResource:
+    """
+    A thread-safe, lazily created singleton.
+    The factory runs at most once, on the first call to get(); concurrent callers
+    wait for it instead of building their own copy.
+    """
+
+    def __init__(self, name: str, factory):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._ready = False
+        self.error = None
+
+    def get(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                logger.info(f"Initializing {self.name}...")
+                try:
+                    self._value = self._factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.error = None
+                self._ready = True
+        return self._value
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+
+def _openrouter_llm():
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model="google/gemini-2.5-flash-lite-preview-06-17",
+        openai_api_key=os.getenv("OPENROUTER_API_KEY"),
+        openai_api_base="https://openrouter.ai/api/v1",
+        temperature=0.7,
+        max_tokens=150,  # Reduced token limit
+        max_retries=LLM_MAX_RETRIES, # Retry on failure, within the turn budget
+        timeout=LLM_TIMEOUT_S,
+    )
+
+
+def _fake_llm():
+    from providers import FakeChatModel
+
+    return FakeChatModel(**_latency_env("LLM", 800))
+
+
+def _hashing_embeddings():
+    from providers import HashingEmbeddings
+
+    return HashingEmbeddings(**_latency_env("EMBEDDING", 0))
+
+
+def _pinecone_vectorstore(embedding):
+    from pinecone_handler import connect_vectorstore, upload_vectorstore
+
+    if CATALOG_SYNC_ON_STARTUP:
+        return upload_vectorstore(INDEX_NAME, NAMESPACE, embedding=embedding)
+    return connect_vectorstore(INDEX_NAME, NAMESPACE, embedding=embedding)
+
+
+def _memory_vectorstore(embedding):
+    from providers import LocalVectorStore
+
+    vectorstore = LocalVectorStore(embedding, **_latency_env("VECTORSTORE", 40))
+    vectorstore.add_documents(get_catalog_documents())
+    return vectorstore
+
+
+def _load_catalog():
+    from pinecone_handler import prepare_documents
+
+    return prepare_documents()
+
+
+LLM_PROVIDERS = {"openrouter": _openrouter_llm, "fake": _fake_llm}
+VECTORSTORE_PROVIDERS = {"pinecone": _pinecone_vectorstore, "memory": _memory_vectorstore}
+
+
+def _select(providers: dict, choice: str, variable: str):
+    if choice not in providers:
+        raise ValueError(f"Unknown {variable} '{choice}'. Expected one of: {', '.join(providers)}.")
+    return providers[choice]
+
+
+def _build_llm():
+    return _select(LLM_PROVIDERS, LLM_PROVIDER, "LLM_PROVIDER")()
+
+
+def load_embedding_model(backend: str = None):
+    """A new embedding model for the backend (EMBEDDING_BACKEND by default), without query batching."""
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "hashing":
+        return _hashing_embeddings()
+    from pinecone_handler import load_embeddings
+
+    return load_embeddings(backend)
+
+
+class TimedEmbeddings(Embeddings):
+    """Records each embedding call under the embedder stage, with or without query batching."""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with time_stage("embedder", "embed_documents"):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with time_stage("embedder", "embed_query"):
+            return self.embeddings.embed_query(text)
+
+
+def _build_embeddings():
+    embeddings = load_embedding_model()
+    if EMBEDDING_BATCH_MAX_WAIT_MS > 0:
+        from embedding_batcher import BatchingEmbeddings
+
+        embeddings = BatchingEmbeddings(
+            embeddings,
+            max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS,
+        )
+    return TimedEmbeddings(embeddings)
+
+
+def _build_vectorstore():
+    return _select(VECTORSTORE_PROVIDERS, VECTORSTORE_PROVIDER, "VECTORSTORE_PROVIDER")(get_embeddings())
+
+
+def _build_retriever():
+    return get_vectorstore().as_retriever(search_kwargs={"k": RETRIEVER_K})
+
+
 # --- LLM and RAG Setup ---
-llm = ChatOpenAI(
-    model="google/gemini-2.5-flash-lite-preview-06-17",
-    openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-    openai_api_base="https://openrouter.ai/api/v1",
-    temperature=0.7,
-    max_tokens=150,  # Reduced token limit
-    max_retries=3, # Retry on failure
-)
-vectorstore = upload_vectorstore("life-insurance")
-retriever = vectorstore.as_retriever(search_kwargs={"k": 1})
+_llm = LazyResource("llm", _build_llm)
+_embeddings = LazyResource("embeddings", _build_embeddings)
+_vectorstore = LazyResource("vectorstore", _build_vectorstore)
+_retriever = LazyResource("retriever", _build_retriever)
+# Read only when an index is built from it, so it is not part of readiness
+_catalog = LazyResource("catalog snapshot", _load_catalog)
+
+_RESOURCES = [_llm, _embeddings, _vectorstore, _retriever]
+
+
+def get_llm():
+    """Returns the shared chat model, creating it on first use."""
+    return _llm.get()
+
+
+def get_embeddings():
+    """Returns the shared embedding model, loading it on first use."""
+    return _embeddings.get()
+
+
+def get_vectorstore():
+    """Returns the shared vector store, connecting (and syncing the catalog) on first use."""
+    return _vectorstore.get()
+
+
+def get_retriever():
+    """Returns the shared retriever over the policy vector store."""
+    return _retriever.get()
+
+
+def get_catalog_documents():
+    """Returns the policy_catalog as documents, read from MySQL on first use."""
+    return _catalog.get()
+
+
+def sync_catalog() -> bool:
+    """
+    Rebuilds the Pinecone index by streaming the catalog through the ingestion pipeline.
+    Returns False for providers without a persistent index to rebuild.
+    """
+    if VECTORSTORE_PROVIDER != "pinecone":
+        return False
+    from pinecone_handler import upload_vectorstore
+
+    upload_vectorstore(INDEX_NAME, NAMESPACE, embedding=get_embeddings())
+    _retrieval_cache.invalidate()
+    return True
+
+
+_llm_flight = SingleFlight("llm")
+_llm_breaker = CircuitBreaker("llm")
+_retriever_breaker = CircuitBreaker("retriever")
+
+
+def _invoke_llm_now(prompt: str):
+    budget = remaining()
+    if budget is None:
+        return get_llm().invoke(prompt)
+    # Let the HTTP client give up when the turn does, instead of holding a worker
+    return get_llm().invoke(prompt, timeout=min(LLM_TIMEOUT_S, budget))
+
+
+class TokenSink:
+    """
+    Where streamed answer text goes. Once closed (the deadline fired, the turn ended or
+    the client went away) it drops text, and streams stop reading at their next chunk.
+    """
+
+    def __init__(self, send: Callable[[str], None]):
+        self._send = send
+        self.closed = False
+
+    def __call__(self, text: str):
+        if not self.closed:
+            self._send(text)
+
+    def close(self):
+        self.closed = True
+
+
+# Where streamed answer text goes in this context; set by transports that can stream
+_token_sink: contextvars.ContextVar[Optional[TokenSink]] = contextvars.ContextVar("llm_token_sink", default=None)
+
+
+@contextmanager
+def stream_tokens(sink: TokenSink):
+    """
+    Sends the text of LLM calls made with invoke_llm(..., stream=True) inside the block
+    to sink as it is generated. sink is called from worker threads and is closed when
+    the block exits, so a stream that outlives it stops.
+    """
+    token = _token_sink.set(sink)
+    try:
+        yield
+    finally:
+        _token_sink.reset(token)
+        sink.close()
+
+
+def _stream_llm_now(prompt: str, sink: TokenSink):
+    from langchain_core.messages import AIMessage
+
+    budget = remaining()
+    kwargs = {} if budget is None else {"timeout": min(LLM_TIMEOUT_S, budget)}
+    parts = []
+    for chunk in get_llm().stream(prompt, **kwargs):
+        if sink.closed:
+            # Nobody is listening any more; leaving the loop closes the upstream stream
+            break
+        text = chunk.content if hasattr(chunk, "content") else str(chunk)
+        if text:
+            parts.append(text)
+            sink(text)
+    return AIMessage(content="".join(parts))
+
+
+def invoke_llm(prompt: str, stream: bool = False):
+    """
+    Sends a prompt to the shared chat model within the current turn's budget.
+    Identical prompts that are already in flight (same text up to whitespace)
+    share that call's response instead of hitting the LLM again.
+    With stream=True, and a sink set by stream_tokens(), the answer is also streamed
+    to the sink; such calls are not shared, since each caller needs its own tokens.
+    Only pass stream=True for text that is shown to the user as generated.
+    Raises DeadlineExceeded or CircuitOpenError instead of waiting on a slow or
+    failing upstream; callers answer with their fallback.
+    """
+    sink = _token_sink.get() if stream else None
+    key = normalize_prompt(prompt)
+    handler = current_handler()
+    LLM_CALLS.inc(handler=handler)
+    try:
+        with time_stage("llm", "stream" if sink is not None else "invoke"):
+            if sink is not None:
+                try:
+                    return call_with_deadline(_stream_llm_now, prompt, sink, stage="llm", breaker=_llm_breaker)
+                except Exception:
+                    # The caller answers with its fallback; text still arriving must not follow it
+                    sink.close()
+                    raise
+            return call_with_deadline(
+                lambda: _llm_flight.do(key, _invoke_llm_now, prompt),
+                stage="llm",
+                breaker=_llm_breaker,
+            )
+    except Exception as e:
+        LLM_ERRORS.inc(handler=handler, error=type(e).__name__)
+        raise
+
+
+def _catalog_version() -> int:
+    from sqlconnect import get_catalog_version
+
+    return get_catalog_version()
+
+
+# Only a Pinecone index is rebuilt by syncs in other processes; the in-memory store
+# is built once per process from its own snapshot.
+_retrieval_cache = RetrievalCache(version_source=_catalog_version if VECTORSTORE_PROVIDER == "pinecone" else None)
+
+
+def retrieve(query: str):
+    """
+    Runs the policy retriever within the current turn's budget.
+    Non-empty results are cached per normalized query (see retrieval_cache.py).
+    """
+    key = (normalize_query(query), RETRIEVER_K, NAMESPACE)
+    cached = _retrieval_cache.get(key)
+    if cached is not None:
+        return list(cached)
+    generation = _retrieval_cache.generation
+    with time_stage("retriever", "search"):
+        docs = call_with_deadline(
+            lambda: get_retriever().invoke(query),
+            stage="retriever",
+            breaker=_retriever_breaker,
+        )
+    if docs:
+        _retrieval_cache.put(key, tuple(docs), generation)
+    return docs
+
+
+def warmup():
+    """
+    Eagerly initializes every lazy resource.
+    Called once from the server's startup hook in a background thread, so that
+    health checks are answered while the models load.
+    """
+    for resource in _RESOURCES:
+        try:
+            resource.get()
+        except Exception as e:
+            logger.error(f"Warmup failed for {resource.name}: {e}", exc_info=True)
+            return False
+    logger.info("Warmup complete: all resources are ready.")
+    return True
+
+
+def readiness() -> dict:
+    """Reports which resources are initialized, for the /ready probe."""
+    components = {}
+    for resource in _RESOURCES:
+        if resource.ready:
+            components[resource.name] = "ready"
+        elif resource.error:
+            components[resource.name] = f"error: {resource.error}"
+        else:
+            components[resource.name] = "pending"
+    return {
+        "ready": all(resource.ready for resource in _RESOURCES),
+        "components": components,
+    }
+
 
 # --- Prompt for the Recommendation Phase ---
 RECOMMENDATION_PROMPT = PromptTemplate(
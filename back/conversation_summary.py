@@ -0,0 +1,153 @@
+"""
+Rolling per-user conversation summary, so prompts stop growing with the conversation.
+
+Prompts used to inline the last five exchanges verbatim, quote tables and policy
+detail dumps included. They now carry `conversation_summary` (a few sentences kept
+in user_context) plus the messages logged after it (`summary_log_id`) verbatim:
+the last SUMMARY_RECENT_TURNS exchanges and whatever has aged out of them but has not
+been folded in yet, so nothing falls between the summary and the recent turns.
+
+After each turn, schedule() hands the user to a small background pool. It reads the
+chat_log messages past `summary_log_id`, leaves the most recent turns alone, folds
+the older ones into the summary with one short LLM call and stores both columns.
+Nothing on the request path waits for it; if it falls behind or fails, prompts just
+carry a slightly older summary.
+"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import chat_sockets
+from dotenv import load_dotenv
+from metrics import counter, handler_scope
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_RECENT_TURNS = int(os.getenv("SUMMARY_RECENT_TURNS", "2"))
+# Fold once at least this many messages (two per turn) have aged out of the recent turns,
+# so the summary costs one LLM call every few turns rather than one per turn
+SUMMARY_MIN_FOLD_MESSAGES = int(os.getenv("SUMMARY_MIN_FOLD_MESSAGES", "8"))
+SUMMARY_MAX_FOLD_MESSAGES = int(os.getenv("SUMMARY_MAX_FOLD_MESSAGES", "40"))
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "800"))
+# Longer messages (quote tables, policy dumps) are clipped when shown or folded
+SUMMARY_MESSAGE_CHARS = int(os.getenv("SUMMARY_MESSAGE_CHARS", "400"))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+SUMMARY_LLM_TIMEOUT_S = float(os.getenv("SUMMARY_LLM_TIMEOUT_S", "30"))
+
+SUMMARIES = counter("conversation_summaries_total", "Background conversation summary runs, by outcome.", ("outcome",))
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and a life insurance assistant.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Rewrite the summary to include the new messages in at most {max_words} words. Keep the facts
+that matter later: the user's needs and constraints, policies discussed or selected, quotes
+given (plan, sum assured, premium), questions still open and decisions made. Leave out
+greetings and repeated wording. Reply with the summary only."""
+
+_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summary")
+_in_progress: set[int] = set()
+_in_progress_lock = threading.Lock()
+
+
+def _clip(text: str, limit: int = SUMMARY_MESSAGE_CHARS) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit] + " …"
+
+
+def _format_messages(messages: list[tuple]) -> str:
+    return "\n".join(f"{'user' if message_type == 'user' else 'assistant'}: {_clip(text)}"
+                     for message_type, text in messages)
+
+
+def prompt_history(bot) -> str:
+    """
+    The conversation as prompts should see it: the summary, then every message logged
+    after the last one folded into it. At most SUMMARY_MAX_FOLD_MESSAGES plus the recent
+    turns are shown, which only cuts in when the background folds fall far behind.
+    """
+    from sqlconnect import get_latest_user_messages_after
+
+    limit = SUMMARY_MAX_FOLD_MESSAGES + 2 * SUMMARY_RECENT_TURNS
+    rows = get_latest_user_messages_after(bot.user_id, bot.context.get("summary_log_id") or 0, limit)
+    recent = _format_messages([(message_type, message) for _, message_type, message in rows])
+    summary = bot.context.get("conversation_summary")
+    if not summary:
+        return recent
+    return f"Summary of the earlier conversation: {summary}\n\nMessages since then:\n{recent}"
+
+
+def fold_messages(summary: Optional[str], messages: list[tuple]) -> str:
+    """
+    One LLM call that merges (message_type, text) pairs into the summary. It goes to the
+    model directly rather than through invoke_llm, so background failures do not count
+    against the circuit breaker that guards user-facing turns.
+    """
+    from config import get_llm
+
+    prompt = SUMMARY_PROMPT.format(
+        summary=summary or "(none yet)",
+        messages=_format_messages(messages),
+        max_words=max(SUMMARY_MAX_CHARS // 7, 20),
+    )
+    response = get_llm().invoke(prompt, timeout=SUMMARY_LLM_TIMEOUT_S)
+    text = response.content if hasattr(response, "content") else str(response)
+    return _clip(text, SUMMARY_MAX_CHARS)
+
+
+def update_summary(user_id: int, summary: Optional[str], summary_log_id: int) -> Optional[str]:
+    """
+    Folds the user's messages older than the recent turns into the summary and stores it.
+    Returns the new summary, or None when there was not enough to fold.
+    """
+    from sqlconnect import get_user_messages_after, update_user_context
+
+    keep = 2 * SUMMARY_RECENT_TURNS
+    rows = get_user_messages_after(user_id, summary_log_id, SUMMARY_MAX_FOLD_MESSAGES + keep)
+    to_fold = rows[:len(rows) - keep] if keep else rows
+    if len(to_fold) < SUMMARY_MIN_FOLD_MESSAGES:
+        return None
+
+    with handler_scope("update_conversation_summary", "background"):
+        new_summary = fold_messages(summary, [(message_type, message) for _, message_type, message in to_fold])
+    update_user_context(user_id, {"conversation_summary": new_summary, "summary_log_id": to_fold[-1][0]})
+    return new_summary
+
+
+def _run(user_id: int):
+    from sqlconnect import get_conversation_summary
+
+    try:
+        # Read from the database, not the caller's context: a bot kept by a socket still
+        # holds whatever summary and watermark it was loaded with
+        summary, summary_log_id = get_conversation_summary(user_id)
+        updated = update_summary(user_id, summary, summary_log_id) is not None
+        outcome = "updated" if updated else "skipped"
+        if updated:
+            # Bots held by open sockets pick the new summary up before their next turn
+            chat_sockets.mark_stale(user_id)
+    except Exception as e:
+        outcome = "failed"
+        logger.warning(f"Conversation summary for user {user_id} failed: {e}")
+    finally:
+        with _in_progress_lock:
+            _in_progress.discard(user_id)
+    SUMMARIES.inc(outcome=outcome)
+
+
+def schedule(bot):
+    """Queues a summary update for the bot's user, unless one is already running for them."""
+    user_id = bot.user_id
+    with _in_progress_lock:
+        if user_id in _in_progress:
+            return
+        _in_progress.add(user_id)
+    _executor.submit(_run, user_id)
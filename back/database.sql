@@ -1,6 +1,12 @@
 -- This script defines the necessary tables for the Life Insurance Chatbot.
 -- It includes DROP statements to ensure a clean setup.
 
+DROP TABLE IF EXISTS `outbox_event`;
+DROP TABLE IF EXISTS `catalog_version`;
+DROP TABLE IF EXISTS `funnel_rollup_watermark`;
+DROP TABLE IF EXISTS `funnel_user_state`;
+DROP TABLE IF EXISTS `funnel_hourly`;
+DROP TABLE IF EXISTS `state_transition_event`;
 DROP TABLE IF EXISTS `chat_log`;
 DROP TABLE IF EXISTS `lead_capture`;
 DROP TABLE IF EXISTS `user_quotations`;
@@ -26,6 +32,7 @@ CREATE TABLE IF NOT EXISTS user_info (
   existing_policy VARCHAR(100),
   annual_income BIGINT,
   gst_applicable VARCHAR(10) DEFAULT 'No',
+  is_shadow TINYINT(1) NOT NULL DEFAULT 0,
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (user_id)
 );
@@ -51,6 +58,10 @@ CREATE TABLE IF NOT EXISTS user_context (
   faq_topic_focus VARCHAR(100),
   diversion_count INT DEFAULT 0,
 
+  -- Rolling summary of the turns older than the prompt window (conversation_summary.py)
+  conversation_summary TEXT,
+  summary_log_id INT DEFAULT 0,
+
   -- Quotation Input
   plan_option VARCHAR(100),
   coverage_required BIGINT,
@@ -121,9 +132,13 @@ CREATE TABLE IF NOT EXISTS `user_quotations` (
   `base_premium` BIGINT,
   `gst_amount` BIGINT,
   `total_premium` BIGINT,
+  -- SHA-256 of the normalized form inputs; repeat submissions reuse quote_response
+  `input_hash` CHAR(64),
+  `quote_response` JSON,
   `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`quotation_id`),
-  INDEX `fk_user_quotations_user_id_idx` (`user_id` ASC),
+  INDEX `idx_user_quotations_user_created` (`user_id` ASC, `created_at` ASC),
+  INDEX `idx_user_quotations_user_input` (`user_id` ASC, `input_hash` ASC, `created_at` ASC),
   CONSTRAINT `fk_user_quotations_user_id`
     FOREIGN KEY (`user_id`)
     REFERENCES `user_info` (`user_id`)
@@ -171,7 +186,7 @@ CREATE TABLE IF NOT EXISTS `lead_capture` (
   `contact_value` VARCHAR(255) NOT NULL,
   `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`lead_id`),
-  INDEX `fk_lead_capture_user_id_idx` (`user_id` ASC),
+  INDEX `idx_lead_capture_user_created` (`user_id` ASC, `created_at` ASC),
   CONSTRAINT `fk_lead_capture_user_id`
     FOREIGN KEY (`user_id`)
     REFERENCES `user_info` (`user_id`)
@@ -191,9 +206,92 @@ CREATE TABLE IF NOT EXISTS `chat_log` (
   `timestamp` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`log_id`),
   INDEX `fk_chat_log_user_id_idx` (`user_id` ASC),
+  INDEX `idx_chat_log_user_timestamp` (`user_id` ASC, `timestamp` ASC, `log_id` ASC),
   CONSTRAINT `fk_chat_log_user_id`
     FOREIGN KEY (`user_id`)
     REFERENCES `user_info` (`user_id`)
     ON DELETE CASCADE
     ON UPDATE NO ACTION
 );
+
+-- -----------------------------------------------------
+-- Table `state_transition_event`
+-- Append-only log of conversation state changes, written with the context update.
+-- No foreign key: analytics history outlives deleted users and inserts stay cheap.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `state_transition_event` (
+  `event_id` BIGINT NOT NULL AUTO_INCREMENT,
+  `user_id` INT NOT NULL,
+  `from_state` VARCHAR(100) NULL,
+  `to_state` VARCHAR(100) NOT NULL,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`event_id`),
+  INDEX `idx_state_transition_event_user_created` (`user_id` ASC, `created_at` ASC)
+);
+
+-- -----------------------------------------------------
+-- Table `funnel_hourly`
+-- Hourly rollup of state_transition_event, maintained incrementally by funnel.py.
+-- entries counts every transition into the state; new_users counts users reaching it
+-- for the first time, so it can be summed over any range of hours.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `funnel_hourly` (
+  `bucket_hour` DATETIME NOT NULL,
+  `state` VARCHAR(100) NOT NULL,
+  `entries` INT NOT NULL DEFAULT 0,
+  `new_users` INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (`bucket_hour`, `state`),
+  INDEX `idx_funnel_hourly_state_bucket` (`state` ASC, `bucket_hour` ASC)
+);
+
+-- -----------------------------------------------------
+-- Table `funnel_user_state`
+-- First time each user reached each state; lets the rollup tell new users from repeats.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `funnel_user_state` (
+  `user_id` INT NOT NULL,
+  `state` VARCHAR(100) NOT NULL,
+  `first_reached_at` TIMESTAMP NOT NULL,
+  PRIMARY KEY (`user_id`, `state`)
+);
+
+-- -----------------------------------------------------
+-- Table `funnel_rollup_watermark`
+-- Single row holding the last state_transition_event folded into the rollups.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `funnel_rollup_watermark` (
+  `id` TINYINT NOT NULL,
+  `last_event_id` BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`)
+);
+
+-- -----------------------------------------------------
+-- Table `catalog_version`
+-- Single row bumped by every catalog sync; retrieval caches drop their entries when it moves.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `catalog_version` (
+  `id` TINYINT NOT NULL,
+  `version` BIGINT NOT NULL DEFAULT 0,
+  `synced_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`)
+);
+
+-- -----------------------------------------------------
+-- Table `outbox_event`
+-- status: pending (waiting or retrying), done (applied) or dead (gave up, see last_error).
+-- Workers claim due pending rows in event_id order with FOR UPDATE SKIP LOCKED.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `outbox_event` (
+  `event_id` BIGINT NOT NULL AUTO_INCREMENT,
+  `user_id` INT NOT NULL,
+  `kind` VARCHAR(50) NOT NULL,
+  `payload` JSON NOT NULL,
+  `status` ENUM('pending', 'done', 'dead') NOT NULL DEFAULT 'pending',
+  `attempts` INT NOT NULL DEFAULT 0,
+  `available_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `last_error` TEXT NULL,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `processed_at` TIMESTAMP NULL,
+  PRIMARY KEY (`event_id`),
+  INDEX `idx_outbox_event_status_available` (`status` ASC, `available_at` ASC, `event_id` ASC)
+);
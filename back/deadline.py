@@ -0,0 +1,151 @@
+import math
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Optional
+from profiling import thread_scope
+
+logger = logging.getLogger(__name__)
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("turn_deadline", default=None)
+
+# Upstream calls run here so a caller can stop waiting when its budget runs out.
+# A call that overruns keeps its worker until the client-side timeout ends it.
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="upstream")
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a turn's latency budget is spent before or during an upstream call."""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+@contextmanager
+def turn_budget(seconds: float):
+    """Gives everything inside the block a shared deadline `seconds` from now."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current turn's budget, or None outside a budget."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def remaining_seconds_ceil(minimum: int = 1) -> Optional[int]:
+    """The remaining budget rounded up to whole seconds, for clients that take integer timeouts."""
+    budget = remaining()
+    if budget is None:
+        return None
+    return max(minimum, math.ceil(budget))
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream after `failure_threshold` consecutive failures.
+    While open, calls fail immediately with CircuitOpenError. After `reset_timeout`
+    seconds one trial call is let through; success closes the circuit again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half_open" and self._trial_in_flight):
+                raise CircuitOpenError(f"Circuit for '{self.name}' is open; skipping call.")
+            if state == "half_open":
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit for '{self.name}' closed after a successful trial call.")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Circuit for '{self.name}' opened after {self._failures} consecutive failures.")
+                self._opened_at = time.monotonic()
+
+
+def _run_in_scope(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    # Executor threads work for whichever request submitted the call
+    with thread_scope():
+        return fn(*args, **kwargs)
+
+
+def _record_outcome(breaker: CircuitBreaker, future):
+    if future.exception() is not None:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def call_with_deadline(fn: Callable[..., Any], *args, stage: str, breaker: CircuitBreaker = None, **kwargs) -> Any:
+    """
+    Runs an upstream call within the remaining turn budget.
+    Raises DeadlineExceeded if the budget is already spent or runs out while waiting,
+    and CircuitOpenError if the stage's breaker is open. Outside a budget the call
+    runs inline with no extra limit.
+
+    The breaker hears how the call itself ended, not whether this turn could wait for
+    it: a call that outlives the budget left by earlier stages is recorded when it
+    finishes, as a success or as the failure its own client timeout raises.
+    """
+    budget = remaining()
+    if budget is not None and budget <= 0:
+        raise DeadlineExceeded(f"No latency budget left for {stage}.")
+    if breaker:
+        breaker.before_call()
+
+    if budget is None:
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            if breaker:
+                breaker.record_failure()
+            raise
+        if breaker:
+            breaker.record_success()
+        return result
+
+    future = _executor.submit(contextvars.copy_context().run, _run_in_scope, fn, *args, **kwargs)
+    if breaker:
+        future.add_done_callback(lambda done: _record_outcome(breaker, done))
+    try:
+        return future.result(timeout=budget)
+    except FutureTimeout:
+        raise DeadlineExceeded(f"{stage} did not finish within the remaining {budget:.2f}s budget.")
@@ -0,0 +1,98 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from metrics import histogram, time_stage
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = histogram(
+    "embedding_batch_size",
+    "Number of queries embedded together in one forward pass.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+QUEUE_WAIT = histogram(
+    "embedding_queue_wait_seconds",
+    "Time a query waited in the batching queue before its forward pass started.",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Coalesces embed_query calls from concurrent requests into batched forward passes.
+
+    A single dispatcher thread takes the first waiting query, then keeps collecting
+    for up to max_wait_ms or until max_batch_size queries are queued, embeds them in
+    one embed_documents call and hands each caller its own vector.
+    embed_documents is passed straight through, since bulk callers batch already.
+    The dispatcher starts on first use, and again in a forked child, which inherits
+    the object but not the thread.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_dispatcher(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue: "queue.Queue[tuple]" = queue.Queue()
+                threading.Thread(target=self._run, args=(self._queue,), name="embedding-batcher", daemon=True).start()
+                self._pid = os.getpid()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self._ensure_dispatcher()
+        future: Future = Future()
+        self._queue.put((text, time.perf_counter(), future))
+        return future.result()
+
+    def _collect(self, pending: queue.Queue) -> list:
+        batch = [pending.get()]
+        deadline = batch[0][1] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, pending: queue.Queue):
+        while True:
+            batch = self._collect(pending)
+            started = time.perf_counter()
+            for _, enqueued, _ in batch:
+                QUEUE_WAIT.observe(started - enqueued)
+
+            # Identical queries (e.g. the templated recommendation search) share one row
+            unique_texts = list(dict.fromkeys(text for text, _, _ in batch))
+            BATCH_SIZE.observe(len(unique_texts))
+            try:
+                # bge embeds queries and documents the same way, so one embed_documents
+                # call serves every query in the batch
+                with time_stage("embedder", "embed_query_batch"):
+                    vectors = dict(zip(unique_texts, self.embeddings.embed_documents(unique_texts)))
+            except Exception as e:
+                logger.error(f"Batched embedding of {len(unique_texts)} queries failed: {e}", exc_info=True)
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for text, _, future in batch:
+                future.set_result(vectors[text])
@@ -0,0 +1,136 @@
+"""
+Streaming bulk export of leads with their user profile and latest quote.
+
+    python export.py --format csv --gzip --output leads.csv.gz
+    python export.py --format ndjson --watermark-file .lead_export_watermark >> leads.ndjson
+
+Rows come off an unbuffered MySQL cursor and are encoded and (optionally) gzipped
+chunk by chunk, so memory stays flat however many leads there are. An export covers
+the leads in (since_id, watermark], where the watermark is the highest lead_id when
+the export starts, among leads older than EXPORT_SETTLE_S; passing it back as since_id
+exports only the leads added since. The lag matters because leads are inserted by
+concurrent outbox transactions: a lower lead_id can commit after a higher one, and a
+watermark taken past it would skip it for good.
+The same stream backs GET /admin/export/leads.
+"""
+import os
+import io
+import csv
+import sys
+import zlib
+import logging
+import argparse
+from typing import Iterable, Iterator, Optional
+
+from dotenv import load_dotenv
+from serialization import dumps_bytes
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+# Longer than an outbox batch transaction can stay open, so every lead below the watermark has committed
+EXPORT_SETTLE_S = int(os.getenv("EXPORT_SETTLE_S", "60"))
+EXPORT_FORMATS = ("csv", "ndjson")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _encode_csv(chunks: Iterable[list[dict]], columns) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _encode_ndjson(chunks: Iterable[list[dict]]) -> Iterator[bytes]:
+    for rows in chunks:
+        yield b"".join(dumps_bytes(row) + b"\n" for row in rows)
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compresses a byte stream into a single gzip member as it goes."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_leads(fmt: str = "csv", since_id: int = 0, upto_id: Optional[int] = None, compress: bool = False,
+                 chunk_size: int = EXPORT_CHUNK_ROWS) -> tuple[int, Iterator[bytes]]:
+    """
+    Returns (watermark, byte stream) for the leads in (since_id, watermark]. The query
+    only runs once the stream is iterated.
+    """
+    from sqlconnect import LEAD_EXPORT_COLUMNS, get_max_lead_id, stream_lead_export
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'; expected one of {', '.join(EXPORT_FORMATS)}.")
+    watermark = get_max_lead_id(EXPORT_SETTLE_S) if upto_id is None else upto_id
+    watermark = max(watermark, since_id)
+
+    chunks = stream_lead_export(since_id, watermark, chunk_size)
+    stream = _encode_csv(chunks, LEAD_EXPORT_COLUMNS) if fmt == "csv" else _encode_ndjson(chunks)
+    if compress:
+        stream = gzip_stream(stream)
+    return watermark, stream
+
+
+def _read_watermark(path: str) -> int:
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _write_watermark(path: str, watermark: int):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(f"{watermark}\n")
+    os.replace(tmp_path, path)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Stream leads joined with their user and latest quote.")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true", help="Gzip the output on the fly.")
+    parser.add_argument("--since-id", type=int, default=None, help="Export leads with a higher lead_id only.")
+    parser.add_argument("--watermark-file", default=None,
+                        help="Read since-id from this file and store the new watermark in it after a complete export.")
+    parser.add_argument("--output", default="-", help="Output file; '-' for stdout.")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    since_id = args.since_id
+    if since_id is None:
+        since_id = _read_watermark(args.watermark_file) if args.watermark_file else 0
+
+    watermark, stream = export_leads(args.format, since_id, compress=args.gzip, chunk_size=args.chunk_size)
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        written = 0
+        for chunk in stream:
+            out.write(chunk)
+            written += len(chunk)
+        out.flush()
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    if args.watermark_file:
+        _write_watermark(args.watermark_file, watermark)
+    logger.info(f"Exported leads {since_id + 1}..{watermark} ({written} bytes); next export: --since-id {watermark}")
+
+
+if __name__ == "__main__":
+    main()
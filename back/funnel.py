@@ -0,0 +1,136 @@
+"""
+Conversion funnel analytics from incrementally maintained hourly rollups.
+
+    python funnel.py rollup                       # fold new transition events into funnel_hourly
+    python funnel.py report --days 7              # funnel and drop-off for the last week
+
+Every conversation state change is appended to state_transition_event in the same
+transaction as the context update. rollup() folds events past a watermark into
+funnel_hourly, so reading a funnel only sums a few rows per state and hour however
+much traffic there has been. The API runs rollup() every FUNNEL_ROLLUP_INTERVAL_S.
+"""
+import os
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+from metrics import counter
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FUNNEL_ROLLUP_INTERVAL_S = float(os.getenv("FUNNEL_ROLLUP_INTERVAL_S", "60"))
+FUNNEL_ROLLUP_BATCH_SIZE = int(os.getenv("FUNNEL_ROLLUP_BATCH_SIZE", "5000"))
+FUNNEL_ROLLUP_SETTLE_S = int(os.getenv("FUNNEL_ROLLUP_SETTLE_S", "10"))
+
+# The conversion path, in order. Drop-off is measured between consecutive steps.
+FUNNEL_STEPS = (
+    "collect_employment_status",
+    "collect_annual_income",
+    "recommendation_phase",
+    "recommendation_given_phase",
+    "generate_premium_quotation",
+    "quote_displayed",
+    "application",
+    "contact_capture",
+    "email_capture",
+    "follow_up",
+)
+
+ROLLED_UP_EVENTS = counter("funnel_rollup_events_total", "State transition events folded into the funnel rollups.")
+
+
+def rollup(batch_size: int = FUNNEL_ROLLUP_BATCH_SIZE, settle_seconds: int = FUNNEL_ROLLUP_SETTLE_S,
+           max_batches: Optional[int] = None) -> int:
+    """Folds pending events into the rollups, batch by batch, and returns how many were folded."""
+    from sqlconnect import rollup_state_transitions
+
+    total, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        folded = rollup_state_transitions(batch_size, settle_seconds)
+        batches += 1
+        total += folded
+        ROLLED_UP_EVENTS.inc(folded)
+        if folded < batch_size:
+            break
+    return total
+
+
+def funnel_report(start: datetime, end: datetime, steps=FUNNEL_STEPS) -> dict:
+    """
+    Users reaching each step for the first time between start and end, and how that
+    compares with the previous step.
+
+    conversion is a ratio of arrivals within the window, users reaching this step over
+    users reaching the previous one, not a per-user conversion rate: users who reached
+    the previous step before the window, or skipped it, can push it over 1. It is
+    clamped to 1, so drop_off is never negative.
+    """
+    from sqlconnect import get_funnel_totals
+
+    totals = get_funnel_totals(start, end)
+    report = []
+    previous = None
+    for state in steps:
+        counts = totals.get(state, {"entries": 0, "new_users": 0})
+        step = {"state": state, "users": counts["new_users"], "entries": counts["entries"]}
+        if previous is not None:
+            step["conversion"] = round(min(counts["new_users"] / previous, 1.0), 4) if previous else None
+            step["drop_off"] = round(1 - step["conversion"], 4) if previous else None
+        report.append(step)
+        previous = counts["new_users"]
+    return {"start": start.isoformat(), "end": end.isoformat(), "steps": report}
+
+
+def _rollup_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            folded = rollup()
+            if folded:
+                logger.debug(f"Funnel rollup folded {folded} events")
+        except Exception as e:
+            logger.warning(f"Funnel rollup failed: {e}")
+
+
+def start_rollup_thread(interval: float = FUNNEL_ROLLUP_INTERVAL_S) -> Optional[threading.Thread]:
+    """Runs rollup() every interval seconds in a daemon thread; 0 disables it."""
+    if interval <= 0:
+        return None
+    thread = threading.Thread(target=_rollup_loop, args=(interval,), name="funnel-rollup", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain and read the conversion funnel rollups.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rollup_parser = subparsers.add_parser("rollup", help="Fold new state transition events into the rollups.")
+    rollup_parser.add_argument("--batch-size", type=int, default=FUNNEL_ROLLUP_BATCH_SIZE)
+    rollup_parser.add_argument("--max-batches", type=int, default=None)
+
+    report_parser = subparsers.add_parser("report", help="Print the funnel for a recent period.")
+    report_parser.add_argument("--days", type=int, default=7)
+
+    args = parser.parse_args()
+    if args.command == "rollup":
+        folded = rollup(batch_size=args.batch_size, max_batches=args.max_batches)
+        print(f"Folded {folded} events into the funnel rollups.")
+    else:
+        end = datetime.now()
+        report = funnel_report(end - timedelta(days=args.days), end)
+        print(f"Funnel {report['start']} .. {report['end']}")
+        for step in report["steps"]:
+            drop = f"  drop-off {step['drop_off']:.1%}" if step.get("drop_off") is not None else ""
+            print(f"  {step['state']:<28} {step['users']:>8} users {step['entries']:>8} entries{drop}")
+
+
+if __name__ == "__main__":
+    main()
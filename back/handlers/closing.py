@@ -1,6 +1,5 @@
 import re
 from typing import Any, Dict
-from sqlconnect import create_lead
 
 # --- Phase 3: Structured Closing ---
 
@@ -37,13 +36,13 @@ def handle_email_capture(bot, query: str) -> Dict[str, Any]:
             "context_state": "follow_up"
         })
 
-        create_lead(
-            user_id=bot.user_id,
-            name=name,
-            policy_id=bot.context.get("selected_policy"),
-            contact_method="email",
-            contact_value=email
-        )
+        # Written by the outbox workers, atomically with the move to follow_up
+        bot.enqueue_side_effect("lead", {
+            "name": name,
+            "policy_id": bot.context.get("selected_policy"),
+            "contact_method": "email",
+            "contact_value": email,
+        })
 
         return {
             "answer": f"Thank you, {name}! A confirmation has been sent to {email}. Our team will contact you shortly."
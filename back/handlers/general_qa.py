@@ -2,7 +2,8 @@ import json
 import logging
 from typing import Any, Dict
 from langchain_core.prompts import PromptTemplate
-from config import llm, retriever
+from config import invoke_llm, retrieve
+from conversation_summary import prompt_history
 from sqlconnect import get_policy_by_id
 from utils import get_persistent_actions
 
@@ -50,16 +51,22 @@ def handle_general_questions(bot, query: str) -> Dict[str, Any]:
     Handles a general question using a RAG-based approach.
     """
     # 1. Retrieve relevant documents
-    docs = retriever.invoke(query)
+    try:
+        docs = retrieve(query)
+    except Exception as e:
+        # Answer from the profile and history alone rather than failing the turn
+        logging.warning(f"Retrieval failed in handle_general_questions: {e}")
+        docs = []
     context_str = "\n\n".join([doc.page_content for doc in docs])
 
     # 2. Extract user profile and chat history
     user_profile_items = {
         k: v for k, v in bot.context.items()
-        if k not in ["chat_history", "state_history", "retrieved_docs", "selected_policy"] and v is not None
+        if k not in ["chat_history", "state_history", "retrieved_docs", "selected_policy",
+                     "conversation_summary", "summary_log_id", "is_shadow"] and v is not None
     }
     user_profile = json.dumps(user_profile_items, default=str)
-    chat_history = "\n".join([f"{msg.type}: {msg.content}" for msg in bot.memory.buffer_as_messages])
+    chat_history = prompt_history(bot)
 
     # 3. Fetch selected policy details
     selected_policy_id = bot.context.get("selected_policy")
@@ -121,7 +128,7 @@ Answer:
 
     # 5. LLM call
     try:
-        llm_response = llm.invoke(formatted_prompt)
+        llm_response = invoke_llm(formatted_prompt, stream=True)
         answer = llm_response.content if hasattr(llm_response, 'content') else str(llm_response)
     except Exception as e:
         logging.error(f"Error in handle_general_questions during LLM call: {e}", exc_info=True)
@@ -132,7 +139,7 @@ Answer:
 
 def handle_random_query(bot, query: str) -> Dict[str, Any]:
     """Handles any query that doesn't fit into the structured flow."""
-    chat_history = "\n".join([f"{msg.type}: {msg.content}" for msg in bot.memory.buffer_as_messages])
+    chat_history = prompt_history(bot)
     
     prompt = f"""You are a friendly and helpful assistant. The user has asked something that is not related to the current conversation. 
     
@@ -145,7 +152,7 @@ def handle_random_query(bot, query: str) -> Dict[str, Any]:
     """
     
     try:
-        llm_response = llm.invoke(prompt)
+        llm_response = invoke_llm(prompt, stream=True)
         answer = llm_response.content if hasattr(llm_response, 'content') else str(llm_response)
     except Exception as e:
         logging.error(f"Error in handle_random_query during LLM call: {e}", exc_info=True)
@@ -1,4 +1,4 @@
-from config import llm
+from config import invoke_llm
 from langchain_core.prompts import PromptTemplate
 
 def recognize_intent(query: str, chat_history: str) -> str:
@@ -45,7 +45,7 @@ def recognize_intent(query: str, chat_history: str) -> str:
     )
 
     try:
-        response = llm.invoke(formatted_prompt)
+        response = invoke_llm(formatted_prompt)
         # Extract the intent from the response, ensuring it's one of the valid intents
         predicted_intent = response.content.strip().lower().replace(" ", "_")
         return predicted_intent if predicted_intent in intents else "onboarding"
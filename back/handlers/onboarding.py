@@ -1,5 +1,5 @@
 from typing import Any, Dict
-from sqlconnect import update_user_context, update_user_info, get_user_by_id
+from sqlconnect import update_user_context, get_user_by_id
 from utils import clean_button_input
 
 # --- Phase 1: Structured Onboarding ---
@@ -13,9 +13,9 @@ def handle_existing_policy(bot, query: str) -> Dict[str, Any]:
             "existing_policy": cleaned_query,
             "context_state": "collect_employment_status"
         })
-        update_user_info(bot.user_id, {"existing_policy": cleaned_query})
-        # Proceed to collect employment status
-        return handle_employment_status(bot, "")
+        bot.write_with_context("user_info", {"updates": {"existing_policy": cleaned_query}})
+        # The state machine moves on to collect employment status
+        return {}
     
     return {
         "answer": f"Welcome, {name}! To help you find the best-fit insurance plan, I have a few quick questions.",
@@ -31,8 +31,8 @@ def handle_employment_status(bot, query: str) -> Dict[str, Any]:
             "context_state": "collect_annual_income"
         })
         # Also update the user_info table
-        update_user_info(bot.user_id, {"employment_status": cleaned_query})
-        return handle_annual_income(bot, "")
+        bot.write_with_context("user_info", {"updates": {"employment_status": cleaned_query}})
+        return {}
     
     return {
         "answer": "What is your current employment status?",
@@ -58,13 +58,12 @@ def handle_annual_income(bot, query: str) -> Dict[str, Any]:
             "context_state": "recommendation_phase"  # End of onboarding
         })
         # Also update the user_info table
-        update_user_info(bot.user_id, {"annual_income": income_value})
+        bot.write_with_context("user_info", {"updates": {"annual_income": income_value}})
         
         # Check if context is complete before moving to recommendation
         if bot._validate_context_completeness():
-            # Use a local import to avoid circular dependency
-            from .recommendation import handle_recommendation_phase
-            return handle_recommendation_phase(bot, "My profile is complete. Please give me recommendations.")
+            # The state machine runs the recommendation phase next
+            return {}
         else:
             # This should not happen if the flow is correct, but as a fallback
             return {"answer": "I still need a few more details. Let's continue."}
@@ -1,13 +1,42 @@
+import os
 import logging
 import json
+import hashlib
 from typing import Any, Dict
-from config import llm
+from config import invoke_llm
 from sqlconnect import update_user_context, get_user_info_for_quote
 from utils import generate_quote_number, get_persistent_actions
 from premium_calculator import calculate_premium
 
 logger = logging.getLogger(__name__)
 
+# A resubmitted quote form with unchanged inputs reuses the quote priced within this window
+QUOTE_REUSE_WINDOW_SECONDS = int(os.getenv("QUOTE_REUSE_WINDOW_SECONDS", "900"))
+
+# The form fields the quote depends on; phone_number only identifies the user
+QUOTE_INPUT_KEYS = (
+    "dob", "gender", "nationality", "marital_status", "education", "gst_applicable",
+    "plan_option", "coverage_required", "premium_budget", "policy_term",
+    "premium_payment_term", "premium_frequency", "income_payout_frequency",
+)
+
+
+def _normalize_quote_value(value: Any) -> Any:
+    if isinstance(value, str):
+        value = " ".join(value.split())
+        # "20" from a dropdown and 20 from a slider price the same
+        return int(value) if value.isdigit() else value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def quote_input_hash(user_id: int, form_data: Dict[str, Any]) -> str:
+    """SHA-256 of the user and the normalized quote inputs, used to spot resubmissions."""
+    normalized = {key: _normalize_quote_value(form_data.get(key)) for key in QUOTE_INPUT_KEYS}
+    payload = json.dumps([user_id, normalized], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
 def handle_generate_premium_quotation(bot, query: str) -> Dict[str, Any]:
     """
     Generates a friendly prompt to encourage the user to fill out the quotation form.
@@ -34,7 +63,7 @@ def handle_generate_premium_quotation(bot, query: str) -> Dict[str, Any]:
     """
     
     try:
-        llm_response = llm.invoke(prompt)
+        llm_response = invoke_llm(prompt, stream=True)
         answer = llm_response.content if hasattr(llm_response, 'content') else str(llm_response)
     except Exception as e:
         logging.error(f"Error in handle_generate_premium_quotation during LLM call: {e}", exc_info=True)
@@ -143,7 +172,9 @@ class QuotationHandler:
         }
         
         logger.debug(f"Updating user context with quote data: {quote_updates}")
-        update_user_context(self.user_id, quote_updates)
+        previous_state = self.context.get("context_state")
+        transitions = [(previous_state, "quote_displayed")] if previous_state != "quote_displayed" else []
+        update_user_context(self.user_id, quote_updates, transitions=transitions)
 
         quote_data = {
             "quote_number": quote_num,
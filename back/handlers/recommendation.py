@@ -2,7 +2,7 @@ import json
 import logging
 from typing import Any, Dict, Optional
 from langchain_core.prompts import PromptTemplate
-from config import llm, retriever, RECOMMENDATION_PROMPT
+from config import invoke_llm, retrieve, RECOMMENDATION_PROMPT
 from handlers.general_qa import handle_general_questions
 from sqlconnect import get_policy_by_id, get_policy_by_name
 from utils import clean_button_input, get_persistent_actions
@@ -81,14 +81,19 @@ def handle_recommendation_phase(bot, query: str) -> Dict[str, Any]:
         return {"answer": "I need a bit more information to give you a recommendation."}
 
     search_query = f"insurance for person {bot.context.get('existing_policy')} and {bot.context.get('employment_status')} with annual income {bot.context.get('annual_income')}"
-    docs = retriever.invoke(search_query)
-    
-    if not docs:
-        logger.warning(f"No policies found for query: '{search_query}'. Falling back to generic search.")
-        docs = retriever.invoke("insurance policy") # Fallback query
+    try:
+        docs = retrieve(search_query)
+
         if not docs:
-            logger.error("Fallback failed: No policies found in the vector store at all.")
-            return {"answer": "I'm sorry, I couldn't find any policies right now. Please try again later."}
+            logger.warning(f"No policies found for query: '{search_query}'. Falling back to generic search.")
+            docs = retrieve("insurance policy") # Fallback query
+    except Exception as e:
+        logger.error(f"Retrieval failed during recommendation: {e}")
+        docs = []
+
+    if not docs:
+        logger.error("Fallback failed: No policies found in the vector store at all.")
+        return {"answer": "I'm sorry, I couldn't find any policies right now. Please try again later."}
 
     top_policy = docs[0]
     logging.debug(f"Retrieved document: {top_policy}")
@@ -109,8 +114,12 @@ def handle_recommendation_phase(bot, query: str) -> Dict[str, Any]:
     # Optional logging
     logger.debug(f"Prompt length: {len(prompt)} chars")
 
-    llm_response = llm.invoke(prompt)
-    
+    try:
+        llm_response = invoke_llm(prompt)
+    except Exception as e:
+        logger.error(f"LLM call failed during recommendation: {e}")
+        return {"answer": "I'm having trouble processing the recommendation details. Could you please try asking again?"}
+
     try:
         cleaned_response = _clean_llm_response(llm_response.content)
         structured_policy = json.loads(cleaned_response)
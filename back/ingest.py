@@ -0,0 +1,257 @@
+"""
+Streaming, parallel ingestion of the policy_catalog into Pinecone.
+
+    python ingest.py --workers 4 --embed-batch 64 --upsert-concurrency 8
+
+The catalog is read from MySQL in keyset chunks and turned into documents chunk by
+chunk. Embedding batches are spread over a pool of worker processes, each loading
+its own copy of the model, and the vectors are upserted in parallel batches with
+retries. A bounded number of batches is in flight at any time, so memory stays flat
+whatever the catalog size. Vector ids are policy_ids, so a re-run overwrites rather
+than duplicates.
+
+With --workers 0 (the default for the startup sync) batches are embedded in this
+process with the embedding model the caller passes in.
+"""
+import os
+import time
+import random
+import logging
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from dotenv import load_dotenv
+from metrics import counter
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+INGEST_UPSERT_BATCH = int(os.getenv("INGEST_UPSERT_BATCH", "100"))
+INGEST_UPSERT_CONCURRENCY = int(os.getenv("INGEST_UPSERT_CONCURRENCY", "4"))
+INGEST_UPSERT_RETRIES = int(os.getenv("INGEST_UPSERT_RETRIES", "5"))
+INGEST_PROGRESS_INTERVAL_S = float(os.getenv("INGEST_PROGRESS_INTERVAL_S", "5"))
+
+INGESTED_DOCUMENTS = counter("catalog_ingested_documents_total", "Catalog documents embedded and upserted.")
+UPSERT_RETRIES = counter("catalog_upsert_retries_total", "Upsert batches retried after a failure.")
+
+# Set in each embedding worker process by _init_worker
+_worker_embeddings = None
+
+
+def _init_worker(backend: str, threads: int):
+    global _worker_embeddings
+    # Split the cores between the workers instead of each one grabbing all of them
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["ONNX_EMBEDDING_THREADS"] = str(threads)
+    from config import load_embedding_model
+
+    _worker_embeddings = load_embedding_model(backend)
+
+
+def _embed_in_worker(texts: list[str]) -> list[list[float]]:
+    return _worker_embeddings.embed_documents(texts)
+
+
+class _InlineEmbedder:
+    """Runs embedding batches in this process behind the same submit() interface as the pool."""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def submit(self, texts: list[str]) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(self.embeddings.embed_documents(texts))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self):
+        pass
+
+
+class _PoolEmbedder:
+    def __init__(self, workers: int, backend: str):
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # spawn: workers must not inherit a half-initialized torch/ONNX runtime from this process
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(backend, threads),
+        )
+
+    def submit(self, texts: list[str]) -> Future:
+        return self.pool.submit(_embed_in_worker, texts)
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+def _batched(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def upsert_with_retry(index, vectors: list[dict], namespace: str, retries: int = INGEST_UPSERT_RETRIES):
+    """Upserts one batch, retrying with jittered exponential back-off."""
+    for attempt in range(retries + 1):
+        try:
+            index.upsert(vectors=vectors, namespace=namespace)
+            return
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+            UPSERT_RETRIES.inc()
+            logger.warning(f"Upsert of {len(vectors)} vectors failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _to_vectors(documents, embeddings) -> list[dict]:
+    return [
+        {
+            "id": str(document.metadata["policy_id"]),
+            "values": list(values),
+            # PineconeVectorStore reads the text back from this key (text_key="page_content")
+            "metadata": {**document.metadata, "page_content": document.page_content},
+        }
+        for document, values in zip(documents, embeddings)
+    ]
+
+
+def record_catalog_sync():
+    """Tells every process's retrieval cache (see retrieval_cache.py) that the index changed."""
+    from sqlconnect import bump_catalog_version
+
+    try:
+        logger.info(f"Catalog version is now {bump_catalog_version()}")
+    except Exception as e:
+        logger.warning(f"Could not bump the catalog version; retrieval caches expire by TTL only: {e}")
+
+
+class _Progress:
+    def __init__(self, total: Optional[int], interval: float):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = self._last = time.perf_counter()
+
+    def add(self, count: int):
+        self.done += count
+        INGESTED_DOCUMENTS.inc(count)
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.log()
+
+    def rate(self) -> float:
+        return self.done / max(time.perf_counter() - self.started, 1e-9)
+
+    def log(self):
+        of = f"/{self.total}" if self.total is not None else ""
+        logger.info(f"Ingested {self.done}{of} policies ({self.rate():.0f}/s)")
+
+
+def ingest_catalog(index, namespace: str, embedding=None, workers: int = INGEST_WORKERS,
+                   embed_batch: int = INGEST_EMBED_BATCH, upsert_batch: int = INGEST_UPSERT_BATCH,
+                   upsert_concurrency: int = INGEST_UPSERT_CONCURRENCY, chunk_size: int = INGEST_CHUNK_SIZE,
+                   backend: str = None, progress_interval: float = INGEST_PROGRESS_INTERVAL_S) -> dict:
+    """
+    Embeds the whole catalog and upserts it into index/namespace. Returns the document
+    count, elapsed seconds and throughput.
+    """
+    from pinecone_handler import iter_documents
+    from sqlconnect import count_policy_catalog
+
+    if workers > 0:
+        import config
+
+        embedder = _PoolEmbedder(workers, backend or config.EMBEDDING_BACKEND)
+    else:
+        if embedding is None:
+            from config import load_embedding_model
+
+            embedding = load_embedding_model(backend)
+        embedder = _InlineEmbedder(embedding)
+
+    progress = _Progress(count_policy_catalog(), progress_interval)
+    max_embedding = max(2 * workers, 1)
+    max_upserts = 2 * upsert_concurrency
+    embedding_batches: deque = deque()
+    upserts: deque = deque()
+    uploader = ThreadPoolExecutor(max_workers=upsert_concurrency, thread_name_prefix="catalog-upsert")
+
+    def drain_upserts(limit: int):
+        while len(upserts) > limit:
+            future, count = upserts.popleft()
+            future.result()
+            progress.add(count)
+
+    def drain_embeddings(limit: int):
+        while len(embedding_batches) > limit:
+            documents, future = embedding_batches.popleft()
+            vectors = _to_vectors(documents, future.result())
+            for batch in _batched(vectors, upsert_batch):
+                upserts.append((uploader.submit(upsert_with_retry, index, batch, namespace), len(batch)))
+                drain_upserts(max_upserts)
+
+    try:
+        for documents in iter_documents(chunk_size):
+            for batch in _batched(documents, embed_batch):
+                embedding_batches.append((batch, embedder.submit([d.page_content for d in batch])))
+                drain_embeddings(max_embedding)
+        drain_embeddings(0)
+        drain_upserts(0)
+    finally:
+        uploader.shutdown(wait=True, cancel_futures=True)
+        embedder.shutdown()
+
+    progress.log()
+    record_catalog_sync()
+    elapsed = time.perf_counter() - progress.started
+    return {"documents": progress.done, "seconds": round(elapsed, 1), "per_second": round(progress.rate(), 1)}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    import config
+
+    parser = argparse.ArgumentParser(description="Stream the policy_catalog into the Pinecone index.")
+    parser.add_argument("--index", default=config.INDEX_NAME)
+    parser.add_argument("--namespace", default=config.NAMESPACE)
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS or os.cpu_count() or 1,
+                        help="Embedding worker processes; 0 embeds in this process.")
+    parser.add_argument("--embed-batch", type=int, default=INGEST_EMBED_BATCH)
+    parser.add_argument("--upsert-batch", type=int, default=INGEST_UPSERT_BATCH)
+    parser.add_argument("--upsert-concurrency", type=int, default=INGEST_UPSERT_CONCURRENCY)
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE, help="Catalog rows read per query.")
+    parser.add_argument("--reset", action="store_true", help="Clear the namespace before ingesting.")
+    args = parser.parse_args()
+
+    from pinecone import Pinecone
+    from pinecone_handler import clear_namespace, ensure_index
+
+    index = ensure_index(Pinecone(api_key=os.getenv("PINECONE_API_KEY")), args.index)
+    if args.reset:
+        clear_namespace(index, args.namespace)
+    stats = ingest_catalog(
+        index, args.namespace,
+        workers=args.workers,
+        embed_batch=args.embed_batch,
+        upsert_batch=args.upsert_batch,
+        upsert_concurrency=args.upsert_concurrency,
+        chunk_size=args.chunk_size,
+    )
+    print(f"Ingested {stats['documents']} policies in {stats['seconds']}s ({stats['per_second']}/s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,59 @@
-from fastapi import FastAPI, HTTPException
+import os
+import copy
+import hmac
+import json
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi import Header
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Any, Dict
 from cbot import ImprovedChatBot
+import chat_sockets
+from chat_sockets import SOCKET_CONNECTIONS, SOCKET_FRAMES, ChatSocketSession
+from config import TURN_LATENCY_BUDGET_S, TokenSink, readiness, stream_tokens, warmup
+from deadline import turn_budget
+from export import MEDIA_TYPES, export_leads
+from funnel import FUNNEL_STEPS, funnel_report, start_rollup_thread
+from metrics import render_prometheus
+from outbox import start_outbox_workers
+from profiling import ADMIN_TOKEN, ProfilingMiddleware, capture_path, list_captures, thread_scope
+from serialization import FastJSONResponse
+from singleflight import SingleFlight
+from sqlconnect import get_chat_history_page, get_funnel_hourly, get_user_id_by_phone
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# Messages sent with the opening /chat response; older ones are paged in from /api/chat_history
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+# How long a new /ws/chat connection has to send its hello frame
+SOCKET_HELLO_TIMEOUT_S = float(os.getenv("SOCKET_HELLO_TIMEOUT_S", "10"))
+
+chat_flight = SingleFlight("chat")
+quote_flight = SingleFlight("quote")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the LLM client, embedder and vector store in the background so the
+    # server starts accepting requests (and health checks) immediately.
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    start_rollup_thread()
+    start_outbox_workers()
+    yield
+
 
 app = FastAPI(
     title="Insurance Chatbot API",
     description="API for a stateful chatbot to guide users through selecting life insurance.",
     version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
 # Allow CORS for frontend communication
@@ -17,7 +63,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id", "X-Export-Watermark"],
 )
+app.add_middleware(ProfilingMiddleware)
 
 # --- Pydantic Models ---
 
@@ -31,6 +79,7 @@ class ChatResponse(BaseModel):
     answer: str
     options: Optional[List[str]] = None
     chat_history: Optional[List[dict]] = None
+    history_cursor: Optional[str] = None
     input_type: Optional[str] = None
     slider_config: Optional[Dict[str, Any]] = None
     quote_data: Optional[Dict[str, Any]] = None
@@ -58,7 +107,18 @@ class QuotationRequest(BaseModel):
 
 # --- API Endpoints ---
 
-@app.post("/chat", response_model=ChatResponse)
+# The hot routes return FastJSONResponse themselves: FastAPI then skips validating the
+# result against a response_model and running it through jsonable_encoder, and the
+# schema is still documented through `responses`.
+CHAT_RESPONSE_FIELDS = tuple(ChatResponse.model_fields)
+
+
+def _chat_payload(response_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Only the ChatResponse fields, as the response_model used to trim it."""
+    return {field: response_data.get(field) for field in CHAT_RESPONSE_FIELDS}
+
+
+@app.post("/chat", response_class=FastJSONResponse, responses={200: {"model": ChatResponse}})
 def chat(request: ChatRequest):
     """
     Handles all chat interactions.
@@ -68,6 +128,23 @@ def chat(request: ChatRequest):
     if not request.phone_number:
         raise HTTPException(status_code=400, detail="phone_number is required.")
 
+    # Identical requests already in flight (e.g. the widget remounting and re-sending
+    # its empty opening query) share one execution instead of replaying the turn.
+    flight_key = (
+        request.phone_number,
+        request.name,
+        request.email,
+        json.dumps(request.query, sort_keys=True, default=str),
+    )
+    return FastJSONResponse(_chat_payload(chat_flight.do(flight_key, _process_chat, request)))
+
+
+def _process_chat(request: ChatRequest) -> Dict[str, Any]:
+    with thread_scope(), turn_budget(TURN_LATENCY_BUDGET_S):
+        return _run_chat_turn(request)
+
+
+def _run_chat_turn(request: ChatRequest) -> Dict[str, Any]:
     try:
         bot = ImprovedChatBot(
             phone_number=request.phone_number,
@@ -77,48 +154,66 @@ def chat(request: ChatRequest):
         
         # If it's the first message (no query), we also send back the history.
         if not request.query:
-            history_from_context = bot.context.get("chat_history", [])
-            
-            # Check if resuming in the recommendation phase
-            if bot.context.get("context_state") == "recommendation_given_phase" and bot.context.get("shown_recommendations"):
-                last_recommendation_answer = "Based on your profile, here are two policies I recommend:" # A generic re-engagement message
-                
-                # Re-create the options based on the stored recommendations
-                structured_policies = bot.context.get("shown_recommendations", [])
-                options = [f"Apply for {item['name']}" for item in structured_policies] + ["Get More Details"]
-
-                return {
-                    "answer": last_recommendation_answer,
-                    "options": options,
-                    "chat_history": history_from_context,
-                }
-
-            # Get the initial welcome message from the bot
-            response_data = bot.handle_message("")
-            
-            return {
-                "answer": response_data.get("answer", "Welcome! How can I help?"),
-                "options": response_data.get("options"),
-                "chat_history": history_from_context,
-            }
+            return _opening_response(bot)
 
         # For subsequent messages, just handle the query.
-        response_data = bot.handle_message(request.query)
-        # Ensure chat_history is not sent on every turn to save bandwidth
-        response_data["chat_history"] = []
-        
-        # Add button state to the response
-        response_data["action_buttons"] = {
-            "getQuotation": not bot.context.get("quotation_clicked", False),
-            "showDetails": not bot.context.get("details_clicked", False),
-        }
-        
+        response_data = _turn_response(bot, request.query)
+        # Open sockets for this user hold a bot whose context this turn just changed
+        chat_sockets.mark_stale(bot.user_id)
         return response_data
     except Exception as e:
         print(f"An error occurred during chat: {e}")
         raise HTTPException(status_code=500, detail="An internal error occurred.")
 
 
+def _opening_response(bot: ImprovedChatBot) -> Dict[str, Any]:
+    # Only the latest page of the log; the widget asks for older pages with history_cursor
+    history_from_context, history_cursor = get_chat_history_page(bot.user_id, HISTORY_PAGE_SIZE)
+    
+    # Check if resuming in the recommendation phase
+    if bot.context.get("context_state") == "recommendation_given_phase" and bot.context.get("shown_recommendations"):
+        last_recommendation_answer = "Based on your profile, here are two policies I recommend:" # A generic re-engagement message
+        
+        # Re-create the options based on the stored recommendations
+        structured_policies = bot.context.get("shown_recommendations", [])
+        options = [f"Apply for {item['name']}" for item in structured_policies] + ["Get More Details"]
+
+        return {
+            "answer": last_recommendation_answer,
+            "options": options,
+            "chat_history": history_from_context,
+            "history_cursor": history_cursor,
+        }
+
+    # Get the initial welcome message from the bot
+    response_data = bot.handle_message("")
+    
+    return {
+        "answer": response_data.get("answer", "Welcome! How can I help?"),
+        "options": response_data.get("options"),
+        "chat_history": history_from_context,
+        "history_cursor": history_cursor,
+    }
+
+
+def _turn_response(bot: ImprovedChatBot, query: Any) -> Dict[str, Any]:
+    response_data = bot.handle_message(query)
+    # Ensure chat_history is not sent on every turn to save bandwidth
+    response_data["chat_history"] = []
+    
+    # Add button state to the response
+    response_data["action_buttons"] = _action_buttons(bot)
+    
+    return response_data
+
+
+def _action_buttons(bot: ImprovedChatBot) -> Dict[str, bool]:
+    return {
+        "getQuotation": not bot.context.get("quotation_clicked", False),
+        "showDetails": not bot.context.get("details_clicked", False),
+    }
+
+
 @app.post("/api/update_user_and_get_quote")
 def update_user_and_get_quote(request: QuotationRequest):
     """
@@ -128,20 +223,34 @@ def update_user_and_get_quote(request: QuotationRequest):
         print("Received quote form data:")
         print(request.dict())
 
-        bot = ImprovedChatBot(phone_number=request.phone_number)
-        response = bot.update_profile_and_get_quote(request.dict())
+        # A double-click arrives before the first quote is stored; let it share that call.
+        # Each caller gets its own copy, since the quote_data below is modified in place.
+        flight_key = (request.phone_number, json.dumps(request.dict(), sort_keys=True, default=str))
+        response = copy.deepcopy(quote_flight.do(flight_key, _generate_quote, request))
 
         quote_data = response.get("quote_data", {})
         quote_data["actions"] = response.get("actions", [])
 
         print("Quote response:", quote_data)
-        return quote_data
+        return FastJSONResponse(quote_data)
 
     except Exception as e:
         print(f"An error occurred during quote generation: {e}")
         raise HTTPException(status_code=500, detail="An internal error occurred during quote generation.")
 
 
+def _generate_quote(request: QuotationRequest) -> Dict[str, Any]:
+    with thread_scope():
+        bot = ImprovedChatBot(phone_number=request.phone_number)
+        response = bot.update_profile_and_get_quote(request.dict())
+        # The chat window may be a socket; show it the quote and have its bot pick up the new profile
+        chat_sockets.push(bot.user_id, "quote", {
+            "quote_data": response.get("quote_data"),
+            "actions": response.get("actions", []),
+        }, context_changed=True)
+        return response
+
+
 @app.post("/api/track_action")
 def track_action(request: TrackActionRequest):
     """
@@ -153,18 +262,256 @@ def track_action(request: TrackActionRequest):
             bot.update_context({"quotation_clicked": True})
         elif request.action == "show_details":
             bot.update_context({"details_clicked": True})
+        chat_sockets.push(bot.user_id, "action_buttons", {"action_buttons": _action_buttons(bot)}, context_changed=True)
         return {"status": "success"}
     except Exception as e:
         print(f"An error occurred during action tracking: {e}")
         raise HTTPException(status_code=500, detail="An internal error occurred during action tracking.")
 
 
+@app.get("/api/chat_history")
+def chat_history(
+    phone_number: str,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=100),
+    before: Optional[str] = Query(None, description="history_cursor / next_cursor from a previous response."),
+):
+    """
+    Returns up to `limit` logged messages older than `before`, oldest first, and the
+    cursor for the page before them (null once the start of the history is reached).
+    """
+    user_id = get_user_id_by_phone(phone_number)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="Unknown phone_number.")
+    try:
+        messages, next_cursor = get_chat_history_page(user_id, limit, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    """
+    Chat over one connection. The user identifies once with a hello frame; the
+    connection then keeps that user's bot, so turns skip the session and history
+    load that every /chat request pays. Answers are streamed as delta frames and
+    other endpoints can push to the connection. See chat_sockets.py for the protocol.
+    """
+    await websocket.accept()
+    try:
+        hello = json.loads(await asyncio.wait_for(websocket.receive_text(), SOCKET_HELLO_TIMEOUT_S))
+    except WebSocketDisconnect:
+        return
+    except (asyncio.TimeoutError, ValueError):
+        hello = None
+    if not isinstance(hello, dict) or hello.get("type") != "hello" or not hello.get("phone_number"):
+        SOCKET_CONNECTIONS.inc(outcome="rejected")
+        await websocket.close(code=1008, reason="Send a hello frame with phone_number first.")
+        return
+
+    session = ChatSocketSession(websocket, asyncio.get_running_loop())
+    writer = asyncio.create_task(session.writer())
+    turns: asyncio.Queue = asyncio.Queue()
+    turn_worker = None
+    outcome = "closed"
+    try:
+        session.bot, opening = await run_in_threadpool(_open_socket_session, hello)
+        chat_sockets.register(session.bot.user_id, session)
+        session.send({"type": "welcome", **opening})
+
+        # Turns run one at a time, in order, while pings and history pages are answered meanwhile
+        turn_worker = asyncio.create_task(_run_socket_turns(session, turns))
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+            except ValueError:
+                session.send({"type": "error", "detail": "Frames must be JSON objects."})
+                continue
+            frame_type = frame.get("type") if isinstance(frame, dict) else None
+            SOCKET_FRAMES.inc(direction="in", type=str(frame_type))
+            if frame_type == "message":
+                turns.put_nowait(frame)
+            elif frame_type == "history":
+                await _send_history_page(session, frame)
+            elif frame_type == "ping":
+                session.send({"type": "pong"})
+            else:
+                session.send({"type": "error", "id": frame.get("id") if isinstance(frame, dict) else None,
+                              "detail": f"Unknown frame type: {frame_type}"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        outcome = "failed"
+        print(f"An error occurred on a chat socket: {e}")
+    finally:
+        SOCKET_CONNECTIONS.inc(outcome=outcome)
+        if turn_worker is not None:
+            turn_worker.cancel()
+        if session.bot is not None:
+            chat_sockets.unregister(session.bot.user_id, session)
+        session.close()
+        try:
+            await writer
+        except Exception:
+            # The client is gone; frames still queued have nowhere to go
+            pass
+    if outcome == "failed":
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+
+
+def _open_socket_session(hello: Dict[str, Any]) -> tuple[ImprovedChatBot, Dict[str, Any]]:
+    with thread_scope(), turn_budget(TURN_LATENCY_BUDGET_S):
+        bot = ImprovedChatBot(
+            phone_number=str(hello["phone_number"]),
+            name=hello.get("name"),
+            email=hello.get("email"),
+        )
+        return bot, _opening_response(bot)
+
+
+async def _run_socket_turns(session: ChatSocketSession, turns: asyncio.Queue):
+    while True:
+        frame = await turns.get()
+        message_id = frame.get("id")
+        if not frame.get("query"):
+            session.send({"type": "error", "id": message_id, "detail": "query is required."})
+            continue
+        try:
+            response_data = await run_in_threadpool(_socket_turn, session, message_id, frame["query"])
+        except Exception as e:
+            print(f"An error occurred during chat: {e}")
+            session.send({"type": "error", "id": message_id, "detail": "An internal error occurred."})
+            continue
+        session.send({"type": "answer", "id": message_id, **response_data})
+
+
+def _socket_turn(session: ChatSocketSession, message_id: Any, query: Any) -> Dict[str, Any]:
+    with thread_scope(), turn_budget(TURN_LATENCY_BUDGET_S):
+        bot = session.bot
+        if session.stale:
+            session.stale = False
+            bot.reload()
+        session.token_sink = TokenSink(lambda text: session.send({"type": "delta", "id": message_id, "text": text}))
+        # Closed when the turn ends, so no delta follows the answer frame
+        with stream_tokens(session.token_sink):
+            response_data = _turn_response(bot, query)
+        chat_sockets.mark_stale(bot.user_id, except_session=session)
+        return response_data
+
+
+async def _send_history_page(session: ChatSocketSession, frame: Dict[str, Any]):
+    try:
+        limit = min(max(int(frame.get("limit") or HISTORY_PAGE_SIZE), 1), 100)
+        messages, next_cursor = await run_in_threadpool(
+            get_chat_history_page, session.bot.user_id, limit, frame.get("before")
+        )
+    except ValueError as e:
+        session.send({"type": "error", "id": frame.get("id"), "detail": str(e)})
+        return
+    session.send({"type": "history", "id": frame.get("id"), "messages": messages, "history_cursor": next_cursor})
+
+
 @app.get("/")
 def read_root():
     """A simple endpoint to confirm the API is running."""
     return {"message": "Insurance Chatbot API is running."}
 
 
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 once the LLM, embedder and vector store are initialized, 503 before."""
+    status = readiness()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Exposes the collected metrics in the Prometheus text format."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+
+def _require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them.")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+@app.get("/admin/profiles")
+def profiles(x_admin_token: Optional[str] = Header(None)):
+    """Lists saved request profiles, newest first."""
+    _require_admin(x_admin_token)
+    return {"profiles": list_captures()}
+
+
+@app.get("/admin/profiles/{profile_id}")
+def download_profile(profile_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Downloads one profile as collapsed stacks (flamegraph.pl / speedscope input)."""
+    _require_admin(x_admin_token)
+    path = capture_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Unknown profile.")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
+
+
+def _funnel_range(days: int, end: Optional[datetime]) -> tuple[datetime, datetime]:
+    end = end or datetime.now()
+    return end - timedelta(days=days), end
+
+
+@app.get("/admin/funnel")
+def funnel(
+    days: int = Query(7, ge=1, le=366),
+    end: Optional[datetime] = Query(None, description="End of the period; defaults to now."),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Funnel and drop-off per step over the period, read from the hourly rollups."""
+    _require_admin(x_admin_token)
+    start, end = _funnel_range(days, end)
+    return funnel_report(start, end)
+
+
+@app.get("/admin/funnel/{state}/hourly")
+def funnel_hourly(
+    state: str,
+    days: int = Query(7, ge=1, le=366),
+    end: Optional[datetime] = Query(None, description="End of the period; defaults to now."),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Hourly entries and first-time users for one state."""
+    _require_admin(x_admin_token)
+    if state not in FUNNEL_STEPS and state != "existing_policy":
+        raise HTTPException(status_code=404, detail="Unknown state.")
+    start, end = _funnel_range(days, end)
+    return {"state": state, "buckets": get_funnel_hourly(state, start, end)}
+
+
+@app.get("/admin/export/leads")
+def export_leads_endpoint(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = Query(False, description="Gzip the export on the fly."),
+    since_id: int = Query(0, ge=0, description="Only leads after this lead_id (a previous X-Export-Watermark)."),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Streams leads joined with their user and latest quote as CSV or NDJSON.
+    X-Export-Watermark is the last lead_id included; pass it as since_id next time.
+    """
+    _require_admin(x_admin_token)
+    watermark, stream = export_leads(format, since_id, compress=gzip)
+    filename = f"leads-{since_id + 1}-{watermark}.{format}" + (".gz" if gzip else "")
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Export-Watermark": str(watermark),
+    }
+    media_type = "application/gzip" if gzip else MEDIA_TYPES[format]
+    return StreamingResponse(stream, media_type=media_type, headers=headers)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
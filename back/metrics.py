@@ -0,0 +1,221 @@
+import time
+import bisect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Sequence, Tuple
+
+# Latency buckets in seconds, spanning a cached DB read to a slow LLM call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: Dict[str, "_Metric"] = {}
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def snapshot(self, **labels) -> Dict[str, float]:
+        """Returns count and sum for one label set, mostly for logs and benchmarks."""
+        state = self._values.get(self._key(labels))
+        if state is None:
+            return {"count": 0, "sum": 0.0}
+        return {"count": sum(state[0]), "sum": state[1]}
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(state[0]), state[1]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def _register(cls, name, documentation, labelnames, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, documentation, labelnames, **kwargs)
+        return metric
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Returns the counter registered under name, creating it on first use."""
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    """Returns the gauge registered under name, creating it on first use."""
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    """Returns the histogram registered under name, creating it on first use."""
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def render_prometheus() -> str:
+    """Renders every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# --- Chatbot stage metrics ---
+
+STAGE_DURATION = histogram(
+    "chatbot_stage_duration_seconds",
+    "Time spent in one backend stage (db, retriever, llm, embedder) per operation, by calling handler and state.",
+    ("stage", "operation", "handler", "state"),
+)
+HANDLER_DURATION = histogram(
+    "chatbot_handler_duration_seconds",
+    "Time spent in a conversation state handler, including the calls it makes.",
+    ("handler", "state"),
+)
+STAGE_ERRORS = counter(
+    "chatbot_stage_errors_total",
+    "Operations in a backend stage that raised an exception, by calling handler and state.",
+    ("stage", "operation", "handler", "state"),
+)
+LLM_CALLS = counter("chatbot_llm_calls_total", "LLM calls made, by calling handler.", ("handler",))
+LLM_ERRORS = counter("chatbot_llm_errors_total", "LLM calls that failed, by calling handler and error type.", ("handler", "error"))
+
+_current_handler: contextvars.ContextVar = contextvars.ContextVar("current_handler", default="none")
+_current_state: contextvars.ContextVar = contextvars.ContextVar("current_state", default="none")
+
+
+@contextmanager
+def time_stage(stage: str, operation: str):
+    """
+    Records the duration of the block, and any exception it raises, under stage and
+    operation, labelled with the handler and state of the enclosing handler_scope.
+    """
+    labels = {"stage": stage, "operation": operation, "handler": _current_handler.get(), "state": _current_state.get()}
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(**labels)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, **labels)
+
+
+def timed(stage: str):
+    """Decorator form of time_stage, using the function name as the operation."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with time_stage(stage, fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def handler_scope(handler: str, state: str):
+    """Times a state handler and labels the stage timings and LLM calls made inside it with its name and state."""
+    token = _current_handler.set(handler)
+    state_token = _current_state.set(state)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        HANDLER_DURATION.observe(time.perf_counter() - start, handler=handler, state=state)
+        _current_state.reset(state_token)
+        _current_handler.reset(token)
+
+
+def current_handler() -> str:
+    """Name of the state handler running in this context, or 'none'."""
+    return _current_handler.get()
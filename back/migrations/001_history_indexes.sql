@@ -0,0 +1,26 @@
+-- -----------------------------------------------------
+-- Migration 001: composite indexes for per-user history reads
+--
+-- chat_log was only indexed on user_id, so `ORDER BY timestamp` sorted the user's
+-- whole history on every read. (user_id, timestamp, log_id) serves both the ordered
+-- read and the keyset-paginated /api/chat_history seek directly from the index.
+-- The user_id index stays: InnoDB appends log_id to it, which is the (user_id, log_id)
+-- order replay.py streams the table in.
+-- user_quotations and lead_capture are likewise read newest-first per user; there the
+-- composite index also covers the foreign key, so it replaces the single-column one.
+--
+-- Run once against an existing database:
+--   mysql -u <user> -p <database> < migrations/001_history_indexes.sql
+-- database.sql already contains these indexes for fresh installs.
+-- -----------------------------------------------------
+
+ALTER TABLE `chat_log`
+  ADD INDEX `idx_chat_log_user_timestamp` (`user_id` ASC, `timestamp` ASC, `log_id` ASC);
+
+ALTER TABLE `user_quotations`
+  ADD INDEX `idx_user_quotations_user_created` (`user_id` ASC, `created_at` ASC),
+  DROP INDEX `fk_user_quotations_user_id_idx`;
+
+ALTER TABLE `lead_capture`
+  ADD INDEX `idx_lead_capture_user_created` (`user_id` ASC, `created_at` ASC),
+  DROP INDEX `fk_lead_capture_user_id_idx`;
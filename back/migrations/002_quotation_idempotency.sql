@@ -0,0 +1,17 @@
+-- -----------------------------------------------------
+-- Migration 002: idempotent quote generation
+--
+-- A quote form resubmitted with the same values within QUOTE_REUSE_WINDOW_SECONDS
+-- returns the stored quote instead of re-pricing and rewriting the profile.
+-- input_hash is the SHA-256 of the user_id and the normalized form inputs;
+-- quote_response is the response that was returned for them.
+--
+-- Run once against an existing database:
+--   mysql -u <user> -p <database> < migrations/002_quotation_idempotency.sql
+-- database.sql already contains these columns for fresh installs.
+-- -----------------------------------------------------
+
+ALTER TABLE `user_quotations`
+  ADD COLUMN `input_hash` CHAR(64) NULL AFTER `total_premium`,
+  ADD COLUMN `quote_response` JSON NULL AFTER `input_hash`,
+  ADD INDEX `idx_user_quotations_user_input` (`user_id` ASC, `input_hash` ASC, `created_at` ASC);
@@ -0,0 +1,63 @@
+-- -----------------------------------------------------
+-- Migration 003: conversion funnel events and hourly rollups
+--
+-- Funnel questions ("how many users reached quote_displayed this week") used to scan
+-- user_context and chat_log. State changes are now appended to state_transition_event
+-- and folded into funnel_hourly by `python funnel.py rollup` (also run periodically by
+-- the API, see FUNNEL_ROLLUP_INTERVAL_S), which /admin/funnel reads.
+--
+-- Run once against an existing database:
+--   mysql -u <user> -p <database> < migrations/003_funnel_rollups.sql
+-- database.sql already contains these tables for fresh installs.
+-- -----------------------------------------------------
+
+-- -----------------------------------------------------
+-- Table `state_transition_event`
+-- Append-only log of conversation state changes, written with the context update.
+-- No foreign key: analytics history outlives deleted users and inserts stay cheap.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `state_transition_event` (
+  `event_id` BIGINT NOT NULL AUTO_INCREMENT,
+  `user_id` INT NOT NULL,
+  `from_state` VARCHAR(100) NULL,
+  `to_state` VARCHAR(100) NOT NULL,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`event_id`),
+  INDEX `idx_state_transition_event_user_created` (`user_id` ASC, `created_at` ASC)
+);
+
+-- -----------------------------------------------------
+-- Table `funnel_hourly`
+-- Hourly rollup of state_transition_event, maintained incrementally by funnel.py.
+-- entries counts every transition into the state; new_users counts users reaching it
+-- for the first time, so it can be summed over any range of hours.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `funnel_hourly` (
+  `bucket_hour` DATETIME NOT NULL,
+  `state` VARCHAR(100) NOT NULL,
+  `entries` INT NOT NULL DEFAULT 0,
+  `new_users` INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (`bucket_hour`, `state`),
+  INDEX `idx_funnel_hourly_state_bucket` (`state` ASC, `bucket_hour` ASC)
+);
+
+-- -----------------------------------------------------
+-- Table `funnel_user_state`
+-- First time each user reached each state; lets the rollup tell new users from repeats.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `funnel_user_state` (
+  `user_id` INT NOT NULL,
+  `state` VARCHAR(100) NOT NULL,
+  `first_reached_at` TIMESTAMP NOT NULL,
+  PRIMARY KEY (`user_id`, `state`)
+);
+
+-- -----------------------------------------------------
+-- Table `funnel_rollup_watermark`
+-- Single row holding the last state_transition_event folded into the rollups.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `funnel_rollup_watermark` (
+  `id` TINYINT NOT NULL,
+  `last_event_id` BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`)
+);
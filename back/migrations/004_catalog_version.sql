@@ -0,0 +1,22 @@
+-- -----------------------------------------------------
+-- Migration 004: catalog version for retrieval cache invalidation
+--
+-- Each API process caches retrieval results (retrieval_cache.py). Catalog syncs,
+-- including `python ingest.py` run elsewhere, bump catalog_version, and the caches
+-- clear themselves within CATALOG_VERSION_CHECK_S of seeing the new version.
+--
+-- Run once against an existing database:
+--   mysql -u <user> -p <database> < migrations/004_catalog_version.sql
+-- database.sql already contains this table for fresh installs.
+-- -----------------------------------------------------
+
+-- -----------------------------------------------------
+-- Table `catalog_version`
+-- Single row bumped by every catalog sync; retrieval caches drop their entries when it moves.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `catalog_version` (
+  `id` TINYINT NOT NULL,
+  `version` BIGINT NOT NULL DEFAULT 0,
+  `synced_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`)
+);
@@ -0,0 +1,15 @@
+-- -----------------------------------------------------
+-- Migration 005: rolling conversation summary
+--
+-- Prompts carry conversation_summary plus the last SUMMARY_RECENT_TURNS exchanges
+-- instead of the raw last five. A background job folds older turns into the summary;
+-- summary_log_id is the last chat_log row folded in.
+--
+-- Run once against an existing database:
+--   mysql -u <user> -p <database> < migrations/005_conversation_summary.sql
+-- database.sql already contains these columns for fresh installs.
+-- -----------------------------------------------------
+
+ALTER TABLE `user_context`
+  ADD COLUMN `conversation_summary` TEXT NULL AFTER `diversion_count`,
+  ADD COLUMN `summary_log_id` INT DEFAULT 0 AFTER `conversation_summary`;
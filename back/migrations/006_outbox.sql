@@ -0,0 +1,31 @@
+-- -----------------------------------------------------
+-- Migration 006: transactional outbox for side-effect writes
+--
+-- Leads used to be written inline during the chat turn, and a failed write was printed
+-- and lost. They are now queued in outbox_event in the same transaction as the context
+-- update and applied by outbox.py workers, with retries and a dead-letter state.
+--
+-- Run once against an existing database:
+--   mysql -u <user> -p <database> < migrations/006_outbox.sql
+-- database.sql already contains this table for fresh installs.
+-- -----------------------------------------------------
+
+-- -----------------------------------------------------
+-- Table `outbox_event`
+-- status: pending (waiting or retrying), done (applied) or dead (gave up, see last_error).
+-- Workers claim due pending rows in event_id order with FOR UPDATE SKIP LOCKED.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `outbox_event` (
+  `event_id` BIGINT NOT NULL AUTO_INCREMENT,
+  `user_id` INT NOT NULL,
+  `kind` VARCHAR(50) NOT NULL,
+  `payload` JSON NOT NULL,
+  `status` ENUM('pending', 'done', 'dead') NOT NULL DEFAULT 'pending',
+  `attempts` INT NOT NULL DEFAULT 0,
+  `available_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `last_error` TEXT NULL,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `processed_at` TIMESTAMP NULL,
+  PRIMARY KEY (`event_id`),
+  INDEX `idx_outbox_event_status_available` (`status` ASC, `available_at` ASC, `event_id` ASC)
+);
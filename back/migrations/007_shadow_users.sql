@@ -0,0 +1,14 @@
+-- -----------------------------------------------------
+-- Migration 007: shadow users for replayed traffic
+--
+-- replay.py feeds recorded conversations through the bot under fresh phone numbers.
+-- Those users are flagged is_shadow and left out of the chat_log replay, the funnel
+-- rollups and the lead export, so replays do not show up as real traffic.
+--
+-- Run once against an existing database:
+--   mysql -u <user> -p <database> < migrations/007_shadow_users.sql
+-- database.sql already contains this column for fresh installs.
+-- -----------------------------------------------------
+
+ALTER TABLE `user_info`
+  ADD COLUMN `is_shadow` TINYINT(1) NOT NULL DEFAULT 0 AFTER `gst_applicable`;
@@ -0,0 +1,121 @@
+import os
+import logging
+import argparse
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+MODEL_FILENAME = "model_quantized.onnx"
+TOKENIZER_FILENAME = "tokenizer.json"
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    CPU embeddings from an int8-quantized ONNX export of bge-small-en-v1.5.
+    Produces the same vectors as the sentence-transformers model (CLS pooling,
+    L2-normalized) without loading PyTorch at query time.
+    """
+
+    def __init__(self, model_dir: str, max_length: int = 512, batch_size: int = 32, num_threads: int = 0):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError(
+                "The ONNX embedding backend requires 'onnxruntime' and 'tokenizers'. "
+                "Install them with: pip install onnxruntime tokenizers"
+            ) from e
+
+        model_path = os.path.join(model_dir, MODEL_FILENAME)
+        tokenizer_path = os.path.join(model_dir, TOKENIZER_FILENAME)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"No quantized ONNX model at '{model_path}'. "
+                f"Create it with: python onnx_embeddings.py --export {model_dir}"
+            )
+
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        inputs = {k: v for k, v in inputs.items() if k in self._input_names}
+        last_hidden_state = self.session.run(None, inputs)[0]
+
+        # bge uses the [CLS] token as the sentence embedding
+        cls = last_hidden_state[:, 0]
+        norms = np.linalg.norm(cls, axis=1, keepdims=True)
+        return cls / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0].tolist()
+
+
+def export_quantized_model(output_dir: str, model_name: str = DEFAULT_MODEL_NAME):
+    """
+    Exports the HuggingFace model to ONNX and applies dynamic int8 quantization.
+    Needs torch and transformers, but only once, at build time.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    sample = tokenizer(["an example policy description"], return_tensors="pt")
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+        fp32_path,
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "token_type_ids": {0: "batch", 1: "sequence"},
+            "last_hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=17,
+    )
+
+    quantize_dynamic(fp32_path, os.path.join(output_dir, MODEL_FILENAME), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    tokenizer.save_pretrained(output_dir)
+    logger.info(f"Exported quantized ONNX model to {output_dir}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export bge-small-en-v1.5 to a quantized ONNX model.")
+    parser.add_argument("--export", metavar="OUTPUT_DIR", required=True, help="Directory to write the model to.")
+    parser.add_argument("--model-name", default=DEFAULT_MODEL_NAME)
+    args = parser.parse_args()
+    export_quantized_model(args.export, args.model_name)
@@ -0,0 +1,154 @@
+"""
+Transactional outbox for side-effect writes.
+
+    python outbox.py drain                        # apply everything that is due
+    python outbox.py status                       # rows per status
+    python outbox.py dead --limit 20              # most recent dead letters
+    python outbox.py retry [EVENT_ID ...]         # put dead letters back in the queue
+    python outbox.py purge --days 7               # delete applied events
+
+Leads used to be written inline during the chat turn; a slow write held up the answer
+and a failed one was printed and lost. Handlers now call bot.enqueue_side_effect(),
+which stores the write in outbox_event in the same transaction as the context update,
+so it exists exactly when the state change does. Writes the next turn reads back
+(onboarding user_info, saved quotations) go through bot.write_with_context() instead
+and are made in that transaction directly; see sqlconnect.OUTBOX_KINDS.
+
+OUTBOX_WORKERS threads per API process apply due events. Each batch is claimed with
+FOR UPDATE SKIP LOCKED, so workers in every process share the queue without taking the
+same rows, and every event is applied in the claiming transaction, so it is marked done
+exactly when its write commits. A failing event is retried with jittered exponential
+back-off and dead-lettered after OUTBOX_MAX_ATTEMPTS. Events are independent writes;
+a retried event may be applied after later events of the same user.
+"""
+import os
+import random
+import logging
+import argparse
+import threading
+from collections import Counter
+from typing import Optional
+
+from dotenv import load_dotenv
+from metrics import counter
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "1"))
+OUTBOX_POLL_INTERVAL_S = float(os.getenv("OUTBOX_POLL_INTERVAL_S", "1"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BASE_BACKOFF_S = float(os.getenv("OUTBOX_BASE_BACKOFF_S", "2"))
+OUTBOX_MAX_BACKOFF_S = float(os.getenv("OUTBOX_MAX_BACKOFF_S", "900"))
+
+OUTBOX_EVENTS = counter("outbox_events_total", "Outbox events processed, by kind and outcome.", ("kind", "outcome"))
+
+# Set when this process queued events, so a sleeping worker picks them up right away
+_wakeup = threading.Event()
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds to wait before the next attempt of an event that has failed `attempts` times."""
+    delay = min(OUTBOX_MAX_BACKOFF_S, OUTBOX_BASE_BACKOFF_S * 2 ** (attempts - 1))
+    return delay * (0.5 + random.random())
+
+
+def notify():
+    _wakeup.set()
+
+
+def drain(batch_size: int = OUTBOX_BATCH_SIZE, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+          max_batches: Optional[int] = None) -> Counter:
+    """Applies due events batch by batch until none are left; returns counts per outcome."""
+    from sqlconnect import apply_outbox_batch
+
+    outcomes: Counter = Counter()
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        results = apply_outbox_batch(batch_size, max_attempts, retry_delay)
+        batches += 1
+        for kind, outcome in results:
+            OUTBOX_EVENTS.inc(kind=kind, outcome=outcome)
+            outcomes[outcome] += 1
+            if outcome == "dead":
+                logger.error(f"Outbox {kind} event dead-lettered; see `python outbox.py dead`")
+        if len(results) < batch_size:
+            break
+    return outcomes
+
+
+def _worker_loop(interval: float):
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        try:
+            outcomes = drain()
+            if outcomes:
+                logger.debug(f"Outbox worker: {dict(outcomes)}")
+        except Exception as e:
+            # Claimed rows were rolled back and stay pending for the next pass
+            logger.warning(f"Outbox worker failed: {e}")
+
+
+def start_outbox_workers(workers: int = OUTBOX_WORKERS, interval: float = OUTBOX_POLL_INTERVAL_S) -> list[threading.Thread]:
+    """Starts the worker threads; 0 workers leaves the outbox to `python outbox.py drain`."""
+    threads = []
+    for i in range(max(workers, 0)):
+        thread = threading.Thread(target=_worker_loop, args=(interval,), name=f"outbox-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Apply and inspect queued side-effect writes.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    drain_parser = subparsers.add_parser("drain", help="Apply every event that is due.")
+    drain_parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+    subparsers.add_parser("status", help="Count events per status.")
+    dead_parser = subparsers.add_parser("dead", help="List the most recent dead-lettered events.")
+    dead_parser.add_argument("--limit", type=int, default=20)
+    retry_parser = subparsers.add_parser("retry", help="Requeue dead-lettered events (all of them by default).")
+    retry_parser.add_argument("event_ids", type=int, nargs="*")
+    purge_parser = subparsers.add_parser("purge", help="Delete applied events older than --days.")
+    purge_parser.add_argument("--days", type=float, default=7)
+    purge_parser.add_argument("--batch-size", type=int, default=5000)
+
+    args = parser.parse_args()
+    if args.command == "drain":
+        outcomes = drain(batch_size=args.batch_size)
+        print(f"Applied {outcomes['applied']}, retrying {outcomes['retried']}, dead-lettered {outcomes['dead']}.")
+    elif args.command == "status":
+        from sqlconnect import count_outbox_events
+
+        counts = count_outbox_events()
+        for status in ("pending", "done", "dead"):
+            print(f"  {status:<8} {counts.get(status, 0):>8}")
+    elif args.command == "dead":
+        from sqlconnect import get_dead_outbox_events
+
+        for row in get_dead_outbox_events(args.limit):
+            print(f"  #{row['event_id']} {row['kind']} user {row['user_id']} "
+                  f"after {row['attempts']} attempts at {row['processed_at']}: {row['last_error']}")
+    elif args.command == "retry":
+        from sqlconnect import requeue_dead_outbox_events
+
+        print(f"Requeued {requeue_dead_outbox_events(args.event_ids or None)} dead events.")
+    else:
+        from sqlconnect import delete_done_outbox_events
+
+        total = 0
+        while True:
+            deleted = delete_done_outbox_events(int(args.days * 86400), args.batch_size)
+            total += deleted
+            if deleted < args.batch_size:
+                break
+        print(f"Deleted {total} applied events.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,120 @@
 import os
-import sys
 import requests
-from pinecone import Pinecone
-from langchain_pinecone import PineconeVectorStore
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
-from sqlconnect import get_mysql_data
+from sqlconnect import iter_policy_catalog
 from decimal import Decimal
 from datetime import datetime, date
 
 
+# policy_catalog column -> document metadata key
+METADATA_FIELDS = {
+    "policy_id": "policy_id",
+    "policy_name": "policy_name",
+    "provider_name": "provider_name",
+    "policy_type": "policy_type",
+    "coverage_min": "coverage_min",
+    "coverage_max": "coverage_amount",
+    "term_min": "policy_term_min",
+    "term_max": "policy_term_max",
+    "premium_min": "premium_min",
+    "premium_max": "premium",
+    "age_min": "entry_age_min",
+    "age_max": "entry_age_max",
+    "claim_settlement_ratio": "claim_settlement_ratio",
+    "riders": "riders",
+    "exclusions": "exclusions",
+    "tax_benefits": "tax_benefits",
+    "payout_options": "payout_options",
+    "benefits": "benefits",
+    "claim_process": "claim_process",
+}
+
+
 def build_page_content(row):
-    return f"Policy: {row[1]} from {row[2]}, with coverage up to ₹{row[5]} and premium of ₹{row[9]}."
+    return (
+        f"Policy: {row['policy_name']} from {row['provider_name']}, "
+        f"with coverage up to ₹{row['coverage_max']} and premium of ₹{row['premium_max']}."
+    )
+
+
+def row_to_document(row: dict) -> Document:
+    """Builds the vector store document for one policy_catalog row (keyed by column name)."""
+    metadata = {}
+    for column, key in METADATA_FIELDS.items():
+        v = row.get(column)
+        if v is None:
+            continue
+        if isinstance(v, Decimal):
+            v = float(v)
+        elif isinstance(v, (datetime, date)):
+            v = v.isoformat()
+        elif not isinstance(v, (bool, dict, float, int, list, str)):
+            v = str(v)
+        metadata[key] = v
+    return Document(page_content=build_page_content(row), metadata=metadata)
+
+
+def iter_documents(chunk_size: int = 1000):
+    """Yields the catalog as lists of documents, one list per chunk of rows read."""
+    for rows in iter_policy_catalog(chunk_size):
+        yield [row_to_document(row) for row in rows]
 
 
 def prepare_documents():
-    mysql_data = get_mysql_data()
     documents = []
+    for chunk in iter_documents():
+        documents.extend(chunk)
+    return documents
 
-    for row in mysql_data:
-        metadata = {
-            "policy_id": row[0],
-            "policy_name": row[1],
-            "provider_name": row[2],
-            "policy_type": row[3],
-            "coverage_min": row[4],
-            "coverage_amount": row[5],
-            "policy_term_min": row[6],
-            "policy_term_max": row[7],
-            "premium_min": row[8],
-            "premium": row[9],
-            "entry_age_min": row[10],
-            "entry_age_max": row[11],
-            "claim_settlement_ratio": row[12],
-            "riders": row[13],
-            "exclusions": row[14],
-            "tax_benefits": row[15],
-            "payout_options": row[16],
-            "benefits": row[17],
-            "claim_process": row[18],
-        }
-
-        metadata = {k: v for k, v in metadata.items() if v is not None}
-
-        for k, v in metadata.items():
-            if isinstance(v, Decimal):
-                metadata[k] = float(v)
-            elif isinstance(v, (datetime, date)):
-                metadata[k] = v.isoformat()
-            elif not isinstance(v, (type(None), bool, dict, float, int, list, str)):
-                metadata[k] = str(v)
-
-        documents.append(Document(page_content=build_page_content(row), metadata=metadata))
 
-    return documents
+EMBEDDING_MODEL_NAME = "BAAI/bge-small-en-v1.5"
 
 
-def upload_vectorstore(index_name="insurance-chatbot", namespace="default"):
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+def load_embeddings(backend: str = None):
+    """
+    Loads the embedding model used for both indexing and query-time retrieval.
+    The backend is chosen by EMBEDDING_BACKEND: "huggingface" (PyTorch, default)
+    or "onnx" (int8-quantized ONNX Runtime on CPU, see onnx_embeddings.py).
+    """
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "huggingface")).lower()
+    if backend == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+
+        return OnnxEmbeddings(
+            model_dir=os.getenv("ONNX_EMBEDDING_MODEL_DIR", "models/bge-small-en-v1.5-onnx-int8"),
+            num_threads=int(os.getenv("ONNX_EMBEDDING_THREADS", "0")),
+        )
+    if backend != "huggingface":
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Expected 'huggingface' or 'onnx'.")
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
     try:
-        embedding = HuggingFaceEmbeddings(model_name="BAAI/bge-small-en-v1.5")
-    except requests.exceptions.ConnectionError:
-        print("\n--- Network Connection Error ---")
-        print("Failed to connect to Hugging Face to download the embedding model.")
-        print("This is likely due to a network issue, a firewall blocking the connection, or a DNS problem.")
-        print("Please check your internet connection and ensure 'huggingface.co' is accessible, then restart the application.")
-        print("---------------------------------\n")
-        sys.exit(1)
-        
-    documents = prepare_documents()
-
-    # Optional: create the index if not present
+        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    except requests.exceptions.ConnectionError as e:
+        # Raised, not sys.exit(): the warmup thread records it and /ready reports it
+        raise RuntimeError(
+            "Failed to connect to Hugging Face to download the embedding model. "
+            "Check that 'huggingface.co' is reachable (network, firewall, DNS), then restart the application."
+        ) from e
+
+
+def connect_vectorstore(index_name="insurance-chatbot", namespace="default", embedding=None):
+    """Connects to an existing Pinecone index without touching its contents."""
+    from pinecone import Pinecone
+    from langchain_pinecone import PineconeVectorStore
+
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    return PineconeVectorStore(
+        index=pc.Index(index_name),
+        embedding=embedding or load_embeddings(),
+        text_key="page_content",
+        namespace=namespace
+    )
+
+
+def ensure_index(pc, index_name: str):
+    """Creates the index if it does not exist yet and returns it."""
     if index_name not in pc.list_indexes().names():
         pc.create_index(
             name=index_name,
@@ -78,16 +122,33 @@ def upload_vectorstore(index_name="insurance-chatbot", namespace="default"):
             metric="cosine",
             spec={"serverless": {"cloud": "aws", "region": "us-east-1"}}  # adjust as needed
         )
+    return pc.Index(index_name)
 
-    index = pc.Index(index_name)
 
-    # Optional: clear old data
+def clear_namespace(index, namespace: str):
     try:
         index.delete(delete_all=True, namespace=namespace)
     except Exception as e:
         if "Namespace not found" not in str(e):
             raise
 
+
+def upload_vectorstore(index_name="insurance-chatbot", namespace="default", embedding=None, documents=None):
+    """
+    Rebuilds the namespace from the catalog. Given documents are added in one call;
+    otherwise the catalog is streamed from MySQL through ingest.ingest_catalog.
+    """
+    from pinecone import Pinecone
+    from langchain_pinecone import PineconeVectorStore
+
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    embedding = embedding or load_embeddings()
+
+    index = ensure_index(pc, index_name)
+
+    # Optional: clear old data
+    clear_namespace(index, namespace)
+
     vectorstore = PineconeVectorStore(
         index=index,
         embedding=embedding,
@@ -95,5 +156,13 @@ def upload_vectorstore(index_name="insurance-chatbot", namespace="default"):
         namespace=namespace
     )
 
-    vectorstore.add_documents(documents)
+    if documents is None:
+        from ingest import ingest_catalog
+
+        ingest_catalog(index, namespace, embedding=embedding)
+    else:
+        from ingest import record_catalog_sync
+
+        vectorstore.add_documents(documents)
+        record_catalog_sync()
     return vectorstore
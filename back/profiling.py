@@ -0,0 +1,251 @@
+"""
+Opt-in, per-request sampling profiler.
+
+A request is profiled when it carries `X-Profile: <ADMIN_TOKEN>` or is picked by
+PROFILE_SAMPLE_RATE (0.0-1.0, default 0). While it runs, a sampler thread records
+the stacks of the threads working on it every PROFILE_INTERVAL_MS and writes them
+to PROFILE_DIR/<profile id>.folded in collapsed-stack format, ready for
+flamegraph.pl or speedscope. The id is made on the server (a well-formed
+X-Request-Id is kept as its prefix, for grepping) and returned in the
+X-Profile-Id header, so no caller can name, and overwrite, another capture.
+
+Threads join a capture through thread_scope(), which the request thread and the
+deadline executor enter; it reads one contextvar and returns when nothing is being
+profiled, so unprofiled requests pay next to nothing.
+"""
+import os
+import re
+import hmac
+import sys
+import time
+import uuid
+import random
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from metrics import counter
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+PROFILE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+CAPTURES = counter("profile_captures_total", "Requests run under the sampling profiler.", ["trigger"])
+
+_current_capture: contextvars.ContextVar[Optional["Capture"]] = contextvars.ContextVar("profile_capture", default=None)
+
+
+class Capture:
+    """The stacks sampled for one request, keyed by collapsed stack."""
+
+    def __init__(self, profile_id: str, label: str):
+        self.profile_id = profile_id
+        self.label = label
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._threads: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def add_thread(self, ident: int):
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+
+    def remove_thread(self, ident: int):
+        with self._lock:
+            if self._threads.get(ident, 0) <= 1:
+                self._threads.pop(ident, None)
+            else:
+                self._threads[ident] -= 1
+
+    def threads(self) -> list[int]:
+        with self._lock:
+            return list(self._threads)
+
+    def record(self, stack: str):
+        with self._lock:
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Sampler:
+    """One daemon thread shared by all active captures; it exits when none remain."""
+
+    def __init__(self):
+        self._captures: set[Capture] = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, capture: Capture):
+        with self._lock:
+            self._captures.add(capture)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, capture: Capture):
+        with self._lock:
+            self._captures.discard(capture)
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while True:
+            with self._lock:
+                if not self._captures:
+                    self._thread = None
+                    return
+                captures = list(self._captures)
+            frames = sys._current_frames()
+            for capture in captures:
+                for ident in capture.threads():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        capture.record(_collapse(frame))
+            del frames
+            time.sleep(interval)
+
+
+_sampler = _Sampler()
+
+
+@contextmanager
+def thread_scope():
+    """Marks the current thread as working on the profiled request, if there is one."""
+    capture = _current_capture.get()
+    if capture is None:
+        yield
+        return
+    ident = threading.get_ident()
+    capture.add_thread(ident)
+    try:
+        yield
+    finally:
+        capture.remove_thread(ident)
+
+
+def _prune(directory: str, keep: int):
+    files = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith(".folded")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in files[:-max(keep, 1)]:
+        os.remove(entry.path)
+
+
+def save_capture(capture: Capture, directory: str = PROFILE_DIR) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{capture.profile_id}.folded")
+    with open(path, "w") as f:
+        f.write(capture.folded())
+    _prune(directory, PROFILE_MAX_FILES)
+    return path
+
+
+def list_captures(directory: str = PROFILE_DIR) -> list[dict]:
+    """Saved captures, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    captures = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".folded"):
+            stat = entry.stat()
+            captures.append({
+                "profile_id": entry.name[: -len(".folded")],
+                "bytes": stat.st_size,
+                "created_at": stat.st_mtime,
+            })
+    return sorted(captures, key=lambda c: c["created_at"], reverse=True)
+
+
+def capture_path(profile_id: str, directory: str = PROFILE_DIR) -> Optional[str]:
+    """Path of a saved capture, or None if the id is malformed or unknown."""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = os.path.join(directory, f"{profile_id}.folded")
+    return path if os.path.exists(path) else None
+
+
+def new_profile_id(request_id: Optional[str] = None) -> str:
+    """A fresh capture id, prefixed with request_id when it is short and safe enough to keep."""
+    suffix = uuid.uuid4().hex
+    if request_id and PROFILE_ID_PATTERN.match(request_id) and len(request_id) <= 32:
+        return f"{request_id}-{suffix[:16]}"
+    return suffix
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware, so requests that are not profiled skip the per-request
+    task and body wrapping that BaseHTTPMiddleware adds.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _trigger(self, scope) -> Optional[str]:
+        requested = _header(scope, b"x-profile")
+        if requested is not None and ADMIN_TOKEN and hmac.compare_digest(requested, ADMIN_TOKEN):
+            return "header"
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        trigger = self._trigger(scope) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = new_profile_id(_header(scope, b"x-request-id"))
+        capture = Capture(profile_id, f"{scope['method']} {scope['path']}")
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        CAPTURES.inc(trigger=trigger)
+        token = _current_capture.set(capture)
+        _sampler.start(capture)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _sampler.stop(capture)
+            _current_capture.reset(token)
+            try:
+                path = await run_in_threadpool(save_capture, capture)
+                logger.info(f"Profiled {capture.label} ({trigger}): {capture.samples} samples -> {path}")
+            except OSError as e:
+                logger.error(f"Could not save profile {profile_id}: {e}")
@@ -0,0 +1,119 @@
+"""
+Deterministic local stand-ins for the LLM, the embedder and the vector store.
+Selected through config.py with LLM_PROVIDER=fake, EMBEDDING_BACKEND=hashing and
+VECTORSTORE_PROVIDER=memory, so the full /chat flow runs on an air-gapped machine.
+Each one can sleep for a configurable, jittered latency to mimic the real upstream.
+"""
+import re
+import json
+import time
+import random
+import hashlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.vectorstores import InMemoryVectorStore
+
+
+def _simulate_latency(mean_ms: float, jitter_ms: float, timeout: float = None):
+    if mean_ms <= 0 and jitter_ms <= 0:
+        return
+    delay = max(0.0, random.gauss(mean_ms, jitter_ms)) / 1000
+    if timeout is not None and delay > timeout:
+        time.sleep(timeout)
+        raise TimeoutError(f"Simulated upstream did not answer within {timeout:.2f}s.")
+    time.sleep(delay)
+
+
+class FakeChatModel:
+    """
+    Answers prompts from templates chosen by the prompt's shape, so each handler
+    gets a response it can parse: JSON for recommendations, an intent label for
+    intent classification, and short prose otherwise.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+
+    def invoke(self, prompt, timeout: float = None, **kwargs) -> AIMessage:
+        _simulate_latency(self.latency_ms, self.jitter_ms, timeout)
+        return AIMessage(content=self._answer(str(prompt)))
+
+    def stream(self, prompt, timeout: float = None, **kwargs):
+        """Yields the answer word by word: the first after ~40% of the latency, the rest spread over the remainder."""
+        _simulate_latency(self.latency_ms * 0.4, self.jitter_ms * 0.4, timeout)
+        words = self._answer(str(prompt)).split(" ")
+        per_word_s = self.latency_ms * 0.6 / 1000 / max(len(words), 1)
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(per_word_s)
+            yield AIMessageChunk(content=word if i == len(words) - 1 else word + " ")
+
+    def _answer(self, prompt: str) -> str:
+        if "recommend ONE best-fit policy" in prompt:
+            match = re.search(r"Policy: (.+?) from (.+?),", prompt)
+            name = match.group(1) if match else "Standard Term Plan"
+            provider = match.group(2) if match else "our partner insurer"
+            return json.dumps({
+                "name": name,
+                "description": f"{name} from {provider} fits your income and employment profile.",
+            })
+        if "classify the user's intent" in prompt:
+            query = re.search(r'User Query: "(.*)"', prompt)
+            return "general_qa" if query and "?" in query.group(1) else "onboarding"
+        if "personalized quote" in prompt:
+            return "You're one step away from your personalized quote. Please fill out the form below to see your options."
+        if "Retrieved Documents" in prompt:
+            match = re.search(r"Policy: (.+?) from (.+?),", prompt)
+            if match:
+                return f"{match.group(1)} from {match.group(2)} covers this; check its benefits and riders for the details."
+            return "I don't have the specific information to answer that."
+        return "Happy to help! Let me know if you have any questions about life insurance."
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Feature-hashed bag of words and bigrams, L2-normalized.
+    Stable across processes (no reliance on Python's salted hash), so texts sharing
+    words land close together, which is enough for retrieval to behave plausibly.
+    """
+
+    def __init__(self, dimension: int = 384, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.dimension = dimension
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+
+    def _embed(self, text: str) -> List[float]:
+        tokens = re.findall(r"\w+", text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dimension)
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        _simulate_latency(self.latency_ms, self.jitter_ms)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        _simulate_latency(self.latency_ms, self.jitter_ms)
+        return self._embed(text)
+
+
+class LocalVectorStore(InMemoryVectorStore):
+    """langchain's in-memory store with an optional simulated network round trip per search."""
+
+    def __init__(self, embedding: Embeddings, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        super().__init__(embedding)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs):
+        _simulate_latency(self.latency_ms, self.jitter_ms)
+        return super().similarity_search(query, k=k, **kwargs)
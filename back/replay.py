@@ -0,0 +1,251 @@
+"""
+Replays recorded conversations from chat_log through ImprovedChatBot.
+
+    python replay.py --providers fake --output replay.jsonl      # stand-in LLM, embedder and vector store
+    python replay.py --users 12,48 --output after.jsonl          # real providers, two users only
+    python replay.py --output after.jsonl --compare before.jsonl # per-turn state and latency changes
+
+chat_log is streamed in keyset-paginated chunks, one user's messages at a time.
+Every user message is fed back through handle_message under a fresh shadow user
+(user_info.is_shadow), so the recorded users' own context is never touched, and each
+turn's latency, new answer and resulting state are written out next to the recorded
+answer. Rows written while the replay runs are excluded, and shadow users are left
+out of later replays, the funnel rollups and the lead export.
+"""
+import os
+import sys
+import json
+import time
+import difflib
+import itertools
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+FAKE_PROVIDERS = {"LLM_PROVIDER": "fake", "EMBEDDING_BACKEND": "hashing", "VECTORSTORE_PROVIDER": "memory"}
+
+
+def stream_chat_log(chunk_size: int, max_log_id: int, from_user_id: int = 0, only_user: bool = False):
+    """
+    Yields chat_log rows in (user_id, log_id) order from from_user_id's first message on,
+    fetching chunk_size rows per query. With only_user it stops at the next user.
+    """
+    from sqlconnect import get_chat_log_chunk
+
+    # log_id starts at 1, so (user_id, 0) sits just before a user's first message
+    after_user_id, after_log_id = from_user_id, 0
+    while True:
+        rows = get_chat_log_chunk(after_user_id, after_log_id, chunk_size, max_log_id)
+        for row in rows:
+            if only_user and row[1] != from_user_id:
+                return
+            yield row
+        if len(rows) < chunk_size:
+            return
+        after_log_id, after_user_id = rows[-1][0], rows[-1][1]
+
+
+def iter_conversations(chunk_size: int, max_log_id: int, user_ids: list = None):
+    """Yields (user_id, [(message_type, message), ...]) for each recorded user."""
+    if user_ids:
+        streams = [stream_chat_log(chunk_size, max_log_id, user_id, only_user=True) for user_id in user_ids]
+    else:
+        streams = [stream_chat_log(chunk_size, max_log_id)]
+
+    for rows in streams:
+        current_user, messages = None, []
+        for _, user_id, message_type, message, _ in rows:
+            if user_id != current_user:
+                if messages:
+                    yield current_user, messages
+                current_user, messages = user_id, []
+            messages.append((message_type, message))
+        if messages:
+            yield current_user, messages
+
+
+def _parse_query(message: str):
+    # Form submissions are logged as the JSON of the submitted dict
+    if message.startswith("{"):
+        try:
+            return json.loads(message)
+        except json.JSONDecodeError:
+            pass
+    return message
+
+
+def to_turns(messages: list) -> list[dict]:
+    """
+    Pairs each user message with the bot answer logged after it.
+    handle_message logs at most one answer per call, so a bot message that does not
+    follow a user message came from an empty query (the first call of a session).
+    """
+    turns = []
+    for message_type, message in messages:
+        if message_type == "user":
+            turns.append({"query": _parse_query(message), "recorded_answer": None})
+        elif turns and turns[-1]["recorded_answer"] is None:
+            turns[-1]["recorded_answer"] = message
+        else:
+            turns.append({"query": "", "recorded_answer": message})
+    return turns
+
+
+def answer_similarity(recorded, answer) -> float:
+    if recorded is None and answer is None:
+        return 1.0
+    return round(difflib.SequenceMatcher(None, recorded or "", answer or "").ratio(), 4)
+
+
+def replay_conversation(source_user_id: int, turns: list, phone_number: str, budget_s: float) -> list[dict]:
+    """Runs one recorded conversation turn by turn, the way /chat drives the bot."""
+    from cbot import ImprovedChatBot
+    from deadline import turn_budget
+
+    results = []
+    for index, turn in enumerate(turns):
+        record = {
+            "source_user_id": source_user_id,
+            "turn": index,
+            "query": turn["query"],
+            "recorded_answer": turn["recorded_answer"],
+            # Stays None when the bot cannot even be loaded
+            "state_before": None,
+        }
+        start = time.perf_counter()
+        try:
+            with turn_budget(budget_s):
+                bot = ImprovedChatBot(phone_number=phone_number)
+                record["state_before"] = bot.context.get("context_state")
+                response = bot.handle_message(turn["query"]) or {}
+            record["answer"] = response.get("answer")
+            record["state_after"] = bot.context.get("context_state")
+            record["error"] = None
+        except Exception as e:
+            record["answer"] = None
+            record["state_after"] = None
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        record["similarity"] = answer_similarity(turn["recorded_answer"], record["answer"])
+        results.append(record)
+        if record["error"]:
+            break
+    return results
+
+
+def compare_runs(current: list[dict], previous: list[dict]) -> dict:
+    """Matches turns by (source_user_id, turn) and counts state, answer and latency changes."""
+    before = {(r["source_user_id"], r["turn"]): r for r in previous}
+    matched = state_changes = answer_changes = 0
+    deltas = []
+    for record in current:
+        old = before.get((record["source_user_id"], record["turn"]))
+        if not old:
+            continue
+        matched += 1
+        state_changes += record["state_after"] != old["state_after"]
+        answer_changes += record["answer"] != old["answer"]
+        deltas.append(record["latency_ms"] - old["latency_ms"])
+    deltas.sort()
+    return {
+        "matched_turns": matched,
+        "state_changes": state_changes,
+        "answer_changes": answer_changes,
+        "median_latency_delta_ms": round(deltas[len(deltas) // 2], 2) if deltas else 0.0,
+    }
+
+
+def run_replay(conversations, concurrency: int, budget_s: float, max_conversations: int,
+               output=None) -> tuple[dict, list[dict]]:
+    from cli_chat import LoadReport, run_phone_numbers
+    from sqlconnect import create_shadow_user
+
+    report = LoadReport()
+    records = []
+    lock = threading.Lock()
+    # Shadow numbers start with 5 so they never collide with the 7-prefixed load generator
+    phone_number = run_phone_numbers("5", max_conversations)
+
+    def work(i, source_user_id, messages):
+        create_shadow_user(phone_number(i))
+        results = replay_conversation(source_user_id, to_turns(messages), phone_number(i), budget_s)
+        with lock:
+            for record in results:
+                report.record(record["state_before"] or "unknown", record["latency_ms"] / 1000, not record["error"])
+                records.append(record)
+                if output:
+                    output.write(json.dumps(record, default=str) + "\n")
+        report.conversation_done()
+
+    start = time.perf_counter()
+    # At most 2 * concurrency conversations are held at once, so the chat_log is never all in memory.
+    # result() re-raises a conversation that failed outside replay_conversation's own error handling.
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = set()
+        for i, (source_user_id, messages) in enumerate(conversations):
+            if len(in_flight) >= 2 * concurrency:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            in_flight.add(pool.submit(work, i, source_user_id, messages))
+        for future in in_flight:
+            future.result()
+    summary = report.summary(time.perf_counter() - start)
+    similarities = [r["similarity"] for r in records]
+    summary["changed_answers"] = sum(1 for s in similarities if s < 1.0)
+    summary["mean_similarity"] = round(sum(similarities) / len(similarities), 4) if similarities else 1.0
+    return summary, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded chat_log conversations through the bot.")
+    parser.add_argument("--providers", choices=["env", "fake"], default="env",
+                        help="'fake' uses the local stand-ins; 'env' keeps whatever the environment selects.")
+    parser.add_argument("--users", help="Comma-separated user_ids to replay (default: everyone).")
+    parser.add_argument("--max-conversations", type=int, help="Stop after this many conversations.")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="chat_log rows fetched per query.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Conversations replayed at once.")
+    parser.add_argument("--output", help="Write one JSON line per replayed turn to this file.")
+    parser.add_argument("--compare", metavar="PREVIOUS_JSONL", help="An earlier --output to diff states and latency against.")
+    args = parser.parse_args()
+
+    if args.providers == "fake":
+        os.environ.update(FAKE_PROVIDERS)
+
+    # Imported after the provider selection, which config.py reads at import time
+    from config import TURN_LATENCY_BUDGET_S
+    from cli_chat import print_report
+    from sqlconnect import count_chat_log_users, get_max_chat_log_id
+
+    max_log_id = get_max_chat_log_id()
+    user_ids = sorted(int(u) for u in args.users.split(",")) if args.users else None
+    conversations = iter_conversations(args.chunk_size, max_log_id, user_ids)
+    # Sizes the shadow phone numbers; checked before anything is replayed
+    max_conversations = len(user_ids) if user_ids else count_chat_log_users(max_log_id)
+    if args.max_conversations:
+        conversations = itertools.islice(conversations, args.max_conversations)
+        max_conversations = min(max_conversations, args.max_conversations)
+
+    output = open(args.output, "w") if args.output else None
+    try:
+        summary, records = run_replay(conversations, args.concurrency, TURN_LATENCY_BUDGET_S, max_conversations, output)
+    finally:
+        if output:
+            output.close()
+
+    print_report(summary, "replay")
+    print(f"Replayed up to log_id {max_log_id}  |  {summary['changed_answers']} answers differ from the recording "
+          f"(mean similarity {summary['mean_similarity']})")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = [json.loads(line) for line in f if line.strip()]
+        diff = compare_runs(records, previous)
+        print(f"\nAgainst {args.compare}: {diff['matched_turns']} matching turns, {diff['state_changes']} state changes, "
+              f"{diff['answer_changes']} answer changes, median latency change {diff['median_latency_delta_ms']:+.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+chat_log retention: moves old messages into a compressed cold archive.
+
+    python retention.py archive                     # archive everything older than CHAT_LOG_RETENTION_DAYS
+    python retention.py archive --days 30 --dry-run # count what would move
+    python retention.py read --user-id 42           # stream a user's archived messages as JSONL
+
+Rows are moved in bounded batches walked in log_id order. Each batch is written to
+day-partitioned, zstd-compressed JSONL files (archive/chat_log/YYYY/MM/DD/) and only
+deleted from MySQL once its files are safely renamed into place. A crash in between
+leaves a row in both places, never in neither; the reader drops such duplicates.
+"""
+import os
+import sys
+import io
+import json
+import time
+import logging
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import zstandard
+from dotenv import load_dotenv
+from metrics import counter
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = int(os.getenv("CHAT_LOG_RETENTION_DAYS", "90"))
+ARCHIVE_DIR = os.getenv("CHAT_LOG_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "archive", "chat_log"))
+BATCH_SIZE = int(os.getenv("CHAT_LOG_ARCHIVE_BATCH_SIZE", "5000"))
+ZSTD_LEVEL = int(os.getenv("CHAT_LOG_ARCHIVE_ZSTD_LEVEL", "9"))
+
+ARCHIVED_ROWS = counter("chat_log_archived_rows_total", "chat_log rows moved to the cold archive.")
+
+
+def _partition_dir(archive_dir: str, day) -> str:
+    return os.path.join(archive_dir, f"{day.year:04d}", f"{day.month:02d}", f"{day.day:02d}")
+
+
+def write_partition(archive_dir: str, day, rows: list[dict]) -> str:
+    """
+    Writes one day's rows to a new compressed part file and returns its path.
+    The file is written under a temporary name, fsynced, then renamed, so a reader
+    never sees a half-written part.
+    """
+    directory = _partition_dir(archive_dir, day)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{rows[0]['log_id']:010d}-{rows[-1]['log_id']:010d}.jsonl.zst")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        with zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(f, closefd=False) as writer:
+            for row in rows:
+                record = {**row, "timestamp": row["timestamp"].isoformat()}
+                writer.write((json.dumps(record, ensure_ascii=False) + "\n").encode())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_old_messages(days: int = RETENTION_DAYS, batch_size: int = BATCH_SIZE, archive_dir: str = ARCHIVE_DIR,
+                         max_batches: int = None, pause: float = 0.0, dry_run: bool = False) -> dict:
+    """
+    Moves chat_log rows older than `days` into the archive, batch_size rows at a time.
+    `pause` sleeps between batches to go easy on replication and the live traffic.
+    """
+    from sqlconnect import delete_chat_log_rows, get_chat_log_before
+
+    cutoff = datetime.now() - timedelta(days=days)
+    stats = {"cutoff": cutoff.isoformat(), "batches": 0, "rows": 0, "files": 0}
+    after_log_id = 0
+    while max_batches is None or stats["batches"] < max_batches:
+        rows = get_chat_log_before(cutoff, after_log_id, batch_size)
+        if not rows:
+            break
+        after_log_id = rows[-1]["log_id"]
+        stats["batches"] += 1
+        stats["rows"] += len(rows)
+        if dry_run:
+            continue
+
+        by_day = defaultdict(list)
+        for row in rows:
+            by_day[row["timestamp"].date()].append(row)
+        for day, day_rows in sorted(by_day.items()):
+            write_partition(archive_dir, day, day_rows)
+            stats["files"] += 1
+
+        deleted = delete_chat_log_rows([row["log_id"] for row in rows])
+        ARCHIVED_ROWS.inc(deleted)
+        logger.info(f"Archived {deleted} chat_log rows up to log_id {after_log_id}.")
+        if pause:
+            time.sleep(pause)
+    return stats
+
+
+def _iter_part_files(archive_dir: str, since: datetime = None, until: datetime = None):
+    """Part files in chronological order, skipping day partitions outside [since, until]."""
+    if not os.path.isdir(archive_dir):
+        return
+    for year in sorted(os.listdir(archive_dir)):
+        for month in sorted(os.listdir(os.path.join(archive_dir, year))):
+            for day in sorted(os.listdir(os.path.join(archive_dir, year, month))):
+                date = datetime(int(year), int(month), int(day)).date()
+                if (since and date < since.date()) or (until and date > until.date()):
+                    continue
+                directory = os.path.join(archive_dir, year, month, day)
+                for name in sorted(os.listdir(directory)):
+                    if name.endswith(".jsonl.zst"):
+                        yield os.path.join(directory, name)
+
+
+def read_archived_messages(user_id: int = None, since: datetime = None, until: datetime = None,
+                           archive_dir: str = ARCHIVE_DIR):
+    """
+    Streams archived messages (optionally for one user) in log_id order, decompressing
+    one line at a time; only the ids of matching messages are kept, for de-duplication.
+    """
+    seen = set()
+    for path in _iter_part_files(archive_dir, since, until):
+        with open(path, "rb") as f:
+            reader = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(f), encoding="utf-8")
+            for line in reader:
+                record = json.loads(line)
+                if user_id is not None and record["user_id"] != user_id:
+                    continue
+                timestamp = datetime.fromisoformat(record["timestamp"])
+                if (since and timestamp < since) or (until and timestamp > until):
+                    continue
+                # A batch interrupted between write and delete is archived twice
+                if record["log_id"] in seen:
+                    continue
+                seen.add(record["log_id"])
+                yield record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old chat_log rows, or read them back.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive = subparsers.add_parser("archive", help="Move rows older than the retention period to the archive.")
+    archive.add_argument("--days", type=int, default=RETENTION_DAYS)
+    archive.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    archive.add_argument("--max-batches", type=int, help="Stop after this many batches.")
+    archive.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+    archive.add_argument("--dry-run", action="store_true", help="Count the rows without moving them.")
+
+    read = subparsers.add_parser("read", help="Print archived messages as JSONL.")
+    read.add_argument("--user-id", type=int)
+    read.add_argument("--since", type=datetime.fromisoformat, help="ISO date or datetime.")
+    read.add_argument("--until", type=datetime.fromisoformat, help="ISO date or datetime.")
+
+    for sub in (archive, read):
+        sub.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        stats = archive_old_messages(args.days, args.batch_size, args.archive_dir,
+                                     args.max_batches, args.pause, args.dry_run)
+        verb = "Would archive" if args.dry_run else "Archived"
+        print(f"{verb} {stats['rows']} rows older than {stats['cutoff']} in {stats['batches']} batches "
+              f"({stats['files']} files written).")
+    else:
+        for record in read_archived_messages(args.user_id, args.since, args.until, args.archive_dir):
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Result cache in front of the policy retriever.
+
+The recommendation handler sends the same templated search query for every user
+with the same profile, and "insurance policy" as its fallback, so most retrievals
+repeat. Results are cached per (normalized query, k, namespace) with LRU eviction
+and a TTL.
+
+Entries belong to a catalog version. Every catalog sync bumps the version in MySQL
+(see sqlconnect.bump_catalog_version); the cache re-reads it at most every
+CATALOG_VERSION_CHECK_S and drops everything when it moves, so workers whose index
+was rebuilt by another process stop serving the old catalog within that interval.
+A sync in this process invalidates it immediately.
+
+Hits, misses and the running hit ratio are exported through metrics.py.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from dotenv import load_dotenv
+from deadline import remaining
+from metrics import counter, gauge
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL_S = float(os.getenv("RETRIEVAL_CACHE_TTL_S", "600"))
+CATALOG_VERSION_CHECK_S = float(os.getenv("CATALOG_VERSION_CHECK_S", "30"))
+# The version check is a MySQL round trip on the request path; a turn with less budget left leaves it to the next one
+CATALOG_VERSION_CHECK_MIN_BUDGET_S = float(os.getenv("CATALOG_VERSION_CHECK_MIN_BUDGET_S", "1"))
+
+LOOKUPS = counter("retrieval_cache_lookups_total", "Retrieval cache lookups, by result.", ("result",))
+INVALIDATIONS = counter("retrieval_cache_invalidations_total", "Times the retrieval cache was emptied for a new catalog version.")
+HIT_RATIO = gauge("retrieval_cache_hit_ratio", "Share of retrieval cache lookups served from the cache since startup.")
+ENTRIES = gauge("retrieval_cache_entries", "Results currently held in the retrieval cache.")
+
+
+def normalize_query(query: str) -> str:
+    """Case and whitespace differences do not change what the retriever returns."""
+    return " ".join(query.lower().split())
+
+
+class RetrievalCache:
+    """
+    Thread-safe LRU of retrieval results with a TTL, tagged with the catalog version
+    they were retrieved from. version_source is called (without the lock held) to
+    read the current version, at most every version_check_s.
+    """
+
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_SIZE, ttl_s: float = RETRIEVAL_CACHE_TTL_S,
+                 version_source=None, version_check_s: float = CATALOG_VERSION_CHECK_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.version_source = version_source
+        self.version_check_s = version_check_s
+        self._entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._version_checked = float("-inf")
+        self._hits = 0
+        self._lookups = 0
+        # Bumped on every clear, so a result retrieved before a clear is not stored after it
+        self.generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_s > 0
+
+    def _refresh_version(self):
+        if self.version_source is None:
+            return
+        now = time.monotonic()
+        # Claimed under the lock, so one request per interval does the check, not every request that sees it lapse
+        with self._lock:
+            if now - self._version_checked < self.version_check_s:
+                return
+            budget = remaining()
+            if budget is not None and budget < CATALOG_VERSION_CHECK_MIN_BUDGET_S:
+                return
+            self._version_checked = now
+        try:
+            version = self.version_source()
+        except Exception as e:
+            # Keep serving what we have; the TTL still bounds how stale it gets
+            logger.warning(f"Could not read the catalog version: {e}")
+            return
+        self.set_version(version)
+
+    def set_version(self, version: int):
+        """Empties the cache if version differs from the one its entries were retrieved under."""
+        with self._lock:
+            if version == self._version:
+                return
+            changed = self._version is not None
+            self._version = version
+            self._entries.clear()
+            self.generation += 1
+        ENTRIES.set(0)
+        if changed:
+            INVALIDATIONS.inc()
+            logger.info(f"Catalog version is now {version}; retrieval cache cleared.")
+
+    def _record(self, result: str):
+        self._lookups += 1
+        if result == "hit":
+            self._hits += 1
+        LOOKUPS.inc(result=result)
+        HIT_RATIO.set(self._hits / self._lookups)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        self._refresh_version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                result, value = "miss", None
+            elif time.monotonic() - entry[0] > self.ttl_s:
+                del self._entries[key]
+                result, value = "expired", None
+            else:
+                self._entries.move_to_end(key)
+                result, value = "hit", entry[1]
+            self._record(result)
+        return value
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        """Stores value, unless the cache was cleared since `generation` was read."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            size = len(self._entries)
+        ENTRIES.set(size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+        ENTRIES.set(0)
+
+    def invalidate(self):
+        """Empties the cache and re-reads the catalog version on the next lookup."""
+        self.clear()
+        with self._lock:
+            self._version_checked = float("-inf")
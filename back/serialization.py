@@ -0,0 +1,78 @@
+"""
+JSON encoding for the per-turn hot paths: the user_context JSON columns, logged
+form submissions, the stored chat window and API responses.
+
+Uses orjson when it is installed and the standard library otherwise. Both produce
+the same compact UTF-8 JSON, so values written by one can be read by the other.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError subclasses this, so one except clause covers both backends
+JSONDecodeError = json.JSONDecodeError
+
+BACKEND = "orjson" if orjson else "json"
+
+
+def _default(obj: Any) -> Any:
+    """Types MySQL rows and pydantic models hand us that neither backend encodes natively."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return dumps(obj).encode()
+
+    def loads(data):
+        return json.loads(data)
+
+
+def message_to_dict(message) -> dict:
+    """
+    The stored form of a chat message: {"type": "human" | "ai", "data": {"content": ...}}.
+    Much cheaper than BaseMessage.dict(), which copies every pydantic field only for
+    _load_chat_history to read the content back.
+    """
+    return {"type": message.type, "data": {"content": message.content}}
+
+
+def messages_to_dicts(messages) -> list[dict]:
+    return [message_to_dict(message) for message in messages]
+
+
+class FastJSONResponse(JSONResponse):
+    """FastAPI's default response class, rendered through dumps_bytes."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
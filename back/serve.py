@@ -0,0 +1,164 @@
+"""
+Pre-fork production launcher: one master, N uvicorn workers sharing one socket.
+
+    python serve.py --workers 4 --port 8000
+
+The master imports the app, loads the embedding model (and the policy_catalog
+snapshot for the in-memory store), and runs the catalog sync once. Then it forks
+the workers, which share those pages copy-on-write and only connect to the
+already-synced index. Workers that die are replaced; SIGTERM or SIGINT stops them
+all gracefully.
+
+Metrics are collected per worker, so /metrics shows whichever worker answered.
+`python main.py` still runs a single worker for development.
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("serve")
+
+# PyTorch only starts its thread pools on the first forward pass, so a loaded model
+# forks cleanly. ONNX Runtime creates its pool with the session, and forked children
+# would inherit a pool with no threads, so each worker loads its own ONNX session.
+FORK_SAFE_EMBEDDING_BACKENDS = {"huggingface", "hashing"}
+
+
+def _run_in_child(name: str, fn) -> None:
+    """
+    Runs fn in a forked child and waits for it. Work that starts threads or opens
+    connections (the catalog sync embeds every policy and talks to Pinecone) stays
+    out of the master, so nothing half-initialized is inherited by the workers.
+    """
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            fn()
+        except Exception as e:
+            logger.error(f"{name} failed: {e}", exc_info=True)
+            code = 1
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise SystemExit(f"{name} failed; not starting workers.")
+
+
+def preload():
+    """Loads everything the workers can share and runs the one-off startup work."""
+    import config
+
+    if config.EMBEDDING_BACKEND in FORK_SAFE_EMBEDDING_BACKENDS:
+        config.get_embeddings()
+    else:
+        logger.info(f"EMBEDDING_BACKEND={config.EMBEDDING_BACKEND} is loaded by each worker, not shared.")
+
+    if config.VECTORSTORE_PROVIDER == "memory":
+        config.get_catalog_documents()
+    if config.CATALOG_SYNC_ON_STARTUP and config.VECTORSTORE_PROVIDER == "pinecone":
+        start = time.perf_counter()
+        _run_in_child("Catalog sync", config.sync_catalog)
+        logger.info(f"Catalog synced once for all workers in {time.perf_counter() - start:.1f}s.")
+    # Workers connect to the synced index instead of each wiping and rebuilding it
+    config.CATALOG_SYNC_ON_STARTUP = False
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _spawn_worker(app, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    # Child: drop the master's handlers; uvicorn installs its own for graceful shutdown
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    import uvicorn
+
+    code = 0
+    try:
+        uvicorn.Server(uvicorn.Config(app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)).run(sockets=[sock])
+    except Exception as e:
+        logger.error(f"Worker {os.getpid()} crashed: {e}", exc_info=True)
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def serve(args):
+    preload()
+    from main import app
+
+    sock = _bind(args.host, args.port, args.backlog)
+    # Keep the garbage collector from touching (and so copying) every preloaded object
+    gc.collect()
+    gc.freeze()
+
+    workers = {}
+    stopping = False
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        pid = _spawn_worker(app, sock, args)
+        workers[pid] = time.monotonic()
+    logger.info(f"Master {os.getpid()} serving on {args.host}:{args.port} with {args.workers} workers.")
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        logger.warning(f"Worker {pid} exited with code {os.waitstatus_to_exitcode(status)}; replacing it.")
+        # Back off when workers die right after starting, instead of fork-looping
+        if time.monotonic() - started < 1:
+            time.sleep(1)
+        workers[_spawn_worker(app, sock, args)] = time.monotonic()
+
+    sock.close()
+    logger.info("All workers stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with pre-forked workers sharing preloaded models.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5, help="Idle keep-alive timeout, in seconds.")
+    parser.add_argument("--log-level", default="info")
+    serve(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
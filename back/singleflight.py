@@ -0,0 +1,65 @@
+import logging
+import threading
+from typing import Any, Callable, Hashable
+
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+SHARED_CALLS = counter(
+    "singleflight_shared_total",
+    "Calls that were served by an identical call already in flight.",
+    ("group",),
+)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses identical concurrent calls into one execution.
+    The first caller for a key runs the function; callers arriving while it is
+    still in flight wait for it and receive the same result (or exception).
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            SHARED_CALLS.inc(group=self.name)
+            logger.debug(f"Single-flight '{self.name}': joining in-flight call")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses whitespace so prompts differing only in indentation share a key."""
+    return " ".join(str(prompt).split())
@@ -1,11 +1,16 @@
 import os
-import json
 import uuid
+import base64
+import binascii
 import logging
-from typing import Any, Dict, Optional
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
 
 import mysql.connector
 from dotenv import load_dotenv
+from deadline import remaining, remaining_seconds_ceil
+from metrics import timed
+from serialization import JSONDecodeError, dumps, loads
 
 load_dotenv()
 
@@ -14,15 +19,59 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def get_mysql_connection():
-    """Establishes a connection to the MySQL database."""
+    """
+    Establishes a connection to the MySQL database.
+    Inside a /chat turn the connection is bounded by the turn's remaining budget: the
+    connect and every wait for a reply time out with it, and the server stops SELECTs
+    that run past it (max_execution_time).
+    """
+    options = {}
+    budget = remaining()
+    if budget is not None:
+        timeout = remaining_seconds_ceil()
+        options["connection_timeout"] = timeout
+        options["read_timeout"] = timeout
+        # Sent as part of the connect rather than as a statement of its own
+        options["init_command"] = f"SET SESSION max_execution_time = {max(1, int(budget * 1000))}"
     return mysql.connector.connect(
         host=os.getenv("MYSQL_HOST"),
         user=os.getenv("MYSQL_USER"),
         password=os.getenv("MYSQL_PASSWORD"),
         database=os.getenv("MYSQL_DB"),
+        **options,
     )
 
 
+# user_context columns that hold JSON documents
+CONTEXT_JSON_FIELDS = ["state_history", "shown_recommendations", "selected_policy_details", "chat_history"]
+
+
+def deserialize_context_fields(session_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Decodes the JSON columns of a session row in place, with safe defaults for bad data."""
+    for key in CONTEXT_JSON_FIELDS:
+        if key in session_data and isinstance(session_data.get(key), str):
+            try:
+                session_data[key] = loads(session_data[key])
+            except (JSONDecodeError, TypeError):
+                session_data[key] = [] if 'history' in key else (
+                    {} if 'details' in key else None
+                )
+
+    if not session_data.get("chat_history"):
+        session_data["chat_history"] = []
+
+    return session_data
+
+
+def serialize_context_fields(updates: Dict[str, Any]) -> Dict[str, Any]:
+    """Encodes the JSON columns of a context update in place."""
+    for key in CONTEXT_JSON_FIELDS:
+        if key in updates and not isinstance(updates[key], str):
+            updates[key] = dumps(updates[key])
+    return updates
+
+
+@timed("db")
 def get_mysql_data() -> list[tuple]:
     """Fetches all data from the policy_catalog table."""
     conn = get_mysql_connection()
@@ -35,6 +84,87 @@ def get_mysql_data() -> list[tuple]:
     return data
 
 
+POLICY_CATALOG_COLUMNS = (
+    "policy_id", "policy_name", "provider_name", "policy_type", "coverage_min", "coverage_max",
+    "term_min", "term_max", "premium_min", "premium_max", "age_min", "age_max",
+    "claim_settlement_ratio", "riders", "exclusions", "tax_benefits", "payout_options",
+    "benefits", "claim_process",
+)
+
+
+@timed("db")
+def count_policy_catalog() -> int:
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM policy_catalog")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    conn.close()
+    return count
+
+
+@timed("db")
+def get_catalog_version() -> int:
+    """The version the last catalog sync recorded; 0 before the first one."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return row[0] if row else 0
+
+
+@timed("db")
+def bump_catalog_version() -> int:
+    """Records a completed catalog sync and returns the new version."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO catalog_version (id, version) VALUES (1, LAST_INSERT_ID(1)) "
+        "ON DUPLICATE KEY UPDATE version = LAST_INSERT_ID(version + 1), synced_at = CURRENT_TIMESTAMP"
+    )
+    conn.commit()
+    version = cursor.lastrowid
+    cursor.close()
+    conn.close()
+    return version
+
+
+@timed("db")
+def get_policy_catalog_chunk(after_policy_id: str, limit: int) -> list[Dict[str, Any]]:
+    """Up to `limit` policy_catalog rows, keyed by column name, after the given policy_id."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        f"SELECT {', '.join(POLICY_CATALOG_COLUMNS)} FROM policy_catalog "
+        "WHERE policy_id > %s ORDER BY policy_id LIMIT %s",
+        (after_policy_id, limit),
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+
+def iter_policy_catalog(chunk_size: int = 1000):
+    """
+    Yields the policy_catalog in chunks of up to chunk_size rows, walking the primary
+    key. Each chunk is its own short query, so no connection is held open while the
+    caller embeds the previous one.
+    """
+    after_policy_id = ""
+    while True:
+        rows = get_policy_catalog_chunk(after_policy_id, chunk_size)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after_policy_id = rows[-1]["policy_id"]
+
+
+@timed("db")
 def get_policy_by_id(policy_id: str) -> Optional[Dict[str, Any]]:
     """Fetches a policy from the policy_catalog table by its ID."""
     conn = get_mysql_connection()
@@ -46,6 +176,7 @@ def get_policy_by_id(policy_id: str) -> Optional[Dict[str, Any]]:
     return policy
 
 
+@timed("db")
 def get_policy_by_name(policy_name: str) -> Optional[Dict[str, Any]]:
     """Fetches a policy from the policy_catalog table by its name."""
     conn = get_mysql_connection()
@@ -57,83 +188,85 @@ def get_policy_by_name(policy_name: str) -> Optional[Dict[str, Any]]:
     return policy
 
 
+# One round trip for a returning user. ui.* comes last so its user_id wins over the
+# NULL uc.user_id of a user whose context row does not exist yet.
+_SESSION_QUERY = """
+SELECT uc.*, ui.*
+FROM user_info ui
+LEFT JOIN user_context uc ON uc.user_id = ui.user_id
+WHERE ui.phone_number = %s
+"""
+
+# Whether user_context has the optional chat_history column; the schema does not
+# change while the process runs, so it is checked once.
+_context_has_chat_history: Optional[bool] = None
+
+
+def _has_chat_history_column(cursor) -> bool:
+    global _context_has_chat_history
+    if _context_has_chat_history is None:
+        cursor.execute("SHOW COLUMNS FROM user_context LIKE 'chat_history'")
+        _context_has_chat_history = cursor.fetchone() is not None
+    return _context_has_chat_history
+
+
+def _create_session(cursor, phone_number: str, name: str = None, email: str = None, is_shadow: bool = False):
+    """
+    Creates the user and their context if missing, in a way that is safe when two
+    requests for the same new phone number race: both inserts are upserts, and
+    LAST_INSERT_ID(user_id) hands back the existing id when the user already exists.
+    """
+    cursor.execute(
+        """
+        INSERT INTO user_info (phone_number, name, email, is_shadow) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE user_id = LAST_INSERT_ID(user_id)
+        """,
+        (phone_number, name, email, is_shadow),
+    )
+    user_id = cursor.lastrowid
+
+    default_context = {
+        "user_id": user_id,
+        "context_state": "welcome",
+        "state_history": dumps(["welcome"]),
+    }
+    if _has_chat_history_column(cursor):
+        default_context["chat_history"] = dumps([])
+
+    insert_cols = ", ".join(default_context.keys())
+    placeholders = ", ".join(["%s"] * len(default_context))
+    cursor.execute(
+        f"INSERT INTO user_context ({insert_cols}) VALUES ({placeholders}) "
+        "ON DUPLICATE KEY UPDATE context_id = context_id",
+        tuple(default_context.values()),
+    )
+
+
+@timed("db")
 def get_user_session(phone_number: str, name: str = None, email: str = None) -> Dict[str, Any]:
     """
     Retrieves user and their context in one go. If user doesn't exist, creates them.
-    If user exists, updates their name and email if provided.
-    This function ensures that user creation is committed before proceeding.
+    A returning user costs a single JOIN; a new one adds two upserts and a re-read,
+    committed together.
     """
     conn = get_mysql_connection()
     cursor = conn.cursor(dictionary=True)
-    
+
     try:
-        # Step 1: Find user by phone number
-        cursor.execute("SELECT * FROM user_info WHERE phone_number = %s", (phone_number,))
-        user_info = cursor.fetchone()
+        cursor.execute(_SESSION_QUERY, (phone_number,))
+        session_data = cursor.fetchone()
 
-        # Step 2: User does not exist - Create them
-        if not user_info:
-            cursor.execute(
-                "INSERT INTO user_info (phone_number, name, email) VALUES (%s, %s, %s)",
-                (phone_number, name, email),
-            )
-            conn.commit()  # Commit the new user immediately
-            
-            # Retrieve the newly created user
-            cursor.execute("SELECT * FROM user_info WHERE phone_number = %s", (phone_number,))
-            user_info = cursor.fetchone()
+        # New user, or a user whose context row is missing
+        if not session_data or session_data.get("context_id") is None:
+            _create_session(cursor, phone_number, name, email)
+            conn.commit()
+            cursor.execute(_SESSION_QUERY, (phone_number,))
+            session_data = cursor.fetchone()
 
-        if not user_info:
+        if not session_data:
             raise Exception("Failed to create or retrieve user.")
 
-        user_id = user_info['user_id']
-
-        # Step 3: Fetch or create user context
-        cursor.execute("SELECT * FROM user_context WHERE user_id = %s", (user_id,))
-        user_context = cursor.fetchone()
-
-        if not user_context:
-            # Check for the existence of the chat_history column
-            cursor.execute("SHOW COLUMNS FROM user_context LIKE 'chat_history'")
-            has_chat_history_column = cursor.fetchone() is not None
-
-            default_context = {
-                "user_id": user_id,
-                "context_state": "welcome",
-                "state_history": json.dumps(["welcome"]),
-            }
-            if has_chat_history_column:
-                default_context["chat_history"] = json.dumps([])
-
-            insert_cols = ", ".join(default_context.keys())
-            placeholders = ", ".join(["%s"] * len(default_context))
-            insert_query = f"INSERT INTO user_context ({insert_cols}) VALUES ({placeholders})"
-            
-            cursor.execute(insert_query, tuple(default_context.values()))
-            conn.commit() # Commit the new context
-
-            # Re-fetch the context
-            cursor.execute("SELECT * FROM user_context WHERE user_id = %s", (user_id,))
-            user_context = cursor.fetchone()
-
-        # Step 4: Combine and deserialize data
-        session_data = {**user_info, **user_context}
-        
-        # Deserialize JSON fields
-        json_fields = ["state_history", "shown_recommendations", "selected_policy_details", "chat_history"]
-        for key in json_fields:
-            if key in session_data and isinstance(session_data.get(key), str):
-                try:
-                    session_data[key] = json.loads(session_data[key])
-                except (json.JSONDecodeError, TypeError):
-                    session_data[key] = [] if 'history' in key else (
-                        {} if 'details' in key else None
-                    )
-        
-        if not session_data.get("chat_history"):
-            session_data["chat_history"] = []
-
-        return session_data
+        return deserialize_context_fields(session_data)
 
     except mysql.connector.Error as err:
         print(f"Database error in get_user_session: {err}")
@@ -144,6 +277,26 @@ def get_user_session(phone_number: str, name: str = None, email: str = None) ->
         conn.close()
 
 
+@timed("db")
+def create_shadow_user(phone_number: str):
+    """
+    Creates a user flagged is_shadow, for replayed traffic (see replay.py). Shadow users
+    are left out of the chat_log replay, the funnel rollups and the lead export.
+    """
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    try:
+        _create_session(cursor, phone_number, is_shadow=True)
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db")
 def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
     """Fetches a user by their user_id."""
     conn = get_mysql_connection()
@@ -155,6 +308,7 @@ def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
     return user
 
 
+@timed("db")
 def update_user_info(user_id: int, updates: Dict[str, Any]):
     """Updates the user_info for a given user by their user_id, filtering for valid columns."""
     if not updates:
@@ -162,7 +316,18 @@ def update_user_info(user_id: int, updates: Dict[str, Any]):
 
     conn = get_mysql_connection()
     cursor = conn.cursor()
+    try:
+        _update_user_info(cursor, user_id, updates)
+        conn.commit()
+    except mysql.connector.Error as err:
+        print(f"Error updating user info: {err}")
+        conn.rollback()
+    finally:
+        cursor.close()
+        conn.close()
 
+
+def _update_user_info(cursor, user_id: int, updates: Dict[str, Any]):
     # Get valid column names from the user_info table
     cursor.execute("SHOW COLUMNS FROM user_info")
     valid_columns = {row[0] for row in cursor.fetchall()}
@@ -171,8 +336,6 @@ def update_user_info(user_id: int, updates: Dict[str, Any]):
     filtered_updates = {k: v for k, v in updates.items() if k in valid_columns}
 
     if not filtered_updates:
-        cursor.close()
-        conn.close()
         return
 
     set_clause = ", ".join([f"`{key}` = %s" for key in filtered_updates.keys()])
@@ -180,24 +343,21 @@ def update_user_info(user_id: int, updates: Dict[str, Any]):
     values.append(user_id)
 
     query = f"UPDATE user_info SET {set_clause} WHERE user_id = %s"
-    
-    try:
-        cursor.execute(query, tuple(values))
-        conn.commit()
-    except mysql.connector.Error as err:
-        print(f"Error updating user info: {err}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+    cursor.execute(query, tuple(values))
 
 
-def update_user_context(user_id: int, updates: Dict[str, Any]):
+@timed("db")
+def update_user_context(user_id: int, updates: Dict[str, Any], transitions: Optional[list[tuple]] = None,
+                        writes: Optional[list[tuple]] = None, outbox: Optional[list[tuple]] = None):
     """
     Updates or creates the context for a given user by their user_id.
     This function performs an "UPSERT" operation.
+    In the same transaction, transitions, (from_state, to_state) pairs, are appended to
+    state_transition_event, writes, (kind, payload) pairs, are applied with
+    SIDE_EFFECT_WRITERS, and outbox, (kind, payload) pairs, are queued in outbox_event.
+    Raises if the transaction fails, so the caller does not report a change that was rolled back.
     """
-    if not updates:
+    if not updates and not writes and not outbox:
         return
 
     conn = get_mysql_connection()
@@ -209,72 +369,267 @@ def update_user_context(user_id: int, updates: Dict[str, Any]):
         valid_columns = {row[0] for row in cursor.fetchall()}
 
         # Serialize JSON fields before updating
-        json_fields = ["state_history", "shown_recommendations", "selected_policy_details", "chat_history"]
-        for key in json_fields:
-            if key in updates and not isinstance(updates[key], str):
-                updates[key] = json.dumps(updates[key])
+        serialize_context_fields(updates)
 
         # Filter updates to only include keys that are valid columns
         filtered_updates = {k: v for k, v in updates.items() if k in valid_columns}
 
-        if not filtered_updates:
+        if not filtered_updates and not writes and not outbox:
             return
 
-        # Check if context already exists
-        cursor.execute("SELECT context_id FROM user_context WHERE user_id = %s", (user_id,))
-        context_exists = cursor.fetchone()
-
-        if context_exists:
-            # UPDATE existing context
-            set_clause = ", ".join([f"`{key}` = %s" for key in filtered_updates.keys()])
-            values = list(filtered_updates.values())
-            values.append(user_id)
-            query = f"UPDATE user_context SET {set_clause} WHERE user_id = %s"
-            cursor.execute(query, tuple(values))
-        else:
-            # INSERT new context
-            filtered_updates['user_id'] = user_id
-            columns = ", ".join([f"`{key}`" for key in filtered_updates.keys()])
-            placeholders = ", ".join(["%s"] * len(filtered_updates))
-            values = list(filtered_updates.values())
-            query = f"INSERT INTO user_context ({columns}) VALUES ({placeholders})"
-            cursor.execute(query, tuple(values))
+        if filtered_updates:
+            _upsert_user_context(cursor, user_id, filtered_updates)
+        if transitions:
+            cursor.executemany(
+                "INSERT INTO state_transition_event (user_id, from_state, to_state) VALUES (%s, %s, %s)",
+                [(user_id, from_state, to_state) for from_state, to_state in transitions],
+            )
+        for kind, payload in writes or ():
+            SIDE_EFFECT_WRITERS[kind](cursor, user_id, payload)
+        if outbox:
+            _enqueue_outbox(cursor, user_id, outbox)
 
         conn.commit()
 
     except mysql.connector.Error as err:
         print(f"Error updating user context: {err}")
         conn.rollback()
+        raise
     finally:
         cursor.close()
         conn.close()
 
 
-def create_lead(
+def _upsert_user_context(cursor, user_id: int, filtered_updates: Dict[str, Any]):
+    # Check if context already exists
+    cursor.execute("SELECT context_id FROM user_context WHERE user_id = %s", (user_id,))
+    context_exists = cursor.fetchone()
+
+    if context_exists:
+        # UPDATE existing context
+        set_clause = ", ".join([f"`{key}` = %s" for key in filtered_updates.keys()])
+        values = list(filtered_updates.values())
+        values.append(user_id)
+        query = f"UPDATE user_context SET {set_clause} WHERE user_id = %s"
+        cursor.execute(query, tuple(values))
+    else:
+        # INSERT new context
+        filtered_updates['user_id'] = user_id
+        columns = ", ".join([f"`{key}`" for key in filtered_updates.keys()])
+        placeholders = ", ".join(["%s"] * len(filtered_updates))
+        values = list(filtered_updates.values())
+        query = f"INSERT INTO user_context ({columns}) VALUES ({placeholders})"
+        cursor.execute(query, tuple(values))
+
+
+@timed("db")
+def rollup_state_transitions(batch_size: int, settle_seconds: int) -> int:
+    """
+    Folds the next batch_size state_transition_event rows past the watermark into
+    funnel_hourly and funnel_user_state, advances the watermark and returns how many
+    events it moved past. Events of shadow users (replayed traffic) are passed over
+    without being counted. Everything happens in one transaction holding the watermark
+    row lock, so concurrent callers (one per worker) take turns and no event is counted
+    twice. Events younger than settle_seconds are left for the next run: their ids may
+    still have gaps from transactions that have not committed yet.
+    """
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT IGNORE INTO funnel_rollup_watermark (id, last_event_id) VALUES (1, 0)")
+        cursor.execute("SELECT last_event_id FROM funnel_rollup_watermark WHERE id = 1 FOR UPDATE")
+        last_event_id = cursor.fetchone()[0]
+        cursor.execute(
+            """
+            SELECT e.event_id, e.user_id, e.to_state, e.created_at, COALESCE(ui.is_shadow, 0)
+            FROM state_transition_event e
+            LEFT JOIN user_info ui ON ui.user_id = e.user_id
+            WHERE e.event_id > %s AND e.created_at < NOW() - INTERVAL %s SECOND
+            ORDER BY e.event_id
+            LIMIT %s
+            """,
+            (last_event_id, int(settle_seconds), batch_size),
+        )
+        scanned = cursor.fetchall()
+        if not scanned:
+            conn.commit()
+            return 0
+        events = [row[:4] for row in scanned if not row[4]]
+        if not events:
+            cursor.execute("UPDATE funnel_rollup_watermark SET last_event_id = %s WHERE id = 1", (scanned[-1][0],))
+            conn.commit()
+            return len(scanned)
+
+        # (user_id, state) pairs seen before this batch; a first visit counts as a new user
+        user_ids = sorted({user_id for _, user_id, _, _ in events})
+        placeholders = ", ".join(["%s"] * len(user_ids))
+        cursor.execute(f"SELECT user_id, state FROM funnel_user_state WHERE user_id IN ({placeholders})", user_ids)
+        reached = set(cursor.fetchall())
+
+        hourly: Dict[tuple, list] = {}
+        first_reached = []
+        for _, user_id, state, created_at in events:
+            bucket = hourly.setdefault((created_at.replace(minute=0, second=0, microsecond=0), state), [0, 0])
+            bucket[0] += 1
+            if (user_id, state) not in reached:
+                reached.add((user_id, state))
+                first_reached.append((user_id, state, created_at))
+                bucket[1] += 1
+
+        if first_reached:
+            cursor.executemany(
+                "INSERT INTO funnel_user_state (user_id, state, first_reached_at) VALUES (%s, %s, %s)",
+                first_reached,
+            )
+        cursor.executemany(
+            """
+            INSERT INTO funnel_hourly (bucket_hour, state, entries, new_users) VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE entries = entries + VALUES(entries), new_users = new_users + VALUES(new_users)
+            """,
+            [(bucket_hour, state, entries, new_users) for (bucket_hour, state), (entries, new_users) in hourly.items()],
+        )
+        cursor.execute("UPDATE funnel_rollup_watermark SET last_event_id = %s WHERE id = 1", (scanned[-1][0],))
+        conn.commit()
+        return len(scanned)
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db")
+def get_funnel_totals(start: datetime, end: datetime) -> Dict[str, Dict[str, int]]:
+    """Per-state entries and first-time users between start and end, summed from funnel_hourly."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT state, SUM(entries), SUM(new_users) FROM funnel_hourly
+        WHERE bucket_hour >= %s AND bucket_hour < %s
+        GROUP BY state
+        """,
+        (start, end),
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return {state: {"entries": int(entries), "new_users": int(new_users)} for state, entries, new_users in rows}
+
+
+@timed("db")
+def get_funnel_hourly(state: str, start: datetime, end: datetime) -> list[Dict[str, Any]]:
+    """One state's hourly buckets between start and end, oldest first."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        """
+        SELECT bucket_hour, entries, new_users FROM funnel_hourly
+        WHERE state = %s AND bucket_hour >= %s AND bucket_hour < %s
+        ORDER BY bucket_hour
+        """,
+        (state, start, end),
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+
+def _insert_lead(
+    cursor,
     user_id: int,
     name: str,
     policy_id: Optional[str],
     contact_method: str,
     contact_value: str,
 ):
-    """Creates a new lead in the lead_capture table using user_id."""
-    conn = get_mysql_connection()
-    cursor = conn.cursor()
+    """Creates a new lead in the lead_capture table; applied from the outbox ("lead" writes)."""
     query = """
     INSERT INTO lead_capture (user_id, name, policy_id, contact_method, contact_value)
     VALUES (%s, %s, %s, %s, %s)
     """
     cursor.execute(query, (user_id, name, policy_id, contact_method, contact_value))
-    conn.commit()
+
+
+LEAD_EXPORT_COLUMNS = (
+    "lead_id", "lead_created_at", "user_id", "lead_name", "contact_method", "contact_value", "policy_id",
+    "phone_number", "email", "dob", "gender", "employment_status", "annual_income",
+    "quote_number", "plan_option", "coverage_required", "sum_assured", "total_premium",
+    "premium_frequency", "quote_created_at",
+)
+
+# Each lead with its user and the user's latest quote; the subquery is a seek on the
+# (user_id, created_at) index, which carries quotation_id.
+_LEAD_EXPORT_QUERY = """
+SELECT l.lead_id, l.created_at AS lead_created_at, l.user_id, l.name AS lead_name,
+       l.contact_method, l.contact_value, l.policy_id,
+       ui.phone_number, ui.email, ui.dob, ui.gender, ui.employment_status, ui.annual_income,
+       q.quote_number, q.plan_option, q.coverage_required, q.sum_assured, q.total_premium,
+       q.premium_frequency, q.created_at AS quote_created_at
+FROM lead_capture l
+JOIN user_info ui ON ui.user_id = l.user_id
+LEFT JOIN user_quotations q ON q.quotation_id = (
+    SELECT MAX(quotation_id) FROM user_quotations WHERE user_id = l.user_id
+)
+WHERE l.lead_id > %s AND l.lead_id <= %s AND NOT ui.is_shadow
+ORDER BY l.lead_id
+"""
+
+
+@timed("db")
+def get_max_lead_id(settle_seconds: int = 0) -> int:
+    """
+    The highest lead_id among leads older than settle_seconds. Leads are inserted by
+    concurrent outbox transactions, so a younger id may still have lower ones
+    uncommitted below it.
+    """
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT COALESCE(MAX(lead_id), 0) FROM lead_capture WHERE created_at < NOW() - INTERVAL %s SECOND",
+        (int(settle_seconds),),
+    )
+    max_lead_id = cursor.fetchone()[0]
     cursor.close()
     conn.close()
+    return max_lead_id
+
+
+def stream_lead_export(after_lead_id: int, upto_lead_id: int, chunk_size: int = 1000):
+    """
+    Yields lists of up to chunk_size export rows (dicts keyed by LEAD_EXPORT_COLUMNS)
+    for leads in (after_lead_id, upto_lead_id]. The cursor is unbuffered, so MySQL
+    streams the result and only one chunk is held in memory at a time.
+    """
+    conn = get_mysql_connection()
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    try:
+        cursor.execute(_LEAD_EXPORT_QUERY, (after_lead_id, upto_lead_id))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        # A consumer that stops early leaves unread rows; the connection is discarded either way
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
 
 
+@timed("db")
 def get_chat_history(user_id: int) -> list[tuple]:
     """Fetches the chat history for a given user by their user_id."""
     conn = get_mysql_connection()
     cursor = conn.cursor()
-    query = "SELECT message_type, message FROM chat_log WHERE user_id = %s ORDER BY timestamp ASC"
+    query = "SELECT message_type, message FROM chat_log WHERE user_id = %s ORDER BY timestamp ASC, log_id ASC"
     cursor.execute(query, (user_id,))
     history = cursor.fetchall()
     cursor.close()
@@ -282,6 +637,243 @@ def get_chat_history(user_id: int) -> list[tuple]:
     return history
 
 
+@timed("db")
+def get_conversation_summary(user_id: int) -> tuple[Optional[str], int]:
+    """The user's stored (conversation_summary, summary_log_id)."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT conversation_summary, summary_log_id FROM user_context WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if row is None:
+        return None, 0
+    return row[0], row[1] or 0
+
+
+@timed("db")
+def get_user_messages_after(user_id: int, after_log_id: int, limit: int) -> list[tuple]:
+    """A user's chat_log rows (log_id, message_type, message) after after_log_id, oldest first."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT log_id, message_type, message FROM chat_log "
+        "WHERE user_id = %s AND log_id > %s ORDER BY log_id LIMIT %s",
+        (user_id, after_log_id, limit),
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+
+@timed("db")
+def get_latest_user_messages_after(user_id: int, after_log_id: int, limit: int) -> list[tuple]:
+    """The latest `limit` of a user's chat_log rows (log_id, message_type, message) after after_log_id, oldest first."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT log_id, message_type, message FROM chat_log "
+        "WHERE user_id = %s AND log_id > %s ORDER BY log_id DESC LIMIT %s",
+        (user_id, after_log_id, limit),
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows[::-1]
+
+
+def encode_history_cursor(timestamp: datetime, log_id: int) -> str:
+    """Packs a chat_log position into an opaque, URL-safe cursor."""
+    raw = f"{timestamp.isoformat()}|{log_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> tuple[datetime, int]:
+    """Reverses encode_history_cursor. Raises ValueError for anything it did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, log_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor!r}") from e
+
+
+@timed("db")
+def get_chat_history_page(user_id: int, limit: int, before: Optional[str] = None) -> tuple[list[dict], Optional[str]]:
+    """
+    Fetches the `limit` messages that precede the `before` cursor (or the latest ones),
+    oldest first, plus the cursor for the page before them (None once history is exhausted).
+    Seeks on the (user_id, timestamp, log_id) index, so every page costs the same however
+    long the user's history is.
+    """
+    conn = get_mysql_connection()
+    cursor = conn.cursor(dictionary=True)
+    query = "SELECT log_id, message_type, message, timestamp FROM chat_log WHERE user_id = %s"
+    params = [user_id]
+    if before:
+        before_timestamp, before_log_id = decode_history_cursor(before)
+        query += " AND (timestamp < %s OR (timestamp = %s AND log_id < %s))"
+        params += [before_timestamp, before_timestamp, before_log_id]
+    # One extra row tells whether an older page exists
+    query += " ORDER BY timestamp DESC, log_id DESC LIMIT %s"
+    params.append(limit + 1)
+    cursor.execute(query, tuple(params))
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_history_cursor(rows[-1]["timestamp"], rows[-1]["log_id"]) if has_more else None
+    messages = [
+        {"type": row["message_type"], "text": row["message"], "timestamp": row["timestamp"].isoformat()}
+        for row in reversed(rows)
+    ]
+    return messages, next_cursor
+
+
+@timed("db")
+def get_user_id_by_phone(phone_number: str) -> Optional[int]:
+    """Looks up a user_id without creating the user."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id FROM user_info WHERE phone_number = %s", (phone_number,))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return row[0] if row else None
+
+
+@timed("db")
+def get_recent_quotation(user_id: int, input_hash: str, max_age_seconds: int) -> Optional[Dict[str, Any]]:
+    """
+    Returns the stored response of the newest quote for the same inputs created within
+    max_age_seconds, or None. Served by idx_user_quotations_user_input.
+    """
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    query = """
+    SELECT quote_response FROM user_quotations
+    WHERE user_id = %s AND input_hash = %s AND created_at >= NOW() - INTERVAL %s SECOND
+    ORDER BY created_at DESC
+    LIMIT 1
+    """
+    try:
+        cursor.execute(query, (user_id, input_hash, int(max_age_seconds)))
+        row = cursor.fetchone()
+    except mysql.connector.Error as err:
+        logger.error(f"Error reading recent quotation for user {user_id}: {err}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+    if not row or row[0] is None:
+        return None
+    try:
+        return loads(row[0])
+    except JSONDecodeError:
+        logger.warning(f"Discarding unreadable stored quote for user {user_id}")
+        return None
+
+
+@timed("db")
+def get_chat_log_chunk(after_user_id: int, after_log_id: int, limit: int,
+                       max_log_id: Optional[int] = None) -> list[tuple]:
+    """
+    Fetches up to `limit` chat_log rows ordered by (user_id, log_id), starting after the given position.
+    Keyset pagination: the user_id index carries log_id, so every chunk is a short range scan
+    however far into the table the caller has got. Shadow users' messages are left out, so
+    a replay never replays an earlier replay.
+    """
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    query = """
+    SELECT c.log_id, c.user_id, c.message_type, c.message, c.timestamp FROM chat_log c
+    JOIN user_info ui ON ui.user_id = c.user_id
+    WHERE (c.user_id > %s OR (c.user_id = %s AND c.log_id > %s)) AND NOT ui.is_shadow
+    """
+    params = [after_user_id, after_user_id, after_log_id]
+    if max_log_id is not None:
+        query += " AND c.log_id <= %s"
+        params.append(max_log_id)
+    query += " ORDER BY c.user_id, c.log_id LIMIT %s"
+    params.append(limit)
+    cursor.execute(query, tuple(params))
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+
+@timed("db")
+def count_chat_log_users(max_log_id: int) -> int:
+    """How many users have messages up to max_log_id; an upper bound on a replay's conversations."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(DISTINCT user_id) FROM chat_log WHERE log_id <= %s", (max_log_id,))
+    (users,) = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return users
+
+
+@timed("db")
+def get_max_chat_log_id() -> int:
+    """Returns the highest log_id in chat_log, or 0 when it is empty."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(log_id), 0) FROM chat_log")
+    (max_log_id,) = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return max_log_id
+
+
+@timed("db")
+def get_chat_log_before(cutoff: datetime, after_log_id: int, limit: int) -> list[Dict[str, Any]]:
+    """
+    Fetches up to `limit` chat_log rows older than `cutoff` with log_id above `after_log_id`.
+    Walks the primary key from the oldest row, so no timestamp index is needed.
+    """
+    conn = get_mysql_connection()
+    cursor = conn.cursor(dictionary=True)
+    query = """
+    SELECT log_id, user_id, message_type, message, timestamp FROM chat_log
+    WHERE log_id > %s AND timestamp < %s
+    ORDER BY log_id LIMIT %s
+    """
+    cursor.execute(query, (after_log_id, cutoff, limit))
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+
+@timed("db")
+def delete_chat_log_rows(log_ids: list[int]) -> int:
+    """Deletes the given chat_log rows and returns how many were removed."""
+    if not log_ids:
+        return 0
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    placeholders = ", ".join(["%s"] * len(log_ids))
+    try:
+        cursor.execute(f"DELETE FROM chat_log WHERE log_id IN ({placeholders})", tuple(log_ids))
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+    except mysql.connector.Error as err:
+        print(f"Error deleting archived chat_log rows: {err}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db")
 def log_chat_message(user_id: int, message_type: str, message: Any):
     """Logs a message to the chat_log table using user_id."""
     conn = get_mysql_connection()
@@ -289,7 +881,7 @@ def log_chat_message(user_id: int, message_type: str, message: Any):
 
     # Convert dicts/lists to JSON strings
     if isinstance(message, (dict, list)):
-        message = json.dumps(message)
+        message = dumps(message)
 
     query = "INSERT INTO chat_log (user_id, message_type, message) VALUES (%s, %s, %s)"
     cursor.execute(query, (user_id, message_type, message))
@@ -299,6 +891,7 @@ def log_chat_message(user_id: int, message_type: str, message: Any):
 
 
 
+@timed("db")
 def get_user_info_for_quote(user_id: int) -> Optional[Dict[str, Any]]:
     """
     Fetches user information from the user_info table required for a premium quote.
@@ -341,6 +934,7 @@ def get_user_info_for_quote(user_id: int) -> Optional[Dict[str, Any]]:
         conn.close()
 
 
+@timed("db")
 def keyword_search_policies(query: str) -> list[Dict[str, Any]]:
     """Performs a keyword search on policy names and descriptions."""
     conn = get_mysql_connection()
@@ -358,11 +952,13 @@ def keyword_search_policies(query: str) -> list[Dict[str, Any]]:
     return policies
 
 
-def save_quotation_details(user_id: int, quote_data: Dict[str, Any]):
-    """Saves the user's quotation details to the user_quotations table."""
-    conn = get_mysql_connection()
-    cursor = conn.cursor()
-
+def _insert_quotation(cursor, user_id: int, quote_data: Dict[str, Any], input_hash: Optional[str] = None,
+                      quote_response: Optional[Dict[str, Any]] = None):
+    """
+    Saves the user's quotation details to the user_quotations table; applied with the
+    context update that shows the quote ("quotation" writes).
+    input_hash and quote_response let get_recent_quotation serve a resubmission of the same form.
+    """
     # Prepare the data for insertion
     # Ensure all keys match the column names in the user_quotations table
     columns = [
@@ -375,17 +971,196 @@ def save_quotation_details(user_id: int, quote_data: Dict[str, Any]):
     
     # Extract values from quote_data, providing defaults for missing keys
     values = [user_id] + [quote_data.get(col) for col in columns[1:]]
+    if input_hash is not None:
+        columns += ['input_hash', 'quote_response']
+        values += [input_hash, dumps(quote_response) if quote_response is not None else None]
 
     # Create the SQL query
     placeholders = ", ".join(["%s"] * len(columns))
     insert_query = f"INSERT INTO user_quotations ({', '.join(columns)}) VALUES ({placeholders})"
+    cursor.execute(insert_query, tuple(values))
+
+
+# --- Side-effect writes: applied with a context update, or queued for outbox.py workers ---
+
+def _apply_user_info(cursor, user_id: int, payload: Dict[str, Any]):
+    _update_user_info(cursor, user_id, payload["updates"])
+
+
+def _apply_lead(cursor, user_id: int, payload: Dict[str, Any]):
+    _insert_lead(cursor, user_id, payload.get("name"), payload.get("policy_id"),
+                 payload["contact_method"], payload["contact_value"])
+
+
+def _apply_quotation(cursor, user_id: int, payload: Dict[str, Any]):
+    _insert_quotation(cursor, user_id, payload["quote_data"], payload.get("input_hash"), payload.get("quote_response"))
 
+
+# Write kind -> function applying its payload with the cursor of the transaction it belongs to
+SIDE_EFFECT_WRITERS: Dict[str, Callable[[Any, int, Dict[str, Any]], None]] = {
+    "user_info": _apply_user_info,
+    "lead": _apply_lead,
+    "quotation": _apply_quotation,
+}
+
+# Kinds that may be deferred to the outbox. user_info and quotation are read back right
+# after the turn (recommendations, pricing, the quote reuse check), so they are always
+# written with the context update instead.
+OUTBOX_KINDS = ("lead",)
+
+# Errors that mean the connection, not the event, is broken; the whole batch is left for a retry
+_CONNECTION_ERRORS = (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError)
+
+
+def _enqueue_outbox(cursor, user_id: int, events: list[tuple]):
+    for kind, _ in events:
+        if kind not in OUTBOX_KINDS:
+            raise ValueError(f"'{kind}' writes cannot go through the outbox.")
+    cursor.executemany(
+        "INSERT INTO outbox_event (user_id, kind, payload) VALUES (%s, %s, %s)",
+        [(user_id, kind, dumps(payload)) for kind, payload in events],
+    )
+
+
+@timed("db")
+def apply_outbox_batch(limit: int, max_attempts: int, retry_delay: Callable[[int], float]) -> list[tuple[str, str]]:
+    """
+    Claims up to limit due outbox events and applies them in one transaction, so an
+    event is marked done exactly when its write commits. Rows claimed by another worker
+    are skipped. Each event runs under a savepoint: a failing one is rolled back alone
+    and retried retry_delay(attempts) seconds later, or marked dead after max_attempts.
+    Returns a (kind, outcome) pair per claimed event; outcome is applied, retried or dead.
+    """
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
     try:
-        cursor.execute(insert_query, tuple(values))
+        cursor.execute(
+            """
+            SELECT event_id, user_id, kind, payload, attempts FROM outbox_event
+            WHERE status = 'pending' AND available_at <= NOW()
+            ORDER BY event_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            (limit,),
+        )
+        events = cursor.fetchall()
+
+        results = []
+        for event_id, user_id, kind, payload, attempts in events:
+            attempts += 1
+            cursor.execute("SAVEPOINT outbox_event")
+            try:
+                writer = SIDE_EFFECT_WRITERS.get(kind)
+                if writer is None:
+                    raise ValueError(f"Unknown outbox event kind: {kind}")
+                writer(cursor, user_id, loads(payload))
+            except _CONNECTION_ERRORS:
+                raise
+            except Exception as err:
+                cursor.execute("ROLLBACK TO SAVEPOINT outbox_event")
+                dead = attempts >= max_attempts or kind not in SIDE_EFFECT_WRITERS
+                cursor.execute(
+                    """
+                    UPDATE outbox_event
+                    SET status = %s, attempts = %s, last_error = %s,
+                        available_at = NOW() + INTERVAL %s SECOND,
+                        processed_at = IF(%s, NOW(), NULL)
+                    WHERE event_id = %s
+                    """,
+                    ("dead" if dead else "pending", attempts, f"{type(err).__name__}: {err}"[:2000],
+                     0 if dead else max(1, round(retry_delay(attempts))), dead, event_id),
+                )
+                results.append((kind, "dead" if dead else "retried"))
+                continue
+            cursor.execute(
+                "UPDATE outbox_event SET status = 'done', attempts = %s, processed_at = NOW() WHERE event_id = %s",
+                (attempts, event_id),
+            )
+            results.append((kind, "applied"))
+
         conn.commit()
-    except mysql.connector.Error as err:
-        print(f"Error saving quotation details: {err}")
+        return results
+    except mysql.connector.Error:
         conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db")
+def count_outbox_events() -> Dict[str, int]:
+    """Outbox rows per status."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM outbox_event GROUP BY status")
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return {status: int(count) for status, count in rows}
+
+
+@timed("db")
+def get_dead_outbox_events(limit: int) -> list[Dict[str, Any]]:
+    """The most recent dead-lettered events, newest first."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        """
+        SELECT event_id, user_id, kind, attempts, last_error, created_at, processed_at FROM outbox_event
+        WHERE status = 'dead'
+        ORDER BY event_id DESC
+        LIMIT %s
+        """,
+        (limit,),
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+
+@timed("db")
+def requeue_dead_outbox_events(event_ids: Optional[list[int]] = None) -> int:
+    """Puts dead events (all of them, or the given ids) back in the queue with a fresh attempt count."""
+    query = """
+        UPDATE outbox_event
+        SET status = 'pending', attempts = 0, available_at = NOW(), processed_at = NULL
+        WHERE status = 'dead'
+    """
+    params: tuple = ()
+    if event_ids:
+        query += f" AND event_id IN ({', '.join(['%s'] * len(event_ids))})"
+        params = tuple(event_ids)
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db")
+def delete_done_outbox_events(older_than_seconds: int, limit: int) -> int:
+    """Deletes up to limit applied events processed more than older_than_seconds ago."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            DELETE FROM outbox_event
+            WHERE status = 'done' AND processed_at < NOW() - INTERVAL %s SECOND
+            ORDER BY event_id
+            LIMIT %s
+            """,
+            (int(older_than_seconds), limit),
+        )
+        conn.commit()
+        return cursor.rowcount
     finally:
         cursor.close()
         conn.close()
@@ -0,0 +1,113 @@
+"""
+Declarative engine for the conversation flow.
+
+States are declared once as a table of State entries and compiled into a lookup
+when the module that defines the flow is imported. A handler moves the conversation
+on by setting `context_state`; if it does so without producing an answer, the
+engine enters the next state and runs that state's handler in the same loop, so
+chained steps (one onboarding answer -> the next question, or the last one -> the
+recommendation) need no handler-to-handler recursion.
+
+All context writes made during one dispatch are flushed to MySQL once at the end,
+and each hop is timed, counted per transition and kept on the bot as a trace.
+"""
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from metrics import counter, handler_scope
+
+logger = logging.getLogger(__name__)
+
+TRANSITIONS = counter(
+    "chatbot_state_transitions_total",
+    "Conversation state changes made by the state machine.",
+    ("from_state", "to_state"),
+)
+
+Handler = Callable[[Any, Any], Dict[str, Any]]
+Action = Callable[[Any, str, str], None]
+
+
+@dataclass(frozen=True)
+class State:
+    """
+    One conversation state.
+
+    entry_query is what the handler receives when the engine enters the state on
+    a chained transition (the user's own text only goes to the first handler).
+    on_enter / on_exit run when a transition enters or leaves the state, with
+    (bot, from_state, to_state).
+    """
+    name: str
+    handler: Handler
+    entry_query: str = ""
+    on_enter: Optional[Action] = None
+    on_exit: Optional[Action] = None
+
+
+class StateMachine:
+    def __init__(self, states: Iterable[State], default: str):
+        self._states: Dict[str, State] = {}
+        for state in states:
+            if state.name in self._states:
+                raise ValueError(f"State '{state.name}' is declared twice.")
+            self._states[state.name] = state
+        if default not in self._states:
+            raise ValueError(f"Default state '{default}' is not declared.")
+        self.default = default
+        # Every state can be visited at most once per dispatch
+        self.max_hops = len(self._states)
+
+    def state(self, name: Optional[str]) -> State:
+        """The declared state, or the default one for unknown and missing names."""
+        return self._states.get(name) or self._states[self.default]
+
+    def handler_for(self, name: str) -> Optional[Handler]:
+        state = self._states.get(name)
+        return state.handler if state else None
+
+    def dispatch(self, bot, state_name: Optional[str], query: Any) -> Dict[str, Any]:
+        """
+        Runs the handler for state_name, then follows transitions that come back
+        without an answer. Returns the first non-empty response, or {} when a
+        handler neither answers nor moves the conversation on.
+        """
+        trace: List[dict] = []
+        bot.last_dispatch_trace = trace
+        response: Dict[str, Any] = {}
+        with bot.batched_context_writes():
+            for _ in range(self.max_hops):
+                state = self.state(state_name)
+                start = time.perf_counter()
+                with handler_scope(state.handler.__name__, state_name or state.name):
+                    response = state.handler(bot, query) or {}
+                next_name = bot.context.get("context_state")
+                trace.append({
+                    "state": state_name,
+                    "handler": state.handler.__name__,
+                    "ms": round((time.perf_counter() - start) * 1000, 2),
+                    "next_state": next_name,
+                })
+
+                if next_name == state_name:
+                    break
+                self._transition(bot, state_name, next_name)
+                if response:
+                    break
+                state_name, query = next_name, self.state(next_name).entry_query
+            else:
+                logger.warning(f"State machine stopped after {self.max_hops} chained transitions: {trace}")
+
+        logger.debug(f"Dispatch trace: {trace}")
+        return response
+
+    def _transition(self, bot, from_name: Optional[str], to_name: Optional[str]):
+        TRANSITIONS.inc(from_state=from_name, to_state=to_name)
+        leaving = self._states.get(from_name)
+        if leaving and leaving.on_exit:
+            leaving.on_exit(bot, from_name, to_name)
+        entering = self._states.get(to_name)
+        if entering and entering.on_enter:
+            entering.on_enter(bot, from_name, to_name)
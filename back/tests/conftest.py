@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The backend modules import each other as top-level modules (run from back/)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Local stand-ins, so importing config never reaches for a real LLM, model or index
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ.setdefault("VECTORSTORE_PROVIDER", "memory")
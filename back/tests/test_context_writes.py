@@ -0,0 +1,72 @@
+import mysql.connector
+import pytest
+
+import cbot
+import sqlconnect
+from cbot import ImprovedChatBot
+from test_outbox import FakeConnection
+
+
+def make_bot(monkeypatch, persisted):
+    def update_user_context(user_id, updates, transitions=None, writes=None, outbox=None):
+        if updates.get("context_state") == "broken":
+            raise mysql.connector.errors.DatabaseError("Deadlock found when trying to get lock")
+        persisted.append((updates, transitions, writes, outbox))
+
+    monkeypatch.setattr(cbot, "update_user_context", update_user_context)
+    bot = ImprovedChatBot.__new__(ImprovedChatBot)
+    bot.user_id = 7
+    bot.context = {"context_state": "email_capture"}
+    bot.memory = ImprovedChatBot._create_memory()
+    return bot
+
+
+def test_batch_is_written_once_with_its_side_effects(monkeypatch):
+    persisted = []
+    bot = make_bot(monkeypatch, persisted)
+
+    with bot.batched_context_writes():
+        bot._update_context({"context_state": "follow_up"})
+        bot.write_with_context("user_info", {"updates": {"name": "Asha"}})
+        bot.enqueue_side_effect("lead", {"contact_value": "asha@example.com"})
+
+    (updates, transitions, writes, side_effects), = persisted
+    assert updates["context_state"] == "follow_up"
+    assert transitions == [("email_capture", "follow_up")]
+    assert writes == [("user_info", {"updates": {"name": "Asha"}})]
+    assert side_effects == [("lead", {"contact_value": "asha@example.com"})]
+
+
+def test_failed_write_is_raised_and_the_context_restored(monkeypatch):
+    bot = make_bot(monkeypatch, [])
+
+    with pytest.raises(mysql.connector.Error):
+        with bot.batched_context_writes():
+            bot._update_context({"context_state": "broken"})
+            bot.enqueue_side_effect("lead", {})
+
+    assert bot.context["context_state"] == "email_capture"
+
+
+def test_side_effects_need_a_batch(monkeypatch):
+    bot = make_bot(monkeypatch, [])
+
+    with pytest.raises(RuntimeError):
+        bot.enqueue_side_effect("lead", {})
+
+
+def test_update_user_context_raises_after_rollback(monkeypatch):
+    conn = FakeConnection([])
+
+    def execute(sql, params=None):
+        if sql.startswith("SHOW COLUMNS"):
+            return
+        raise mysql.connector.errors.DatabaseError("Lock wait timeout exceeded")
+
+    conn.cursor().execute = execute
+    conn.cursor().fetchall = lambda: [("context_state",)]
+    monkeypatch.setattr(sqlconnect, "get_mysql_connection", lambda: conn)
+
+    with pytest.raises(mysql.connector.Error):
+        sqlconnect.update_user_context(7, {"context_state": "follow_up"})
+    assert conn.rolled_back and not conn.committed
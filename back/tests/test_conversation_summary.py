@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+import conversation_summary
+import sqlconnect
+
+LOG = [(i, "user" if i % 2 else "bot", f"message {i}") for i in range(1, 15)]
+
+
+def bot_with(monkeypatch, summary, summary_log_id):
+    def latest(user_id, after_log_id, limit):
+        return [row for row in LOG if row[0] > after_log_id][-limit:]
+
+    monkeypatch.setattr(sqlconnect, "get_latest_user_messages_after", latest)
+    return SimpleNamespace(user_id=7, context={"conversation_summary": summary, "summary_log_id": summary_log_id})
+
+
+def test_every_unfolded_message_is_shown(monkeypatch):
+    history = conversation_summary.prompt_history(bot_with(monkeypatch, "Wants term cover.", 4))
+
+    assert history.startswith("Summary of the earlier conversation: Wants term cover.")
+    assert "message 4" not in history
+    for i in range(5, 15):
+        assert f"message {i}" in history
+
+
+def test_before_the_first_fold_the_whole_log_is_shown(monkeypatch):
+    history = conversation_summary.prompt_history(bot_with(monkeypatch, None, None))
+
+    assert history.splitlines()[0] == "user: message 1"
+    assert len(history.splitlines()) == len(LOG)
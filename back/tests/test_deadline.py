@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+import deadline
+from deadline import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    call_with_deadline,
+    remaining,
+    turn_budget,
+)
+
+
+def fail():
+    raise RuntimeError("upstream down")
+
+
+def test_breaker_opens_after_the_threshold():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            call_with_deadline(fail, stage="test", breaker=breaker)
+
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        call_with_deadline(lambda: "ok", stage="test", breaker=breaker)
+
+
+def test_half_open_lets_one_trial_through(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(deadline.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+
+    now[0] += 30
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_reopens_the_circuit(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(deadline.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+
+    now[0] += 30
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_call_stops_waiting_when_the_budget_runs_out():
+    with turn_budget(0.05):
+        with pytest.raises(DeadlineExceeded):
+            call_with_deadline(time.sleep, 1, stage="test")
+
+
+def test_spent_budget_skips_the_call():
+    calls = []
+    with turn_budget(0):
+        with pytest.raises(DeadlineExceeded):
+            call_with_deadline(calls.append, 1, stage="test")
+    assert calls == []
+
+
+def test_budget_is_scoped_to_the_block():
+    assert remaining() is None
+    with turn_budget(5):
+        assert 0 < remaining() <= 5
+        assert call_with_deadline(remaining, stage="test") > 0
+    assert remaining() is None
+
+
+def test_a_timeout_from_a_spent_budget_does_not_trip_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    with turn_budget(0.02):
+        with pytest.raises(DeadlineExceeded):
+            call_with_deadline(time.sleep, 0.1, stage="test", breaker=breaker)
+
+    # The call itself succeeds once it is done sleeping
+    time.sleep(0.2)
+    assert breaker.state == "closed"
+
+
+def test_failures_under_a_budget_still_count():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    with turn_budget(5):
+        with pytest.raises(RuntimeError):
+            call_with_deadline(fail, stage="test", breaker=breaker)
+
+    deadline_passed = time.monotonic() + 1
+    while breaker.state != "open" and time.monotonic() < deadline_passed:
+        time.sleep(0.01)
+    assert breaker.state == "open"
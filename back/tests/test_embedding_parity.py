@@ -0,0 +1,30 @@
+"""The int8 ONNX embeddings must stay interchangeable with the PyTorch ones they replace."""
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("langchain_huggingface")
+
+from benchmarks.embedding_backends import build_corpus, parity
+from pinecone_handler import load_embeddings
+
+MODEL_DIR = os.getenv("ONNX_EMBEDDING_MODEL_DIR", "models/bge-small-en-v1.5-onnx-int8")
+
+
+@pytest.mark.skipif(not os.path.isdir(MODEL_DIR), reason=f"no exported ONNX model in {MODEL_DIR}")
+def test_onnx_matches_torch():
+    documents, queries = build_corpus(64, 32)
+    onnx = load_embeddings("onnx")
+    torch = load_embeddings("huggingface")
+
+    result = parity(
+        np.array(onnx.embed_documents(documents)),
+        np.array(torch.embed_documents(documents)),
+        np.array(onnx.embed_documents(queries)),
+        np.array(torch.embed_documents(queries)),
+    )
+
+    assert result["min_cosine"] >= 0.99
+    assert result["top1_agreement"] >= 0.98
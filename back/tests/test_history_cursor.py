@@ -0,0 +1,17 @@
+from datetime import datetime
+
+import pytest
+
+from sqlconnect import decode_history_cursor, encode_history_cursor
+
+
+def test_roundtrip():
+    timestamp = datetime(2025, 3, 14, 9, 26, 53, 589793)
+
+    assert decode_history_cursor(encode_history_cursor(timestamp, 42)) == (timestamp, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "!!!", encode_history_cursor(datetime(2025, 1, 1), 1)[:-3]])
+def test_rejects_cursors_it_did_not_produce(cursor):
+    with pytest.raises(ValueError):
+        decode_history_cursor(cursor)
@@ -0,0 +1,105 @@
+import mysql.connector
+import pytest
+
+import outbox
+import sqlconnect
+from serialization import dumps
+
+
+class FakeCursor:
+    def __init__(self, events):
+        self.events = events
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((" ".join(sql.split()), params))
+
+    def fetchall(self):
+        return self.events
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, events):
+        self._cursor = FakeCursor(events)
+        self.committed = self.rolled_back = False
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        pass
+
+
+def event(event_id, kind="lead", attempts=0):
+    return (event_id, 7, kind, dumps({"event": event_id}), attempts)
+
+
+def status_updates(cursor):
+    return [params for sql, params in cursor.statements if sql.startswith("UPDATE outbox_event")]
+
+
+@pytest.fixture
+def applied(monkeypatch):
+    payloads = []
+
+    def write_lead(cursor, user_id, payload):
+        if payload["event"] in (2, 3):
+            raise RuntimeError("insert failed")
+        payloads.append(payload)
+
+    monkeypatch.setitem(sqlconnect.SIDE_EFFECT_WRITERS, "lead", write_lead)
+    return payloads
+
+
+def test_batch_applies_retries_and_dead_letters(monkeypatch, applied):
+    conn = FakeConnection([event(1), event(2), event(3, attempts=2), event(4, kind="fax")])
+    monkeypatch.setattr(sqlconnect, "get_mysql_connection", lambda: conn)
+
+    results = sqlconnect.apply_outbox_batch(limit=10, max_attempts=3, retry_delay=lambda attempts: 5)
+
+    assert results == [("lead", "applied"), ("lead", "retried"), ("lead", "dead"), ("fax", "dead")]
+    assert applied == [{"event": 1}]
+    assert conn.committed
+    done, retried, dead, unknown = status_updates(conn.cursor())
+    assert done == (1, 1)
+    assert retried[:2] == ("pending", 1) and retried[3] == 5
+    assert dead[:2] == ("dead", 3)
+    # An unknown kind never succeeds, so it is not retried
+    assert unknown[:2] == ("dead", 1)
+
+
+def test_connection_errors_leave_the_batch_pending(monkeypatch):
+    def lost(cursor, user_id, payload):
+        raise mysql.connector.errors.OperationalError("Lost connection to MySQL server")
+
+    conn = FakeConnection([event(1)])
+    monkeypatch.setattr(sqlconnect, "get_mysql_connection", lambda: conn)
+    monkeypatch.setitem(sqlconnect.SIDE_EFFECT_WRITERS, "lead", lost)
+
+    with pytest.raises(mysql.connector.errors.OperationalError):
+        sqlconnect.apply_outbox_batch(limit=10, max_attempts=3, retry_delay=lambda attempts: 5)
+
+    assert conn.rolled_back and not conn.committed
+    assert status_updates(conn.cursor()) == []
+
+
+def test_only_outbox_kinds_can_be_queued():
+    with pytest.raises(ValueError):
+        sqlconnect._enqueue_outbox(FakeCursor([]), 7, [("user_info", {"updates": {}})])
+
+
+def test_retry_delay_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr(outbox.random, "random", lambda: 0.5)
+
+    assert outbox.retry_delay(1) == outbox.OUTBOX_BASE_BACKOFF_S
+    assert outbox.retry_delay(3) == outbox.OUTBOX_BASE_BACKOFF_S * 4
+    assert outbox.retry_delay(100) == outbox.OUTBOX_MAX_BACKOFF_S
@@ -0,0 +1,87 @@
+import pytest
+
+import retrieval_cache
+from retrieval_cache import RetrievalCache, normalize_query
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retrieval_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_hit_and_miss():
+    cache = RetrievalCache(max_entries=4, ttl_s=60)
+
+    assert cache.get("q") is None
+    cache.put("q", ["doc"])
+    assert cache.get("q") == ["doc"]
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = RetrievalCache(max_entries=4, ttl_s=60)
+    cache.put("q", ["doc"])
+
+    clock[0] += 59
+    assert cache.get("q") == ["doc"]
+    clock[0] += 2
+    assert cache.get("q") is None
+
+
+def test_evicts_the_least_recently_used():
+    cache = RetrievalCache(max_entries=2, ttl_s=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_put_after_a_clear_is_dropped():
+    cache = RetrievalCache(max_entries=4, ttl_s=60)
+    generation = cache.generation
+    cache.clear()
+    cache.put("q", ["stale"], generation=generation)
+
+    assert cache.get("q") is None
+    cache.put("q", ["fresh"], generation=cache.generation)
+    assert cache.get("q") == ["fresh"]
+
+
+def test_a_new_catalog_version_empties_the_cache(clock):
+    versions = [1]
+    cache = RetrievalCache(max_entries=4, ttl_s=600, version_source=lambda: versions[0], version_check_s=30)
+    cache.get("warmup")
+    cache.put("q", ["v1"])
+
+    versions[0] = 2
+    clock[0] += 10
+    assert cache.get("q") == ["v1"]  # not re-checked yet
+    clock[0] += 30
+    assert cache.get("q") is None
+
+
+def test_invalidate_rechecks_the_version():
+    calls = []
+    cache = RetrievalCache(max_entries=4, ttl_s=600, version_source=lambda: calls.append(1) or 1, version_check_s=30)
+    cache.get("q")
+    cache.put("q", ["doc"])
+    cache.invalidate()
+
+    assert cache.get("q") is None
+    assert len(calls) == 2
+
+
+def test_disabled_cache_stores_nothing():
+    cache = RetrievalCache(max_entries=0, ttl_s=60)
+    cache.put("q", ["doc"])
+
+    assert cache.get("q") is None
+
+
+def test_normalize_query():
+    assert normalize_query("  Term   PLAN\tfor me ") == "term plan for me"
@@ -0,0 +1,56 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(flight.do, "key", slow) for _ in range(4)]
+        while not flight._calls:
+            pass
+        # Let the followers reach the wait before the leader finishes
+        threading.Event().wait(0.1)
+        release.set()
+        results = [f.result(timeout=5) for f in futures]
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(flight.do, "key", failing) for _ in range(3)]
+        threading.Event().wait(0.1)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=5)
+
+
+def test_nothing_is_cached_after_the_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    flight.do("key", calls.append, 1)
+    flight.do("key", calls.append, 2)
+
+    assert calls == [1, 2]
@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+
+import pytest
+
+from state_machine import State, StateMachine
+
+
+class Bot:
+    def __init__(self, state):
+        self.context = {"context_state": state}
+        self.writes = 0
+
+    @contextmanager
+    def batched_context_writes(self):
+        yield
+        self.writes += 1
+
+
+def advance(to_state, answer=None):
+    def handler(bot, query):
+        bot.context["context_state"] = to_state
+        bot.context.setdefault("queries", []).append(query)
+        return {"answer": answer} if answer else {}
+    handler.__name__ = f"to_{to_state}"
+    return handler
+
+
+def test_chains_transitions_without_answers():
+    events = []
+    machine = StateMachine([
+        State("a", advance("b")),
+        State("b", advance("c"), entry_query="entered b",
+              on_enter=lambda bot, frm, to: events.append(("enter", frm, to))),
+        State("c", advance("c", answer="done")),
+    ], default="a")
+    bot = Bot("a")
+
+    response = machine.dispatch(bot, "a", "hello")
+
+    assert response == {"answer": "done"}
+    assert bot.context["context_state"] == "c"
+    # Only the first handler sees the user's text; chained ones get their entry_query
+    assert bot.context["queries"] == ["hello", "entered b", ""]
+    assert events == [("enter", "a", "b")]
+    assert [hop["state"] for hop in bot.last_dispatch_trace] == ["a", "b", "c"]
+    assert bot.writes == 1
+
+
+def test_stops_at_the_first_answer():
+    machine = StateMachine([
+        State("a", advance("b", answer="first")),
+        State("b", advance("b", answer="second")),
+    ], default="a")
+    bot = Bot("a")
+
+    assert machine.dispatch(bot, "a", "x") == {"answer": "first"}
+    assert bot.context["context_state"] == "b"
+
+
+def test_unknown_state_runs_the_default():
+    machine = StateMachine([State("a", advance("a", answer="default"))], default="a")
+
+    assert machine.dispatch(Bot(None), "nowhere", "x") == {"answer": "default"}
+    assert machine.handler_for("nowhere") is None
+
+
+def test_cycles_are_bounded():
+    machine = StateMachine([State("a", advance("b")), State("b", advance("a"))], default="a")
+    bot = Bot("a")
+
+    assert machine.dispatch(bot, "a", "x") == {}
+    assert len(bot.last_dispatch_trace) == machine.max_hops
+
+
+def test_rejects_bad_declarations():
+    with pytest.raises(ValueError):
+        StateMachine([State("a", advance("a")), State("a", advance("a"))], default="a")
+    with pytest.raises(ValueError):
+        StateMachine([State("a", advance("a"))], default="b")